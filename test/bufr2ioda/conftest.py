@@ -0,0 +1,22 @@
+# conftest.py
+# the helper modules of the bufr2ioda converters are imported from ush/ioda/bufr2ioda.
+# The bufr and ioda bindings are not installed outside of a JEDI build: they are
+# replaced by empty modules, and a test that needs them sets its own
+import importlib
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ush', 'ioda', 'bufr2ioda'))
+
+for name in ('pyiodaconv.bufr', 'pyioda.ioda_obs_space'):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        parent = None
+        for i, part in enumerate(name.split('.')):
+            full_name = '.'.join(name.split('.')[:i + 1])
+            module = sys.modules.setdefault(full_name, types.ModuleType(full_name))
+            if parent is not None:
+                setattr(parent, part, module)
+            parent = module
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# prepbufr_loops.py
+# the per-observation loops the prepbufr converters used, the reference the
+# tests check the shared kernels of ush/ioda/bufr2ioda against.
+# Run as a script it benchmarks the kernels against them, e.g.
+# prepbufr_loops.py time -n 1000000 10000000 or prepbufr_loops.py mask -n 1000000 -v 6
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import numpy.ma as ma
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ush', 'ioda', 'bufr2ioda'))
+
+from wxflow import Logger
+from prepbufr_time import Compute_dateTime, int64_fill_value
+from obstype_mask import Mask_typ_for_vars
+
+
+def Compute_dateTime_loop(cycleTimeSinceEpoch, dhr):
+    dateTime = np.zeros(dhr.shape, dtype=np.int64)
+    for i in range(len(dateTime)):
+        if ma.is_masked(dhr[i]):
+            continue
+        else:
+            dateTime[i] = np.int64(dhr[i]*3600) + cycleTimeSinceEpoch
+
+    dateTime = ma.array(dateTime)
+    dateTime = ma.masked_values(dateTime, int64_fill_value)
+
+    return dateTime
+
+
+def Mask_typ_for_var_loop(typ, var):
+    typ_var = copy.deepcopy(typ)
+    for i in range(len(typ_var)):
+        if ma.is_masked(var[i]):
+            typ_var[i] = typ.fill_value
+
+    return typ_var
+
+
+def same_masked(a, b):
+    return (a.dtype == b.dtype and a.fill_value == b.fill_value and
+            np.array_equal(ma.getmaskarray(a), ma.getmaskarray(b)) and
+            np.array_equal(ma.getdata(a), ma.getdata(b)))
+
+
+def benchmark_time(args, logger):
+    rng = np.random.default_rng(0)
+    cycleTimeSinceEpoch = np.int64(1700000000)
+    for n in args.sizes:
+        # offsets within a 6 hour window, about 1% missing, like DHR in a prepbufr file
+        dhr = ma.masked_array(rng.uniform(-3, 3, n).astype(np.float32), mask=rng.random(n) < 0.01,
+                              fill_value=np.float32(10e10))
+
+        start_time = time.time()
+        dateTime = Compute_dateTime(cycleTimeSinceEpoch, dhr)
+        kernel_time = time.time() - start_time
+
+        # the loop is timed on at most loop_max observations and scaled up
+        m = min(n, args.loop_max)
+        start_time = time.time()
+        reference = Compute_dateTime_loop(cycleTimeSinceEpoch, dhr[:m])
+        loop_time = (time.time() - start_time) * n / m
+        if not same_masked(dateTime[:m], reference):
+            raise ValueError(f"Compute_dateTime differs from the loop for n = {n}")
+
+        logger.info(f"n = {n:>9d}: kernel {kernel_time:8.3f} s, loop {loop_time:8.3f} s"
+                    f"{'' if m == n else ' (scaled)'}, speedup {loop_time / kernel_time:8.1f}x")
+
+
+def measure(function, *args):
+    # wall time and peak of the memory allocated while running function
+    tracemalloc.start()
+    start_time = time.time()
+    result = function(*args)
+    elapsed = time.time() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def benchmark_mask(args, logger):
+    n = args.size
+    rng = np.random.default_rng(0)
+    typ = ma.masked_array(rng.choice([120, 180, 181, 187, 220], n).astype(np.int32),
+                          mask=rng.random(n) < 0.001, fill_value=np.int32(2147483647))
+    # variables missing in 5 to 50% of the reports
+    variables = [ma.masked_array(rng.random(n).astype(np.float32), mask=rng.random(n) < 0.05 * (k + 1),
+                                 fill_value=np.float32(10e10)) for k in range(args.variables)]
+
+    typ_vars, block_time, block_peak = measure(Mask_typ_for_vars, typ, *variables)
+
+    # the loop is timed on at most loop_max reports and scaled up
+    m = min(n, args.loop_max)
+    reference, loop_time, loop_peak = measure(lambda: [Mask_typ_for_var_loop(typ[:m], var[:m]) for var in variables])
+    loop_time *= n / m
+    loop_peak *= n / m
+    for typ_var, ref in zip(typ_vars, reference):
+        if not same_masked(typ_var[:m], ref):
+            raise ValueError(f"Mask_typ_for_vars differs from the loop for n = {n}")
+
+    per_million = 1.e6 / n
+    logger.info(f"n = {n}, {args.variables} variables")
+    logger.info(f"  time per million reports: block {block_time * per_million:8.3f} s, "
+                f"loop {loop_time * per_million:8.3f} s{'' if m == n else ' (scaled)'}")
+    logger.info(f"  memory allocated:         block {block_peak / 2**20:8.1f} MB, "
+                f"loop {loop_peak / 2**20:8.1f} MB, saved {(loop_peak - block_peak) / 2**20:8.1f} MB")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    kernels = parser.add_subparsers(dest='kernel', required=True)
+    parser_time = kernels.add_parser('time', help='Compute_dateTime of prepbufr_time.py')
+    parser_time.add_argument('-n', '--sizes', type=int, nargs='+', default=[1000000, 10000000],
+                             help='number of observations to benchmark')
+    parser_time.add_argument('--loop-max', type=int, default=1000000,
+                             help='largest number of observations the reference loop is timed on')
+    parser_time.set_defaults(benchmark=benchmark_time)
+    parser_mask = kernels.add_parser('mask', help='Mask_typ_for_vars of obstype_mask.py')
+    parser_mask.add_argument('-n', '--size', type=int, default=1000000, help='number of reports')
+    parser_mask.add_argument('-v', '--variables', type=int, default=6, help='number of derived variables')
+    parser_mask.add_argument('--loop-max', type=int, default=200000,
+                             help='largest number of reports the reference loop is timed on')
+    parser_mask.set_defaults(benchmark=benchmark_mask)
+    args = parser.parse_args()
+
+    logger = Logger('prepbufr_loops.py', level='INFO', colored_log=True)
+    args.benchmark(args, logger)
@@ -0,0 +1,93 @@
+# test_conversion_manifest.py
+# what makes run_bufr2ioda.py --incremental convert an obtype again
+import os
+import pytest
+from conversion_manifest import ConversionManifest, conversion_key, written_outputs
+
+
+@pytest.fixture
+def conversion(tmp_path):
+    # a python converter importing a helper next to it, and its bufr input
+    (tmp_path / 'bufr2ioda_atms.py').write_text('import numpy\nfrom helper import derive\n')
+    (tmp_path / 'helper.py').write_text('def derive():\n    pass\n')
+    bufrfile = tmp_path / 'gdas.t00z.atms.tm00.bufr_d'
+    bufrfile.write_bytes(b'BUFR0001')
+    config = {'observations': [{'obs space': {'obsdatain': str(bufrfile)}}]}
+    return config, str(tmp_path / 'bufr2ioda_atms.py'), bufrfile
+
+
+def rewrite(path, data):
+    # the same size and mtime, other bytes
+    stat = os.stat(path)
+    path.write_bytes(data)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def test_key_is_stable(conversion):
+    config, converter, bufrfile = conversion
+    assert conversion_key(config, converter) == conversion_key(dict(config), converter)
+    assert conversion_key(config, converter, digest=True) == conversion_key(config, converter, digest=True)
+
+
+def test_key_follows_inputs(conversion, tmp_path):
+    config, converter, bufrfile = conversion
+    key = conversion_key(config, converter)
+
+    # the rendered config
+    assert conversion_key(dict(config, cycle_datetime='2021063006'), converter) != key
+    # a local module the converter imports
+    (tmp_path / 'helper.py').write_text('def derive():\n    return 1\n')
+    assert conversion_key(config, converter) != key
+    key = conversion_key(config, converter)
+    # the bufr input, by its size and mtime
+    bufrfile.write_bytes(b'BUFR00010002')
+    assert conversion_key(config, converter) != key
+
+
+def test_digest_sees_rewritten_bytes(conversion):
+    config, converter, bufrfile = conversion
+    key = conversion_key(config, converter)
+    digest_key = conversion_key(config, converter, digest=True)
+    rewrite(bufrfile, b'BUFR0002')
+    assert conversion_key(config, converter) == key
+    assert conversion_key(config, converter, digest=True) != digest_key
+
+
+def test_compiled_converter(conversion, tmp_path):
+    config, _, _ = conversion
+    executable = tmp_path / 'bufr2ioda.x'
+    executable.write_bytes(b'\x7fELF')
+    key = conversion_key(config, str(executable))
+    # a rebuild changes its size or mtime
+    executable.write_bytes(b'\x7fELF\x02')
+    assert conversion_key(config, str(executable)) != key
+
+
+def test_written_outputs(tmp_path):
+    since = 1700000000.0
+    for name, mtime in (('atms_n20.nc', since + 5), ('atms_npp.nc', since - 1), ('atms_n21.nc', since - 3),
+                        ('amsua_n19.nc', since + 5)):
+        path = tmp_path / f'gdas.t00z.{name}'
+        path.write_bytes(b'')
+        os.utime(path, (mtime, mtime))
+    # the files of the pattern written since the job started, within 2 seconds
+    assert written_outputs(str(tmp_path / 'gdas.t00z.atms_*.nc'), since) == [
+        str(tmp_path / 'gdas.t00z.atms_n20.nc'), str(tmp_path / 'gdas.t00z.atms_npp.nc')]
+    assert written_outputs(None, since) == []
+
+
+def test_stale_reason(conversion, tmp_path):
+    config, converter, bufrfile = conversion
+    manifest = ConversionManifest(str(tmp_path / 'manifest.json'))
+    key = conversion_key(config, converter)
+    output = tmp_path / 'gdas.t00z.atms_n20.nc'
+    output.write_bytes(b'')
+    manifest.update('atms', key, str(tmp_path / 'gdas.t00z.atms_*.nc'), os.path.getmtime(output))
+    manifest.save()
+
+    manifest = ConversionManifest(manifest.path)
+    assert manifest.stale_reason('atms', key) is None
+    assert manifest.stale_reason('mhs', key) == 'not in manifest'
+    assert manifest.stale_reason('atms', 'other') == 'input, config or converter changed'
+    output.unlink()
+    assert manifest.stale_reason('atms', key).startswith('missing outputs')
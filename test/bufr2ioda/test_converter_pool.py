@@ -0,0 +1,19 @@
+# test_converter_pool.py
+# the workers of the in-process converter pool
+import multiprocessing as mp
+import os
+import sys
+from converter_pool import converter_executor
+
+
+def worker_state(task):
+    return os.getpid(), mp.current_process().daemon
+
+
+def test_workers_may_fork():
+    with converter_executor(2, [], 1) as executor:
+        states = list(executor.map(worker_state, range(4)))
+    assert not any(daemon for pid, daemon in states)
+    if sys.version_info >= (3, 11):
+        # a worker is replaced after every converter
+        assert len({pid for pid, daemon in states}) == 4
@@ -0,0 +1,71 @@
+# test_ioda_schema.py
+# the create_var/write_attr/write_data calls of a schema against the chains it replaces
+import numpy as np
+import numpy.ma as ma
+import pytest
+from ioda_schema import IodaVar, write_ioda_vars
+from output_policy import OutputPolicy, PolicyObsSpace
+
+
+class ObsSpace:
+    # records the calls of the variables it creates, in order
+    def __init__(self):
+        self.calls = []
+
+    def create_var(self, name, dtype=np.float32, dim_list=["Location"], fillval=None, **options):
+        self.calls.append(('create_var', name, dtype, list(dim_list), fillval, options))
+        return self
+
+    def write_attr(self, name, value):
+        self.calls.append(('write_attr', name, value))
+        return self
+
+    def write_data(self, values):
+        self.calls.append(('write_data', values))
+        return self
+
+
+lat = ma.masked_array(np.array([10.0, 20.0], dtype=np.float32), fill_value=np.float32(3.4e38))
+tb = np.zeros((2, 3), dtype=np.float32)
+valid_range = np.array([-90, 90], dtype=np.float32)
+
+
+def test_same_as_chain():
+    schema = [IodaVar('MetaData/latitude', 'degrees_north', 'Latitude', valid_range),
+              IodaVar('ObsValue/brightnessTemperature', 'K', 'Brightness Temperature',
+                      dim_list=['Location', 'Channel'], fillval=np.float32(3.4e38))]
+    obsspace = ObsSpace()
+    write_ioda_vars(obsspace, schema, {'MetaData/latitude': lat, 'ObsValue/brightnessTemperature': tb})
+
+    chain = ObsSpace()
+    chain.create_var('MetaData/latitude', dtype=lat.dtype, fillval=lat.fill_value) \
+        .write_attr('units', 'degrees_north') \
+        .write_attr('valid_range', valid_range) \
+        .write_attr('long_name', 'Latitude') \
+        .write_data(lat)
+    chain.create_var('ObsValue/brightnessTemperature', dtype=tb.dtype, dim_list=['Location', 'Channel'],
+                     fillval=np.float32(3.4e38)) \
+        .write_attr('units', 'K') \
+        .write_attr('long_name', 'Brightness Temperature') \
+        .write_data(tb)
+    assert obsspace.calls == chain.calls
+
+
+def test_storage_options_override_policy():
+    obsspace = ObsSpace()
+    policy = OutputPolicy(location_chunk=1000, deflate_level=4)
+    schema = [IodaVar('MetaData/latitude', chunks=[2]),
+              IodaVar('ObsValue/brightnessTemperature', dim_list=['Location', 'Channel'], compression_level=1)]
+    write_ioda_vars(PolicyObsSpace(obsspace, policy, {'Location': 2, 'Channel': 3}), schema,
+                    {'MetaData/latitude': lat, 'ObsValue/brightnessTemperature': ma.masked_array(tb)})
+    options = [call[5] for call in obsspace.calls if call[0] == 'create_var']
+    assert options == [{'chunks': [2], 'compression_level': 4}, {'chunks': [2, 3], 'compression_level': 1}]
+
+
+@pytest.mark.parametrize('data', [{}, {'MetaData/latitude': lat, 'MetaData/longitude': lat}],
+                         ids=['missing', 'unknown'])
+def test_nothing_written_on_mismatch(data):
+    obsspace = ObsSpace()
+    with pytest.raises(KeyError):
+        write_ioda_vars(obsspace, [IodaVar('MetaData/latitude')], data)
+    assert obsspace.calls == []
@@ -0,0 +1,60 @@
+# test_obstype_mask.py
+# Mask_typ_for_vars against the per-variable deepcopy and loop it replaces
+import numpy as np
+import numpy.ma as ma
+import pytest
+from obstype_mask import Mask_typ_for_vars
+from prepbufr_loops import Mask_typ_for_var_loop, same_masked
+
+int32_fill_value = np.int32(2147483647)
+float32_fill_value = np.float32(10e10)
+
+
+def typ_array(values, mask=ma.nomask):
+    return ma.masked_array(np.array(values, dtype=np.int32), mask=mask, fill_value=int32_fill_value)
+
+
+def var_array(values, mask=False):
+    return ma.masked_array(np.array(values, dtype=np.float32), mask=mask, fill_value=float32_fill_value)
+
+
+@pytest.mark.parametrize('typ', [
+    typ_array([120, 180, 181, 187]),
+    typ_array([120, 180, 181, 187], mask=[False, True, False, False]),
+], ids=['typ unmasked', 'typ masked'])
+def test_same_as_loop(typ):
+    variables = [var_array([1.0, 2.0, 3.0, 4.0]),
+                 var_array([1.0, 2.0, 3.0, 4.0], mask=[True, False, False, True]),
+                 var_array([1.0, 2.0, 3.0, 4.0], mask=True)]
+    for typ_var, var in zip(Mask_typ_for_vars(typ, *variables), variables):
+        assert same_masked(typ_var, Mask_typ_for_var_loop(typ, var))
+
+
+def test_same_as_loop_random():
+    rng = np.random.default_rng(0)
+    n = 2000
+    typ = typ_array(rng.choice([120, 180, 181, 187, 220], n), mask=rng.random(n) < 0.01)
+    variables = [var_array(rng.random(n), mask=rng.random(n) < 0.1 * (k + 1)) for k in range(4)]
+    for typ_var, var in zip(Mask_typ_for_vars(typ, *variables), variables):
+        assert same_masked(typ_var, Mask_typ_for_var_loop(typ, var))
+
+
+def test_never_missing_shares_typ():
+    typ = typ_array([120, 180])
+    typ_var, = Mask_typ_for_vars(typ, var_array([1.0, 2.0]))
+    assert typ_var is typ
+
+
+def test_levels_of_a_report():
+    # a report with any masked level is missing the variable
+    typ = typ_array([120, 180, 181])
+    var = ma.masked_array(np.ones((3, 2), dtype=np.float32), mask=[[False, False], [False, True], [False, False]])
+    typ_var, = Mask_typ_for_vars(typ, var)
+    assert ma.getdata(typ_var).tolist() == [120, int32_fill_value, 181]
+
+
+def test_empty():
+    typ = typ_array([])
+    variables = [var_array([]), ma.masked_array(np.zeros((0, 3), dtype=np.float32), mask=True)]
+    for typ_var in Mask_typ_for_vars(typ, *variables):
+        assert same_masked(typ_var, Mask_typ_for_var_loop(typ, variables[0]))
@@ -0,0 +1,82 @@
+# test_output_policy.py
+# the create_var arguments of the output policy, and the ObsSpace they are handed to
+import logging
+import numpy as np
+import pytest
+from output_policy import OutputPolicy, PolicyObsSpace
+
+dim_sizes = {'Location': 25000, 'Channel': 16}
+
+
+class ObsSpace:
+    # records the create_var calls of the converters
+    def __init__(self):
+        self.calls = []
+        self.attrs = {}
+
+    def create_var(self, name, dtype=np.float32, dim_list=["Location"], fillval=None, **options):
+        self.calls.append((name, list(dim_list), options))
+        return self
+
+    def write_attr(self, name, value):
+        self.attrs[name] = value
+        return self
+
+
+class LegacyObsSpace(ObsSpace):
+    # an IODA library without the storage options
+    def create_var(self, name, dtype=np.float32, dim_list=["Location"], fillval=None):
+        return super().create_var(name, dtype, dim_list, fillval)
+
+
+def test_create_options():
+    policy = OutputPolicy(location_chunk=10000, channel_chunk=4, deflate_level=4, shuffle=True)
+    assert policy.create_options(['Location', 'Channel'], dim_sizes) == {
+        'chunks': [10000, 4], 'compression_level': 4, 'shuffle': True}
+    # a chunk is no larger than its dimension, a dimension without a chunk size is chunked whole
+    assert OutputPolicy(location_chunk=100000).create_options(['Location', 'Channel'], dim_sizes) == {
+        'chunks': [25000, 16]}
+    assert OutputPolicy(deflate_level=1).create_options(['Location'], dim_sizes) == {'compression_level': 1}
+    # empty variables are left to the library
+    assert OutputPolicy(location_chunk=10).create_options(['Location'], {'Location': 0}) == {}
+    assert OutputPolicy().create_options(['Location'], dim_sizes) == {}
+
+
+@pytest.mark.parametrize('settings', [{'deflate_level': 10}, {'location_chunk': 0}])
+def test_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        OutputPolicy.from_settings(settings)
+
+
+def test_policy_obsspace():
+    obsspace = ObsSpace()
+    policy = OutputPolicy(location_chunk=10000, deflate_level=4)
+    wrapped = PolicyObsSpace(obsspace, policy, dim_sizes)
+    wrapped.create_var('MetaData/latitude').write_attr('units', 'degrees_north')
+    wrapped.create_var('ObsValue/brightnessTemperature', dim_list=['Location', 'Channel'])
+    # the options of the call override the policy
+    wrapped.create_var('MetaData/sensorChannelNumber', dim_list=['Channel'], chunks=[16], compression_level=0)
+    assert obsspace.calls == [
+        ('MetaData/latitude', ['Location'], {'chunks': [10000], 'compression_level': 4}),
+        ('ObsValue/brightnessTemperature', ['Location', 'Channel'], {'chunks': [10000, 16], 'compression_level': 4}),
+        ('MetaData/sensorChannelNumber', ['Channel'], {'chunks': [16], 'compression_level': 0})]
+    assert obsspace.attrs == {'units': 'degrees_north'}
+
+
+def test_default_policy_passes_nothing():
+    obsspace = LegacyObsSpace()
+    wrapped = PolicyObsSpace(obsspace, OutputPolicy(), dim_sizes)
+    wrapped.create_var('MetaData/latitude')
+    assert obsspace.calls == [('MetaData/latitude', ['Location'], {})]
+
+
+def test_library_without_options(caplog):
+    obsspace = LegacyObsSpace()
+    wrapped = PolicyObsSpace(obsspace, OutputPolicy(location_chunk=10000), dim_sizes,
+                             logging.getLogger('test_output_policy'))
+    with caplog.at_level(logging.WARNING):
+        wrapped.create_var('MetaData/latitude')
+        wrapped.create_var('MetaData/longitude', chunks=[100])
+    assert obsspace.calls == [('MetaData/latitude', ['Location'], {}), ('MetaData/longitude', ['Location'], {})]
+    # warned once
+    assert len(caplog.records) == 1
@@ -0,0 +1,169 @@
+# test_prepbufr_fanout.py
+# the shared per-subset decode of prepbufr_fanout against the columns each
+# converter would read from its own QuerySets
+import types
+import numpy as np
+import pytest
+import prepbufr_fanout
+from converter_pool import load_converter
+from prepbufr_fanout import SubsetResultView, fanout
+
+POB = '*/P___INFO/P__EVENT{1}/POB'
+TYP = '*/TYP'
+SID = '*/SID'
+
+# the column of each path in each subset of the prepbufr file
+columns = {
+    ('ADPSFC', POB): np.array([1000.0, 990.0]),
+    ('ADPSFC', TYP): np.array([181, 187]),
+    ('ADPSFC', SID): np.array(['72393', '72469'], dtype=object),
+    ('SFCSHP', TYP): np.array([180, 280, 183]),
+}
+
+
+class QuerySet:
+    def __init__(self, subsets):
+        self.subset, = subsets
+        self.paths = {}
+
+    def add(self, name, path):
+        self.paths[name] = path
+
+
+class ResultSet:
+    # get of a bufr.ResultSet, recording the arguments it is called with
+    def __init__(self, q):
+        self.q = q
+        self.calls = []
+
+    def get(self, name, *group_by, **kwargs):
+        self.calls.append((name, group_by, kwargs))
+        return columns[(self.q.subset, self.q.paths[name])]
+
+    def get_datetime(self, *names, **kwargs):
+        self.calls.append((names, (), kwargs))
+        return columns[(self.q.subset, self.q.paths[names[0]])]
+
+
+class File:
+    executed = []
+    failing = ()
+
+    def __init__(self, path):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, q):
+        if q.subset in self.failing:
+            raise RuntimeError(f"no {q.subset} messages")
+        self.executed.append(q)
+        return ResultSet(q)
+
+
+def test_view_names():
+    q = QuerySet(['ADPSFC'])
+    q.add('pressure', POB)
+    q.add('observationType', TYP)
+    result = ResultSet(q)
+    view = SubsetResultView(result, {'stationPressure': 'pressure', 'obsType': 'observationType'})
+    assert view.get('stationPressure', 'obsType', type='float').tolist() == [1000.0, 990.0]
+    assert view.get_datetime('obsType', group_by='obsType').tolist() == [181, 187]
+    # the converter's names, its group_by included, are asked for under the shared ones
+    assert result.calls == [('pressure', ('observationType',), {'type': 'float'}),
+                            (('observationType',), (), {'group_by': 'observationType'})]
+
+
+# conventional_prepbufr_ps builds a QuerySet per subset, and queries POB twice
+prepbufr_ps_script = """
+calls = []
+
+
+def build_query(q, subset):
+    if subset == 'ADPSFC':
+        q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
+        q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
+    q.add('observationType', '*/TYP')
+    return q
+
+
+def bufr_to_ioda(config, logger, results=None):
+    calls.append(results)
+"""
+
+# adpsfc_prepbufr reads TYP under another name, and its observationType is another path
+adpsfc_script = """
+calls = []
+
+
+def build_query(q):
+    q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
+    q.add('obsType', '*/TYP')
+    q.add('observationType', '*/SID')
+    return q
+
+
+def bufr_to_ioda(config, logger, r=None):
+    calls.append(r)
+"""
+
+
+@pytest.fixture
+def converters(tmp_path, monkeypatch):
+    File.executed = []
+    File.failing = ()
+    monkeypatch.setattr(prepbufr_fanout, 'bufr', types.SimpleNamespace(QuerySet=QuerySet, File=File))
+    converters = []
+    for obtype, script, subsets in (('conventional_prepbufr_ps', prepbufr_ps_script, ['ADPSFC', 'SFCSHP']),
+                                    ('adpsfc_prepbufr', adpsfc_script, ['ADPSFC'])):
+        path = tmp_path / f'bufr2ioda_{obtype}.py'
+        path.write_text(script)
+        converters.append((obtype, str(path), {'subsets': subsets}))
+    return converters
+
+
+def calls(converters):
+    return {obtype: load_converter(script).calls for obtype, script, _ in converters}
+
+
+def test_each_path_decoded_once(converters):
+    status = fanout('gdas.t06z.prepbufr', converters, workers=1)
+    assert status == {'conventional_prepbufr_ps': 'ok', 'adpsfc_prepbufr': 'ok'}
+
+    # one QuerySet per subset, each path once, a name taken by another path is renamed
+    assert {q.subset: q.paths for q in File.executed} == {
+        'ADPSFC': {'pressure': POB, 'observationType': TYP, 'observationType__2': SID},
+        'SFCSHP': {'observationType': TYP}}
+
+    # every converter reads its columns under its own names
+    (results,), (r,) = calls(converters).values()
+    assert results.keys() == {'ADPSFC', 'SFCSHP'}
+    assert results['ADPSFC'].get('pressure').tolist() == [1000.0, 990.0]
+    assert results['ADPSFC'].get('stationPressure').tolist() == [1000.0, 990.0]
+    assert results['ADPSFC'].get('observationType').tolist() == [181, 187]
+    assert results['SFCSHP'].get('observationType').tolist() == [180, 280, 183]
+    assert r.get('pressure').tolist() == [1000.0, 990.0]
+    assert r.get('obsType').tolist() == [181, 187]
+    assert r.get('observationType').tolist() == ['72393', '72469']
+    # the converters of a subset share its ResultSet
+    assert r.result is results['ADPSFC'].result
+
+
+def test_failed_subset_skips_its_converters(converters):
+    File.failing = ('SFCSHP',)
+    status = fanout('gdas.t06z.prepbufr', converters, workers=1)
+    # as on its own, the converter of the failed subset writes nothing and succeeds
+    assert status == {'conventional_prepbufr_ps': 'ok', 'adpsfc_prepbufr': 'ok'}
+    (r,) = calls(converters)['adpsfc_prepbufr']
+    assert calls(converters)['conventional_prepbufr_ps'] == []
+    assert r.get('observationType').tolist() == ['72393', '72469']
+
+
+def test_single_queryset_over_several_subsets(converters):
+    # build_query(q) builds one QuerySet, it cannot be split by subset
+    with pytest.raises(ValueError):
+        prepbufr_fanout.converter_queries(converters[1][1], {'subsets': ['ADPSFC', 'SFCSHP']})
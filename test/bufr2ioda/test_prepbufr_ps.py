@@ -0,0 +1,84 @@
+# test_prepbufr_ps.py
+# the quality markers bufr_to_ioda writes for the surface subsets of a prepbufr file
+import logging
+import types
+import numpy as np
+import numpy.ma as ma
+import bufr2ioda_conventional_prepbufr_ps as prepbufr_ps
+
+INT_FILL = np.int32(2147483647)
+FLOAT_FILL = np.float32(10e10)
+
+
+class QuerySet:
+    def __init__(self, subsets):
+        pass
+
+    def add(self, name, path):
+        pass
+
+
+class ResultSet:
+    # get of a bufr.ResultSet, every column of one type
+    def __init__(self, typ, **columns):
+        n = len(typ)
+        self.columns = {name: np.full(n, 1, dtype=np.int32) for name in (
+            'prepbufrDataLevelCategory', 'temperatureEventCode', 't29', 'qualityMarkerStationPressure',
+            'qualityMarkerStationElevation', 'qualityMarkerAirTemperature')}
+        self.columns.update({name: np.full(n, 1.0, dtype=np.float32) for name in (
+            'latitude', 'longitude', 'obsTimeMinusCycleTime', 'timeOffset', 'height', 'pressure',
+            'obsErrorStationPressure', 'obsErrorAirTemperature', 'stationElevation', 'stationPressure',
+            'airTemperature')})
+        self.columns['stationIdentification'] = np.array([f'SID{i}' for i in range(n)], dtype=object)
+        self.columns['observationType'] = np.asarray(typ, dtype=np.int32)
+        self.columns.update(columns)
+
+    def get(self, name, group_by=None, type=None):
+        values = self.columns[name]
+        fill = {'O': '', 'i': INT_FILL}.get(values.dtype.kind, FLOAT_FILL)
+        return ma.masked_array(values.copy(), fill_value=fill)
+
+
+class ObsSpace:
+    # the data the converter writes, by variable
+    def __init__(self):
+        self.data = {}
+
+    def create_var(self, name, dtype=np.float32, dim_list=['Location'], fillval=None):
+        self.name = name
+        return self
+
+    def write_attr(self, name, value):
+        return self
+
+    def write_data(self, values):
+        self.data[self.name] = values
+        return self
+
+
+def test_station_elevation_quality_marker(monkeypatch, tmp_path):
+    obsspace = ObsSpace()
+    monkeypatch.setattr(prepbufr_ps, 'bufr', types.SimpleNamespace(QuerySet=QuerySet))
+    monkeypatch.setattr(prepbufr_ps, 'create_obsspace', lambda *args: obsspace)
+    bufrfile = tmp_path / 'gdas.20210630' / '06' / 'atmos' / 'gdas.t06z.prepbufr'
+    bufrfile.parent.mkdir(parents=True)
+    bufrfile.write_bytes(b'BUFR')
+    config = {'subsets': ['ADPSFC', 'SFCSHP', 'ADPUPA'], 'data_format': 'prepbufr', 'source': 'prepbufr',
+              'data_type': 'prepbufr', 'data_description': 'ps', 'data_provider': 'U.S. NOAA',
+              'cycle_type': 'gdas', 'cycle_datetime': '2021063006', 'dump_directory': str(tmp_path),
+              'ioda_directory': str(tmp_path / 'ioda')}
+    # the records of types 200 and above are winds, and left out of the surface subsets
+    results = {
+        'ADPSFC': ResultSet([181, 281, 187, 120],
+                            qualityMarkerStationPressure=np.array([2, 9, 3, 4], dtype=np.int32),
+                            qualityMarkerStationElevation=np.array([5, 9, 6, 7], dtype=np.int32)),
+        'SFCSHP': ResultSet([180, 280],
+                            qualityMarkerStationPressure=np.array([1, 9], dtype=np.int32),
+                            qualityMarkerStationElevation=np.array([8, 9], dtype=np.int32)),
+        'ADPUPA': ResultSet([120], qualityMarkerStationElevation=np.array([3], dtype=np.int32)),
+    }
+    prepbufr_ps.bufr_to_ioda(config, logging.getLogger('test_prepbufr_ps'), results)
+
+    # one marker per location, from the elevation, not the pressure
+    assert len(obsspace.data['MetaData/latitude']) == 5
+    assert ma.getdata(obsspace.data['QualityMarker/stationElevation']).tolist() == [5, 6, 7, 8, 3]
@@ -0,0 +1,40 @@
+# test_prepbufr_time.py
+# Compute_dateTime against the per-observation loop it replaces
+import numpy as np
+import numpy.ma as ma
+import pytest
+from prepbufr_time import Compute_dateTime
+from prepbufr_loops import Compute_dateTime_loop, same_masked
+
+cycleTimeSinceEpoch = np.int64(1700000000)
+
+
+def dhr_array(values, mask=False):
+    return ma.masked_array(np.array(values, dtype=np.float32), mask=mask, fill_value=np.float32(10e10))
+
+
+@pytest.mark.parametrize('dhr', [
+    dhr_array([-3.0, -1.5, 0.0, 0.25, 2.999]),
+    dhr_array([-3.0, 1.0, 2.0, 0.5], mask=[False, True, False, True]),
+    dhr_array([1.0, 2.0], mask=True),
+    dhr_array([]),
+], ids=['unmasked', 'masked', 'all masked', 'empty'])
+def test_same_as_loop(dhr):
+    assert same_masked(Compute_dateTime(cycleTimeSinceEpoch, dhr),
+                       Compute_dateTime_loop(cycleTimeSinceEpoch, dhr))
+
+
+def test_same_as_loop_random():
+    rng = np.random.default_rng(0)
+    n = 10000
+    dhr = ma.masked_array(rng.uniform(-3, 3, n).astype(np.float32), mask=rng.random(n) < 0.1,
+                          fill_value=np.float32(10e10))
+    assert same_masked(Compute_dateTime(cycleTimeSinceEpoch, dhr),
+                       Compute_dateTime_loop(cycleTimeSinceEpoch, dhr))
+
+
+def test_zero_is_masked():
+    # an offset back to the epoch gives 0, which is masked like a missing offset
+    dateTime = Compute_dateTime(np.int64(3600), dhr_array([-1.0, 1.0]))
+    assert ma.getmaskarray(dateTime).tolist() == [True, False]
+    assert dateTime.fill_value == 0
@@ -0,0 +1,107 @@
+# test_record_filter.py
+# RecordFilter against the np.append loops it replaces in conventional_prepbufr_ps
+import numpy as np
+import numpy.ma as ma
+import pytest
+from record_filter import RecordFilter
+
+
+def append_loop(typ, column, selected=None):
+    # the selection loop of the ADPSFC and SFCSHP branches
+    if selected is None:
+        selected = np.array([], dtype=column.dtype)
+    for i in range(len(typ)):
+        if typ[i] < 200:
+            selected = np.append(selected, column[i])
+    return selected
+
+
+def same_array(a, b):
+    return (type(a) is type(b) and a.dtype == b.dtype and a.shape == b.shape and
+            np.array_equal(ma.getdata(a), ma.getdata(b)) and
+            np.array_equal(ma.getmaskarray(a), ma.getmaskarray(b)) and
+            (not isinstance(a, ma.MaskedArray) or np.asarray(a.fill_value).tobytes() == np.asarray(b.fill_value).tobytes()))
+
+
+@pytest.fixture
+def subset():
+    typ = ma.masked_array(np.array([120, 280, 181, 187, 220, 183], dtype=np.int32),
+                          mask=[False, False, False, False, False, True], fill_value=np.int32(2147483647))
+    lat = ma.masked_array(np.array([10.0, 20.0, 30.0, 40.0, 50.0, 60.0], dtype=np.float32),
+                          mask=[False, False, True, False, False, False], fill_value=np.float32(10e10))
+    sid = np.array(['A', 'B', 'C', 'D', 'E', 'F'], dtype=object)
+    return typ, lat, sid
+
+
+def test_same_as_loop(subset):
+    typ, lat, sid = subset
+    adpsfc = RecordFilter(typ < 200)
+    # the masked type is rejected by the filter, the loop compared its fill value
+    loop_typ = ma.filled(typ, 999)
+    assert len(adpsfc) == len(append_loop(loop_typ, typ))
+    assert adpsfc(sid).tolist() == append_loop(loop_typ, sid).tolist()
+    assert ma.getdata(adpsfc(typ)).tolist() == append_loop(loop_typ, ma.getdata(typ)).tolist()
+
+
+def test_masked_entries_stay_masked(subset):
+    typ, lat, sid = subset
+    selected = RecordFilter(typ < 200)(lat)
+    # np.append turned the masked latitude into an unmasked value
+    assert isinstance(selected, ma.MaskedArray)
+    assert ma.getmaskarray(selected).tolist() == [False, True, False]
+    assert ma.getdata(selected)[[0, 2]].tolist() == [10.0, 40.0]
+    assert selected.dtype == lat.dtype
+    assert selected.fill_value == lat.fill_value
+
+
+def test_nothing_rejected_returns_the_column(subset):
+    typ, lat, sid = subset
+    keep_all = RecordFilter(np.ones(len(lat), dtype=bool))
+    assert keep_all(lat) is lat
+
+
+def test_empty():
+    empty = RecordFilter(np.array([], dtype=np.int32) < 200)
+    column = ma.masked_array(np.array([], dtype=np.float32))
+    assert len(empty) == 0
+    assert empty(column).shape == (0,)
+    none_kept = RecordFilter(np.array([300, 400]) < 200)
+    assert len(none_kept) == 0
+    assert none_kept(np.array([1.0, 2.0])).shape == (0,)
+
+
+def test_column_length_checked(subset):
+    typ, lat, sid = subset
+    with pytest.raises(ValueError):
+        RecordFilter(typ < 200)(lat[:3])
+
+
+@pytest.mark.parametrize('initial', [np.array([], dtype=np.float32), np.array([], dtype=np.int32),
+                                     ma.array([], dtype=np.float32), np.array([]).astype('str')],
+                         ids=['float32', 'int32', 'masked', 'str'])
+@pytest.mark.parametrize('seed', range(20))
+def test_appended_same_as_loop(initial, seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(0, 10))
+    typ = ma.masked_array(rng.choice([120, 181, 220, 280], n).astype(np.int32), mask=rng.random(n) < 0.1)
+    if initial.dtype.kind == 'U':
+        data = rng.choice(['72393', 'KBOS', 'SHIP0001'], n).astype(object)
+    else:
+        data = rng.uniform(-90, 90, n).astype(np.float32)
+    column = ma.masked_array(data, mask=rng.random(n) < 0.3)
+    loop_typ = ma.filled(typ, 999)
+    assert same_array(RecordFilter(typ < 200).appended(initial, column), append_loop(loop_typ, column, initial))
+
+
+def test_appended_masked_entry(subset):
+    typ, lat, sid = subset
+    selected = RecordFilter(typ < 200).appended(np.array([], dtype=np.float32), lat)
+    # the masked latitude is an unmasked 0, and promotes the result to float64
+    assert selected.dtype == np.float64
+    assert not ma.is_masked(selected)
+    assert selected.tolist() == [10.0, 0.0, 40.0]
+
+
+def test_appended_nothing_accepted():
+    initial = np.array([], dtype=np.int32)
+    assert RecordFilter(np.array([300, 400]) < 200).appended(initial, np.array([1, 2])) is initial
@@ -0,0 +1,114 @@
+# test_run_admitted.py
+# the converters run_bufr2ioda.py starts at once, within the slots and the memory budget
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+import run_bufr2ioda
+from run_bufr2ioda import run_admitted
+
+GB = 2**30
+
+
+def jobs(*estimates):
+    return [{'obtype': f"obtype{k}", 'rss_estimate': rss * GB} for k, rss in enumerate(estimates)]
+
+
+def record(job, status='ok'):
+    return {'obtype': job['obtype'], 'start': 0.0, 'end': 0.0, 'wall_time': 0.0, 'peak_rss': 0, 'status': status}
+
+
+class ImmediatePool:
+    """
+    Executor running each job as it is submitted: run_admitted then sees the
+    jobs finish in the order they started, and the order of the submits is
+    the order it admits them in.
+    """
+
+    def __init__(self, broken_after=None):
+        self.submitted = []
+        self.broken_after = broken_after
+
+    def submit(self, fn, job):
+        if self.broken_after is not None and len(self.submitted) >= self.broken_after:
+            raise BrokenProcessPool('a worker died')
+        self.submitted.append(job['obtype'])
+        future = Future()
+        try:
+            future.set_result(fn(job))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@pytest.fixture(autouse=True)
+def run_job(monkeypatch):
+    def run_job(job):
+        if job.get('fail'):
+            raise RuntimeError(f"{job['obtype']} crashed")
+        return record(job)
+    monkeypatch.setattr(run_bufr2ioda, 'run_job', run_job)
+
+
+def test_slots():
+    pool = ImmediatePool()
+    records = run_admitted(pool, jobs(1, 1, 1, 1), 2)
+    assert pool.submitted == ['obtype0', 'obtype1', 'obtype2', 'obtype3']
+    assert [r['status'] for r in records] == ['ok'] * 4
+
+
+def test_memory_budget_order():
+    # obtype1 does not fit next to obtype0, obtype2 does and starts ahead of it;
+    # obtype3 is larger than the whole budget and starts once nothing else runs
+    pool = ImmediatePool()
+    records = run_admitted(pool, jobs(6, 6, 3, 12), 4, max_rss=10 * GB)
+    assert pool.submitted == ['obtype0', 'obtype2', 'obtype1', 'obtype3']
+    # the records come back in job order
+    assert [r['obtype'] for r in records] == ['obtype0', 'obtype1', 'obtype2', 'obtype3']
+
+
+def test_without_budget_estimates_are_ignored():
+    pool = ImmediatePool()
+    run_admitted(pool, jobs(6, 6, 3, 12), 4)
+    assert pool.submitted == ['obtype0', 'obtype1', 'obtype2', 'obtype3']
+
+
+def test_failed_jobs():
+    failing = jobs(1, 1, 1)
+    failing[1]['fail'] = True
+    records = run_admitted(ImmediatePool(), failing, 2)
+    assert [r['status'] for r in records] == ['ok', 'failed', 'ok']
+    assert records[1]['obtype'] == 'obtype1'
+
+
+def test_broken_pool():
+    # once a worker died the pool takes no more jobs, they all fail
+    pool = ImmediatePool(broken_after=1)
+    records = run_admitted(pool, jobs(1, 1, 1), 1)
+    assert [r['status'] for r in records] == ['ok', 'failed', 'failed']
+
+
+def test_running_within_budget(monkeypatch):
+    # on a real executor, the jobs running at the same time fit in the budget
+    lock = threading.Lock()
+    running = {}
+    peaks = []
+
+    def run_job(job):
+        with lock:
+            running[job['obtype']] = job['rss_estimate']
+            peaks.append((len(running), sum(running.values())))
+        time.sleep(0.02)
+        with lock:
+            del running[job['obtype']]
+        return record(job)
+
+    monkeypatch.setattr(run_bufr2ioda, 'run_job', run_job)
+    estimates = [4, 3, 5, 2, 6, 1, 3, 4, 2, 5, 11]
+    with ThreadPoolExecutor(4) as pool:
+        records = run_admitted(pool, jobs(*estimates), 3, max_rss=10 * GB)
+    assert [r['status'] for r in records] == ['ok'] * len(estimates)
+    assert max(count for count, _ in peaks) <= 3
+    # only the job larger than the budget exceeds it, on its own
+    assert all(rss <= 10 * GB or count == 1 for count, rss in peaks)
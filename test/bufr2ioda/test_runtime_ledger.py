@@ -0,0 +1,100 @@
+# test_runtime_ledger.py
+# the dispatch order and memory estimates run_bufr2ioda.py takes from the ledger
+import pytest
+import runtime_ledger
+from runtime_ledger import RuntimeLedger
+
+MB = 2**20
+
+
+def ledger_with(tmp_path, **histories):
+    # {obtype: [(wall_time, peak_rss, input_size, status)]}, oldest first
+    ledger = RuntimeLedger(str(tmp_path / 'ledger.json'))
+    for obtype, history in histories.items():
+        for k, (wall_time, peak_rss, input_size, status) in enumerate(history):
+            ledger.record(obtype, f"20210630{k:02d}", wall_time, peak_rss, input_size, status)
+    return ledger
+
+
+def jobs(*sizes):
+    return [{'obtype': obtype, 'input_size': size} for obtype, size in sizes]
+
+
+def obtypes(ordered):
+    return [job['obtype'] for job in ordered]
+
+
+def test_order_without_history(tmp_path):
+    # nothing to cost them with: largest input first
+    ledger = RuntimeLedger(str(tmp_path / 'ledger.json'))
+    ordered = ledger.order(jobs(('gnssro', 10 * MB), ('atms', 300 * MB), ('adpsfc', 0)))
+    assert obtypes(ordered) == ['atms', 'gnssro', 'adpsfc']
+    assert [job['estimate'] for job in ordered] == [None, None, None]
+
+
+def test_order_with_history(tmp_path):
+    # atms runs 1 s per MB, gnssro 10 s per MB, adpsfc takes 30 s whatever its size
+    ledger = ledger_with(tmp_path,
+                         atms=[(100.0, MB, 100 * MB, 'ok'), (300.0, MB, 300 * MB, 'ok')],
+                         gnssro=[(100.0, MB, 10 * MB, 'ok')],
+                         adpsfc=[(30.0, MB, 0, 'ok')])
+    ordered = ledger.order(jobs(('atms', 200 * MB), ('gnssro', 30 * MB), ('adpsfc', 0)))
+    assert obtypes(ordered) == ['gnssro', 'atms', 'adpsfc']
+    assert [job['estimate'] for job in ordered] == pytest.approx([300.0, 200.0, 30.0])
+
+
+def test_order_new_obtypes(tmp_path):
+    ledger = ledger_with(tmp_path,
+                         atms=[(100.0, MB, 100 * MB, 'ok')],
+                         gnssro=[(300.0, MB, 100 * MB, 'ok')])
+    ordered = ledger.order(jobs(('atms', 100 * MB), ('mhs', 100 * MB), ('gnssro', 50 * MB)))
+    # mhs has no history: costed with the mean rate of the ledger, 2 s per MB
+    assert obtypes(ordered) == ['mhs', 'gnssro', 'atms']
+    assert ordered[0]['estimate'] == pytest.approx(200.0)
+    # without an input size that costs nothing
+    ordered = ledger.order(jobs(('atms', 100 * MB), ('mhs', 0)))
+    assert obtypes(ordered) == ['atms', 'mhs']
+    # failed runs are not costed
+    ledger = ledger_with(tmp_path, atms=[(1.0, MB, 100 * MB, 'failed')])
+    assert obtypes(ledger.order(jobs(('gnssro', MB), ('atms', 100 * MB)))) == ['atms', 'gnssro']
+
+
+def test_history_trimmed(tmp_path):
+    ledger = ledger_with(tmp_path, atms=[(float(k), MB, MB, 'ok') for k in range(runtime_ledger.MAX_HISTORY + 3)])
+    history = ledger.history('atms')
+    assert len(history) == runtime_ledger.MAX_HISTORY
+    # the latest cycles are kept, and saved
+    assert [h['wall_time'] for h in history] == [float(k) for k in range(3, runtime_ledger.MAX_HISTORY + 3)]
+    ledger.save()
+    assert RuntimeLedger(ledger.path).history('atms') == history
+
+
+def test_rss_estimate_decay(tmp_path):
+    # the latest peak weighs 1, the one before it RSS_DECAY
+    ledger = ledger_with(tmp_path, atms=[(1.0, 100 * MB, MB, 'ok'), (1.0, 200 * MB, MB, 'ok')])
+    decay = runtime_ledger.RSS_DECAY
+    assert ledger.rss_estimate('atms', MB) == pytest.approx((200 * MB + decay * 100 * MB) / (1 + decay))
+    # an outlier fades out as new cycles come in
+    ledger = ledger_with(tmp_path, atms=[(1.0, 1000 * MB, MB, 'ok')] + [(1.0, 100 * MB, MB, 'ok')] * 4)
+    assert ledger.rss_estimate('atms', MB) < 200 * MB
+
+
+def test_rss_estimate_scale_bounds(tmp_path):
+    ledger = ledger_with(tmp_path, atms=[(1.0, 100 * MB, 100 * MB, 'ok')])
+    assert ledger.rss_estimate('atms', 150 * MB) == pytest.approx(150 * MB)
+    assert ledger.rss_estimate('atms', 1000 * MB) == pytest.approx(100 * MB * runtime_ledger.RSS_SCALE_MAX)
+    assert ledger.rss_estimate('atms', MB) == pytest.approx(100 * MB * runtime_ledger.RSS_SCALE_MIN)
+    # without an input size to scale with, the peak as it was
+    assert ledger.rss_estimate('atms', 0) == pytest.approx(100 * MB)
+
+
+def test_rss_estimate_skips_failed(tmp_path):
+    ledger = ledger_with(tmp_path, atms=[(1.0, 100 * MB, MB, 'ok'), (1.0, 900 * MB, MB, 'failed'), (1.0, 0, MB, 'ok')])
+    assert ledger.rss_estimate('atms', MB) == pytest.approx(100 * MB)
+    assert ledger.rss_estimate('mhs', MB) is None
+
+
+def test_corrupt_ledger(tmp_path):
+    path = tmp_path / 'ledger.json'
+    path.write_text('{"version": 1, "obtypes"')
+    assert RuntimeLedger(str(path)).obtypes == {}
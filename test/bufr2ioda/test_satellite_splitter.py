@@ -0,0 +1,129 @@
+# test_satellite_splitter.py
+# SatelliteSplitter against the boolean mask per satellite it replaces
+import multiprocessing as mp
+import os
+import numpy as np
+import numpy.ma as ma
+import pytest
+from converter_pool import converter_executor
+from satellite_splitter import SatelliteSplitter
+
+
+def mask_loop(satid, sat, *variables, keep=None):
+    # the rows of satellite sat as the converters selected them, one mask and copy per variable
+    mask = ma.filled(satid == sat, False)
+    if keep is not None:
+        mask &= ma.filled(keep, False)
+    return [var[mask] for var in variables]
+
+
+def same_rows(a, b):
+    return (np.array_equal(ma.getdata(a), ma.getdata(b)) and
+            np.array_equal(ma.getmaskarray(a), ma.getmaskarray(b)))
+
+
+@pytest.fixture
+def obs():
+    rng = np.random.default_rng(0)
+    n = 500
+    satid = ma.masked_array(rng.choice([270, 271, 224, 783], n).astype(np.int32), mask=rng.random(n) < 0.05)
+    lat = ma.masked_array(rng.uniform(-90, 90, n).astype(np.float32), mask=rng.random(n) < 0.1)
+    radiance = rng.random((n, 3)).astype(np.float32)
+    zenith = rng.uniform(0, 90, n).astype(np.float32)
+    return satid, lat, radiance, zenith
+
+
+def test_same_as_mask(obs):
+    satid, lat, radiance, zenith = obs
+    splitter = SatelliteSplitter(satid)
+    assert splitter.satids.tolist() == [224, 270, 271, 783]
+    sorted_vars = splitter.sort(lat, radiance)
+    for sat in splitter.satids:
+        for taken, reference in zip(splitter.take(sat, *sorted_vars), mask_loop(satid, sat, lat, radiance)):
+            assert same_rows(taken, reference)
+
+
+def test_same_as_mask_with_keep(obs):
+    satid, lat, radiance, zenith = obs
+    keep = (zenith > 0) & (zenith < 80)
+    splitter = SatelliteSplitter(satid, keep)
+    sorted_vars = splitter.sort(lat, radiance)
+    for sat in splitter.satids:
+        for taken, reference in zip(splitter.take(sat, *sorted_vars), mask_loop(satid, sat, lat, radiance, keep=keep)):
+            assert same_rows(taken, reference)
+
+
+def test_take_returns_views(obs):
+    satid, lat, radiance, zenith = obs
+    splitter = SatelliteSplitter(satid)
+    sorted_radiance, = splitter.sort(radiance)
+    taken, = splitter.take(splitter.satids[0], sorted_radiance)
+    assert np.shares_memory(taken, sorted_radiance)
+
+
+def test_satellite_without_kept_rows():
+    satid = np.array([270, 271, 270], dtype=np.int32)
+    splitter = SatelliteSplitter(satid, keep=np.array([True, False, True]))
+    assert splitter.satids.tolist() == [270, 271]
+    lat, = splitter.sort(np.array([1.0, 2.0, 3.0]))
+    assert splitter.take(270, lat)[0].tolist() == [1.0, 3.0]
+    assert splitter.take(271, lat)[0].shape == (0,)
+
+
+def test_empty():
+    splitter = SatelliteSplitter(ma.masked_array(np.array([], dtype=np.int32)))
+    assert len(splitter.satids) == 0
+    assert splitter.sort(np.array([], dtype=np.float32))[0].shape == (0,)
+    assert splitter.write(lambda sat: sat) == []
+
+
+def test_all_masked_satid():
+    splitter = SatelliteSplitter(ma.masked_array(np.array([270, 271], dtype=np.int32), mask=True))
+    assert len(splitter.satids) == 0
+    assert splitter.write(lambda sat: sat) == []
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_write(obs, workers):
+    satid, lat, radiance, zenith = obs
+    splitter = SatelliteSplitter(satid)
+    sorted_lat, = splitter.sort(lat)
+
+    def write(sat):
+        # None results are dropped
+        return None if sat == 271 else (sat, splitter.take(sat, sorted_lat)[0].count())
+
+    expected = [(sat, reference.count()) for sat in (224, 270, 783) for reference in mask_loop(satid, sat, lat)]
+    assert splitter.write(write, workers) == expected
+
+
+def write_in_worker(workers):
+    # a converter splitting its obs in a pool worker: the rows written per
+    # satellite, and the processes that wrote them
+    satid = np.array([783, 270, 224, 270, 783, 271, 224], dtype=np.int32)
+    splitter = SatelliteSplitter(satid)
+    sorted_rows, = splitter.sort(np.arange(len(satid)))
+
+    def write(sat):
+        return int(sat), splitter.take(sat, sorted_rows)[0].tolist(), os.getpid()
+
+    return os.getpid(), splitter.write(write, workers)
+
+
+expected_rows = [(224, [2, 6]), (270, [1, 3]), (271, [5]), (783, [0, 4])]
+
+
+def test_write_in_converter_pool_worker():
+    # the workers of the in-process converter pool may fork the writers
+    with converter_executor(1, [], 1) as executor:
+        worker, results = executor.submit(write_in_worker, 3).result()
+    assert [(sat, rows) for sat, rows, pid in results] == expected_rows
+    assert worker not in [pid for sat, rows, pid in results]
+
+
+def test_write_in_daemonic_process():
+    # a daemonic process may not fork: the same results, written serially
+    with mp.get_context('fork').Pool(1) as pool:
+        worker, results = pool.apply(write_in_worker, (3,))
+    assert [(sat, rows) for sat, rows, pid in results] == expected_rows
+    assert {pid for sat, rows, pid in results} == {worker}
@@ -0,0 +1,204 @@
+# test_satwnd_amv_fanout.py
+# the per-converter views of the shared satwnd decode against the decode of
+# the converter's own subsets they replace
+import types
+import numpy as np
+import numpy.ma as ma
+import pytest
+import satwnd_amv_fanout
+from converter_pool import load_converter
+from satwnd_amv_fanout import ResultSetView, fanout, subset_name, subset_rows
+
+FLOAT_FILL = np.float32(10e10)
+
+
+class QuerySet:
+    def __init__(self, subsets):
+        self.subsets = subsets
+        self.queries = []
+
+    def add(self, name, path):
+        self.queries.append((name, path))
+
+
+class ResultSet:
+    """
+    get of a bufr.ResultSet over the rows of some subsets of a dump, each
+    row a (subset, {element: value}). A name qualified with a subset is
+    missing in the rows of the other subsets, a missing element is masked,
+    a string element is not.
+    """
+
+    def __init__(self, rows, subsets):
+        self.rows = [row for row in rows if row[0] in subsets]
+
+    def get(self, name, **kwargs):
+        subset, _, element = name.rpartition('__')
+        values = [elements.get(element) if subset in ('', s) else None for s, elements in self.rows]
+        if element == 'stationName':
+            return np.array(['' if v is None else v for v in values], dtype=object)
+        return ma.masked_array(np.array([0.0 if v is None else v for v in values], dtype=np.float32),
+                               mask=[v is None for v in values], fill_value=FLOAT_FILL)
+
+    def get_datetime(self, *names, **kwargs):
+        minutes = self.get(names[0])
+        return ma.masked_array(np.datetime64('2021-06-30T06:00', 's') + ma.getdata(minutes).astype('m8[m]'),
+                               mask=ma.getmaskarray(minutes))
+
+
+class File:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, q):
+        return ResultSet(self.rows, q.subsets)
+
+
+def row(subset, lat, pressure=50000.0, name='GOES'):
+    return (subset, {'latitude': lat, 'pressure': pressure, 'stationName': name})
+
+
+# goes has two subsets, interleaved in the file with the one of ahi
+rows = [row('NC005030', 10.0), row('NC005044', 20.0), row('NC005031', 30.0), row('NC005030', 40.0, pressure=None),
+        row('NC005044', 50.0), row('NC005031', None, pressure=60000.0)]
+queries = [('stationName', '*/NAME'), ('latitude', '*/CLATH'), ('pressure', '*/PRLC[1]')]
+
+
+def shared(rows):
+    subsets = sorted({subset for subset, _ in rows})
+    return ResultSet(rows, subsets), subsets
+
+
+def same_array(a, b):
+    return (a.dtype == b.dtype and a.shape == b.shape and
+            np.array_equal(ma.getdata(a), ma.getdata(b)) and
+            np.array_equal(ma.getmaskarray(a), ma.getmaskarray(b)) and
+            a.fill_value == b.fill_value)
+
+
+def test_subset_rows():
+    result, subsets = shared(rows)
+    # a row is the subset's if any of its numeric elements is present, the string is ignored
+    assert subset_rows(result, 'NC005030', queries).tolist() == [True, False, False, True, False, False]
+    assert subset_rows(result, 'NC005031', queries).tolist() == [False, False, True, False, False, True]
+    assert subset_rows(result, 'NC005044', queries).tolist() == [False, True, False, False, True, False]
+    with pytest.raises(ValueError):
+        subset_rows(result, 'NC005030', queries[:1])
+
+
+@pytest.mark.parametrize('subsets', [['NC005030', 'NC005031'], ['NC005044'], ['NC005031', 'NC005030']],
+                         ids=['two subsets', 'one subset', 'out of file order'])
+def test_same_as_own_decode(subsets):
+    # the rows of the converter's subsets, in file order, as its own QuerySet returns them
+    result, all_subsets = shared(rows)
+    view = ResultSetView(result, subsets, {s: subset_rows(result, s, queries) for s in all_subsets})
+    own = ResultSet(rows, subsets)
+    for name in ('latitude', 'pressure'):
+        assert same_array(view.get(name), own.get(name)), name
+    assert view.get_datetime('latitude').tolist() == own.get_datetime('latitude').tolist()
+
+
+class Columns:
+    # get of a ResultSet returning given arrays
+    def __init__(self, columns):
+        self.columns = columns
+
+    def get(self, name, **kwargs):
+        return self.columns[name]
+
+
+def test_stitch_repeated_elements():
+    # rows 0 and 2 of subset A have 2 levels, row 1 of subset B has 3
+    a = ma.masked_array(np.arange(6, dtype=np.float32).reshape(3, 2), fill_value=FLOAT_FILL)
+    b = ma.masked_array(np.arange(10, 19, dtype=np.float32).reshape(3, 3), mask=[[0, 0, 1]] * 3,
+                        fill_value=FLOAT_FILL)
+    result = Columns({subset_name('A', 'levels'): a, subset_name('B', 'levels'): b})
+    view = ResultSetView(result, ['A', 'B'], {'A': np.array([True, False, True]), 'B': np.array([False, True, False])})
+    stitched = view.get('levels')
+    assert stitched.shape == (3, 3)
+    assert stitched.fill_value == FLOAT_FILL
+    assert stitched.tolist() == [[0.0, 1.0, None], [13.0, 14.0, None], [4.0, 5.0, None]]
+
+    result.columns[subset_name('B', 'levels')] = ma.masked_array(np.zeros(3, dtype=np.float32))
+    with pytest.raises(ValueError):
+        view.get('levels')
+
+
+def test_stitch_one_subset_is_its_rows():
+    a = ma.masked_array(np.arange(4, dtype=np.float32), mask=[0, 1, 0, 0], fill_value=FLOAT_FILL)
+    result = Columns({subset_name('A', 'latitude'): a})
+    view = ResultSetView(result, ['A'], {'A': np.array([True, True, False, True])})
+    assert same_array(view.get('latitude'), a[[0, 1, 3]])
+
+
+converter_script = """
+calls = []
+
+
+def build_query(q):
+    q.add('stationName', '*/NAME')
+    q.add('latitude', '*/CLATH')
+    q.add('pressure', '*/PRLC[1]')
+    return q
+
+
+def bufr_to_ioda(config, logger, r=None):
+    calls.append(r)
+"""
+
+
+@pytest.fixture
+def converters(tmp_path):
+    converters = []
+    for obtype, subsets in (('satwnd_amv_goes', ['NC005030', 'NC005031']), ('satwnd_amv_ahi', ['NC005044'])):
+        script = tmp_path / f'bufr2ioda_{obtype}.py'
+        script.write_text(converter_script)
+        converters.append((obtype, str(script), {'subsets': subsets}))
+    return converters
+
+
+def run_fanout(monkeypatch, rows, converters):
+    monkeypatch.setattr(satwnd_amv_fanout, 'bufr', types.SimpleNamespace(QuerySet=QuerySet, File=lambda path: File(rows)))
+    status = fanout('gdas.t06z.satwnd.tm00.bufr_d', converters, workers=1)
+    assert status == {'satwnd_amv_goes': 'ok', 'satwnd_amv_ahi': 'ok'}
+    calls = {}
+    for obtype, script, config in converters:
+        r, = load_converter(script).calls
+        calls[obtype] = r
+    return calls
+
+
+def test_fanout_views(monkeypatch, converters):
+    monkeypatch.delenv(satwnd_amv_fanout.CHECK_ENV, raising=False)
+    calls = run_fanout(monkeypatch, rows, converters)
+    assert ma.getdata(calls['satwnd_amv_goes'].get('pressure')).tolist() == [50000.0, 50000.0, 0.0, 60000.0]
+    assert calls['satwnd_amv_ahi'].get('latitude').tolist() == [20.0, 50.0]
+
+
+def test_unclaimed_rows_decode_standalone(monkeypatch, converters):
+    # a row missing every queried numeric element belongs to no subset: no converter gets a view
+    calls = run_fanout(monkeypatch, rows + [row('NC005044', None, pressure=None)], converters)
+    assert calls == {'satwnd_amv_goes': None, 'satwnd_amv_ahi': None}
+
+
+def test_check_against_own_decode(monkeypatch, converters):
+    monkeypatch.setenv(satwnd_amv_fanout.CHECK_ENV, '1')
+    calls = run_fanout(monkeypatch, rows, converters)
+    assert all(isinstance(r, ResultSetView) for r in calls.values())
+
+
+def test_check_mismatch_decodes_standalone(monkeypatch, converters):
+    # the converter whose rows differ from its own decode gets none, the others keep their view
+    monkeypatch.setenv(satwnd_amv_fanout.CHECK_ENV, '1')
+    standalone_rows = satwnd_amv_fanout.standalone_rows
+    monkeypatch.setattr(satwnd_amv_fanout, 'standalone_rows',
+                        lambda bufrfile, script, subsets: standalone_rows(bufrfile, script, subsets) + ('NC005044' in subsets))
+    calls = run_fanout(monkeypatch, rows, converters)
+    assert isinstance(calls['satwnd_amv_goes'], ResultSetView)
+    assert calls['satwnd_amv_ahi'] is None
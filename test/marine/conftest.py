@@ -0,0 +1,45 @@
+# conftest.py
+# the b2iconverter package is imported from ush/ioda/bufr2ioda/marine/b2i,
+# and the modules it shares with the bufr2ioda converters from ush/ioda/bufr2ioda.
+# The soca package of prep_ocean_obs is imported from ush.
+# The tests exercise its numpy helpers only: the modules it imports that are
+# not installed, such as the bufr and ioda bindings outside of a JEDI build,
+# are replaced by empty modules, and a test that needs bufr sets its own
+import importlib
+import os
+import sys
+import types
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+bufr2ioda_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'ush', 'ioda', 'bufr2ioda')
+sys.path.insert(0, bufr2ioda_dir)
+sys.path.insert(0, os.path.join(bufr2ioda_dir, 'marine', 'b2i'))
+sys.path.append(os.path.join(bufr2ioda_dir, '..', '..'))
+
+for name in ('xarray', 'pyiodaconv.bufr', 'pyioda.ioda_obs_space'):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        parent = None
+        for i, part in enumerate(name.split('.')):
+            full_name = '.'.join(name.split('.')[:i + 1])
+            module = sys.modules.setdefault(full_name, types.ModuleType(full_name))
+            if parent is not None:
+                setattr(parent, part, module)
+            parent = module
+
+
+@pytest.fixture
+def ocean_basin_nc_file(tmp_path):
+    # a 10 degree regular grid of basins, laid out like the RECCAP2 region masks
+    path = str(tmp_path / 'basins.nc')
+    rng = np.random.default_rng(0)
+    with nc.Dataset(path, 'w') as f:
+        f.createDimension('lat', 18)
+        f.createDimension('lon', 36)
+        f.createVariable('lat', 'f8', ('lat',))[:] = np.arange(-85.0, 90.0, 10.0)
+        f.createVariable('lon', 'f8', ('lon',))[:] = np.arange(5.0, 360.0, 10.0)
+        f.createVariable('open_ocean', 'i2', ('lat', 'lon'))[:] = rng.integers(0, 10, (18, 36))
+    return path
@@ -0,0 +1,109 @@
+# test_basin_cache.py
+# the memory-mapped basin cache against the nc file it is made from
+import os
+import numpy as np
+import netCDF4 as nc
+import pytest
+from b2iconverter import ocean
+from b2iconverter.ocean import OceanBasin, basin_cache_path, read_basin_cache, write_basin_cache
+from soca.prep_ocean_obs_utils import write_ocean_basin_cache
+
+b2i_dir = os.path.dirname(os.path.dirname(ocean.__file__))
+
+
+def station_basins(nc_file_path):
+    ocean = OceanBasin()
+    ocean.set_ocean_basin_nc_file(nc_file_path)
+    ocean.read_nc_file()
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-90, 90, 500)
+    lon = rng.uniform(-180, 360, 500)
+    return ocean.get_station_basin(lat, lon)
+
+
+def test_round_trip(ocean_basin_nc_file):
+    grid, basin_array = read_basin_cache(write_basin_cache(ocean_basin_nc_file))
+    with nc.Dataset(ocean_basin_nc_file, 'r') as f:
+        assert np.array_equal(basin_array, f.variables['open_ocean'][:])
+        assert basin_array.dtype == f.variables['open_ocean'].dtype
+        assert grid['lat0'] == f.variables['lat'][0]
+        assert grid['dlon'] == f.variables['lon'][1] - f.variables['lon'][0]
+    assert isinstance(basin_array, np.memmap)
+    assert not basin_array.flags.writeable
+
+
+def test_same_basins_as_nc_file(ocean_basin_nc_file):
+    from_nc = station_basins(ocean_basin_nc_file)
+    write_basin_cache(ocean_basin_nc_file)
+    from_cache = station_basins(ocean_basin_nc_file)
+    assert from_cache.tolist() == from_nc.tolist()
+
+
+def test_stale_cache_is_ignored(ocean_basin_nc_file):
+    cache_path = write_basin_cache(ocean_basin_nc_file)
+    cached = station_basins(ocean_basin_nc_file)
+    # the nc file is updated after the cache was written
+    with nc.Dataset(ocean_basin_nc_file, 'a') as f:
+        f.variables['open_ocean'][:] = f.variables['open_ocean'][:] + 10
+    mtime = os.path.getmtime(cache_path)
+    os.utime(ocean_basin_nc_file, (mtime + 10, mtime + 10))
+    assert station_basins(ocean_basin_nc_file).tolist() == [b + 10 for b in cached.tolist()]
+    # until the cache is written again
+    write_basin_cache(ocean_basin_nc_file)
+    os.utime(basin_cache_path(ocean_basin_nc_file), (mtime + 20, mtime + 20))
+    assert station_basins(ocean_basin_nc_file).tolist() == [b + 10 for b in cached.tolist()]
+
+
+def test_missing_cache(ocean_basin_nc_file):
+    assert not os.path.exists(basin_cache_path(ocean_basin_nc_file))
+    assert len(station_basins(ocean_basin_nc_file)) == 500
+
+
+def test_irregular_grid_is_refused(tmp_path):
+    path = str(tmp_path / 'irregular.nc')
+    with nc.Dataset(path, 'w') as f:
+        f.createDimension('lat', 3)
+        f.createDimension('lon', 3)
+        f.createVariable('lat', 'f8', ('lat',))[:] = [0.0, 1.0, 3.0]
+        f.createVariable('lon', 'f8', ('lon',))[:] = [0.0, 1.0, 2.0]
+        f.createVariable('open_ocean', 'i2', ('lat', 'lon'))[:] = np.zeros((3, 3))
+    with pytest.raises(ValueError):
+        write_basin_cache(path)
+    assert not os.path.exists(basin_cache_path(path))
+
+
+def station_basins_from_nc(nc_file_path):
+    # the basins read from the nc file, with the cache out of the way
+    cache_path = basin_cache_path(nc_file_path)
+    os.rename(cache_path, f"{cache_path}.saved")
+    try:
+        return station_basins(nc_file_path).tolist()
+    finally:
+        os.rename(f"{cache_path}.saved", cache_path)
+
+
+def test_cycle_cache_written_when_missing_or_stale(ocean_basin_nc_file):
+    cache_path = basin_cache_path(ocean_basin_nc_file)
+    write_ocean_basin_cache(ocean_basin_nc_file, b2i_dir)
+    assert station_basins(ocean_basin_nc_file).tolist() == station_basins_from_nc(ocean_basin_nc_file)
+
+    # an up to date cache is kept as it is
+    mtime = os.path.getmtime(ocean_basin_nc_file) - 100
+    os.utime(ocean_basin_nc_file, (mtime, mtime))
+    os.utime(cache_path, (mtime + 10, mtime + 10))
+    write_ocean_basin_cache(ocean_basin_nc_file, b2i_dir)
+    assert os.path.getmtime(cache_path) == mtime + 10
+
+    # a cache older than the nc file is written again
+    with nc.Dataset(ocean_basin_nc_file, 'a') as f:
+        f.variables['open_ocean'][:] = f.variables['open_ocean'][:] + 10
+    os.utime(ocean_basin_nc_file, (mtime + 20, mtime + 20))
+    write_ocean_basin_cache(ocean_basin_nc_file, b2i_dir)
+    assert os.path.getmtime(cache_path) >= mtime + 20
+    assert station_basins(ocean_basin_nc_file).tolist() == station_basins_from_nc(ocean_basin_nc_file)
+
+
+def test_cycle_cache_failure_is_not_fatal(tmp_path):
+    # the converters read the nc file instead
+    write_ocean_basin_cache(str(tmp_path / 'missing.nc'), b2i_dir)
+    assert not os.path.exists(basin_cache_path(str(tmp_path / 'missing.nc')))
@@ -0,0 +1,137 @@
+# test_batch.py
+# the jobs of a batch config against the conversions of one cycle each, and
+# the batch config prep_ocean_obs writes for an obs space
+import json
+import logging
+import os
+import types
+import pytest
+import yaml
+from b2iconverter.bufr2ioda_converter import Bufr2iodaJob, Bufr2ioda_Converter
+from soca import prep_ocean_obs_utils
+
+jobs = [['2021063000', '2021063000-gdas.t00z.subpfl.tm00.bufr_d', 'gdas.t00z.insitu_profile_argo.2021063000.nc'],
+        ['2021063006', '2021063006-gdas.t06z.subpfl.tm00.bufr_d', 'gdas.t06z.insitu_profile_argo.2021063006.nc'],
+        ['2021063012']]
+
+
+class Config:
+    # the job entries of a Bufr2iodaConfig
+    def __init__(self, jobs=None, merge_output=None, job_workers=1):
+        self.jobs = jobs
+        self.merge_output = merge_output
+        self.job_workers = job_workers
+
+    def set_job(self, cycle_datetime, input_file=None, output_file=None):
+        self.job = Bufr2iodaJob(cycle_datetime, input_file, output_file)
+
+
+class IodaVars:
+    def __init__(self):
+        self.queries = 0
+        self.additional_vars = types.SimpleNamespace(load_ocean_basin=lambda: None)
+
+    def build_query(self):
+        self.queries += 1
+        return 'QuerySet'
+
+
+def make_converter(tmp_path, failing=(), config=None):
+    # converts the job of the config, marking it done in tmp_path, forked workers included
+    converter = Bufr2ioda_Converter.__new__(Bufr2ioda_Converter)
+    converter.bufr2ioda_config = config or Config()
+    converter.ioda_vars = IodaVars()
+    converter.logger = logging.getLogger('test_batch')
+    converter.query = None
+
+    def convert():
+        job = converter.bufr2ioda_config.job
+        (tmp_path / job.cycle).write_text(json.dumps(job))
+        if job.cycle in failing:
+            raise RuntimeError(f"no {job.cycle} dump")
+        return True
+
+    converter.convert = convert
+    return converter
+
+
+def converted(tmp_path):
+    return {cycle: json.loads((tmp_path / cycle).read_text()) for cycle in os.listdir(tmp_path)}
+
+
+@pytest.mark.parametrize('workers', [1, 2, 5])
+def test_every_job_converted(tmp_path, workers):
+    converter = make_converter(tmp_path)
+    assert converter.run_batch(jobs, workers) == []
+    assert converted(tmp_path) == {job[0]: list(Bufr2iodaJob(*job)) for job in jobs}
+    # the QuerySet is built once for the batch
+    assert converter.ioda_vars.queries == 1
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_failed_jobs_are_returned(tmp_path, workers):
+    converter = make_converter(tmp_path, failing=('2021063006',))
+    assert converter.run_batch(jobs, workers) == [Bufr2iodaJob(*jobs[1])]
+    # the others are converted
+    assert sorted(converted(tmp_path)) == ['2021063000', '2021063006', '2021063012']
+
+
+def test_failed_batch_exits_nonzero(tmp_path):
+    converter = make_converter(tmp_path, failing=('2021063012',), config=Config(jobs))
+    with pytest.raises(SystemExit) as exit:
+        converter.run()
+    assert exit.value.code == 1
+    converter = make_converter(tmp_path, config=Config(jobs))
+    converter.run()
+
+
+@pytest.fixture
+def batch_run(tmp_path, monkeypatch):
+    # the batch config and the command run_bufr_to_ioda starts for an obs space
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'bufr2ioda_insitu_profile_argo.yaml').write_text(yaml.safe_dump(
+        {'cycle_datetime': '2021063012', 'data_format': 'subpfl', 'ocean_basin': 'basins.nc'}))
+    runs = []
+
+    def run(args, check=False, env=None):
+        with open(args[3]) as f:
+            runs.append((args, yaml.safe_load(f), env['PYTHONPATH']))
+
+    monkeypatch.setattr(prep_ocean_obs_utils.subprocess, 'run', run)
+    return runs
+
+
+def obsspace(**entries):
+    return dict({'name': 'insitu_profile_argo',
+                 'conversion config file': 'bufr2ioda_insitu_profile_argo.yaml',
+                 'bufr2ioda converter': '/gdas/ush/ioda/bufr2ioda/marine/b2i/bufr2ioda_insitu_profile_argo.py',
+                 'bufrconv files': jobs[:2]}, **entries)
+
+
+def test_single_batch_config(batch_run):
+    prep_ocean_obs_utils.run_bufr_to_ioda(obsspace(**{'bufr2ioda workers': 2}))
+    (args, config, pythonpath), = batch_run
+    assert args == ['python', '/gdas/ush/ioda/bufr2ioda/marine/b2i/bufr2ioda_insitu_profile_argo.py',
+                    '-c', 'batch.bufr2ioda_insitu_profile_argo.yaml']
+    assert pythonpath.split(os.pathsep)[0] == '/gdas/ush/ioda/bufr2ioda'
+    # every cycle in one config, the first fills the entries of one cycle
+    assert config['jobs'] == jobs[:2]
+    assert config['job_workers'] == 2
+    assert (config['cycle_datetime'], config['input_file'], config['output_file']) == tuple(jobs[0])
+    assert config['ocean_basin'] == 'basins.nc'
+    assert 'merge_output' not in config
+
+
+def test_merged_batch_config(batch_run):
+    prep_ocean_obs_utils.run_bufr_to_ioda(obsspace(**{'merge output': 'gdas.t12z.insitu_profile_argo.nc'}))
+    (args, config, pythonpath), = batch_run
+    assert config['jobs'] == jobs[:2]
+    assert config['job_workers'] == 1
+    # the config keeps the cycle of the window
+    assert config['cycle_datetime'] == '2021063012'
+    assert config['merge_output'] == config['output_file'] == 'gdas.t12z.insitu_profile_argo.nc'
+
+
+def test_no_files_no_run(batch_run):
+    prep_ocean_obs_utils.run_bufr_to_ioda(obsspace(**{'bufrconv files': []}))
+    assert batch_run == []
@@ -0,0 +1,76 @@
+# test_hash.py
+# the streamed test hashes against the hashes of the copied bytes they replace
+import hashlib
+import numpy as np
+import numpy.ma as ma
+import pytest
+from b2iconverter import util
+from b2iconverter.util import compute_fingerprint, compute_hash, compute_string_hash
+
+
+def bytes_hash(sequence):
+    # the hash of the test logs: a copy of the whole array as bytes
+    return hashlib.sha256(bytes(sequence)).hexdigest()
+
+
+@pytest.fixture(params=[1 << 20, 64], ids=['one block', 'small blocks'])
+def block_size(request, monkeypatch):
+    monkeypatch.setattr(util, 'HASH_BLOCK_SIZE', request.param)
+    monkeypatch.delenv(util.HASH_FINGERPRINT_ENV, raising=False)
+    return request.param
+
+
+@pytest.mark.parametrize('array', [
+    np.arange(1000, dtype=np.float32),
+    np.arange(1000, dtype=np.int64)[::3],
+    np.arange(600, dtype=np.float64).reshape(20, 30).T,
+    np.array(7.5),
+    np.array([], dtype=np.int32),
+    np.zeros((0, 4), dtype=np.float32),
+], ids=['contiguous', 'strided', 'transposed', '0-d', 'empty', 'empty 2-d'])
+def test_same_as_bytes(block_size, array):
+    assert compute_hash(array) == bytes_hash(array)
+
+
+def test_masked_hashes_data(block_size):
+    data = np.arange(100, dtype=np.float32)
+    masked = ma.masked_array(data, mask=data % 7 == 0)
+    assert compute_hash(masked) == bytes_hash(data)
+    assert compute_hash(masked[::2]) == bytes_hash(data[::2])
+
+
+def test_sequence(block_size):
+    assert compute_hash([1, 2, 3]) == bytes_hash([1, 2, 3])
+    assert compute_hash([]) == bytes_hash([])
+
+
+@pytest.mark.parametrize('strings', [
+    ['5901234', '5905678', '', 'Ω7900001'],
+    np.array(['a', 'bc', 'def'] * 50),
+    [],
+], ids=['list', 'array', 'empty'])
+def test_string_hash_same_as_join(block_size, strings):
+    assert compute_string_hash(strings) == hashlib.sha256(''.join(strings).encode()).hexdigest()
+
+
+def test_fingerprint_tells_apart_layouts():
+    data = np.arange(12, dtype=np.int32)
+    assert compute_hash(data) == compute_hash(data.reshape(3, 4))
+    assert compute_fingerprint(data) != compute_fingerprint(data.reshape(3, 4))
+    assert compute_fingerprint(data) != compute_fingerprint(data.view(np.float32))
+    masked = ma.masked_array(data, mask=data == 5)
+    assert compute_hash(masked) == compute_hash(data)
+    assert compute_fingerprint(masked) != compute_fingerprint(data)
+    assert compute_fingerprint(masked) == compute_fingerprint(ma.masked_array(data.copy(), mask=data == 5))
+
+
+def test_fingerprint_option(monkeypatch):
+    data = ma.masked_array(np.arange(12, dtype=np.int32), mask=np.arange(12) == 5)
+    monkeypatch.delenv(util.HASH_FINGERPRINT_ENV, raising=False)
+    assert compute_hash(data) == bytes_hash(np.arange(12, dtype=np.int32))
+    assert compute_hash(data, fingerprint=True) == compute_fingerprint(data)
+    monkeypatch.setenv(util.HASH_FINGERPRINT_ENV, '1')
+    assert compute_hash(data) == compute_fingerprint(data)
+    assert compute_hash(data, fingerprint=False) == bytes_hash(np.arange(12, dtype=np.int32))
+    # sequences are hashed as bytes either way
+    assert compute_hash([1, 2, 3]) == bytes_hash([1, 2, 3])
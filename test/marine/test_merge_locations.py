@@ -0,0 +1,94 @@
+# test_merge_locations.py
+# the locations of a merged window against a comparison of every pair of
+# locations, and the concatenation of the cycles they come from
+import numpy as np
+import numpy.ma as ma
+import pytest
+from b2iconverter.bufr2ioda_converter import merge_locations, unique_locations
+
+FLOAT_FILL = np.float32(10e10)
+
+
+def same_location(columns, i, j):
+    # equal values, masked in the same places, whatever is under the mask
+    for column in columns:
+        a, b = ma.getmaskarray(column[i]), ma.getmaskarray(column[j])
+        if not np.array_equal(a, b):
+            return False
+        x, y = ma.getdata(column[i])[~a], ma.getdata(column[j])[~b]
+        if not np.array_equal(x, y, equal_nan=x.dtype.kind == 'f'):
+            return False
+    return True
+
+
+def unique_loop(columns, cycles):
+    return [i for i in range(len(cycles))
+            if not any(cycles[j] < cycles[i] and same_location(columns, i, j) for j in range(len(cycles)))]
+
+
+def floats(values, mask=False):
+    return ma.masked_array(np.array(values, dtype=np.float32), mask=mask, fill_value=FLOAT_FILL)
+
+
+def test_duplicates_across_cycles():
+    # the 06z dump repeats two reports of the 00z one, and one of them twice
+    lat = floats([10.0, 20.0, 30.0, 10.0, 20.0, 20.0, 40.0])
+    sid = np.array(['a', 'b', 'c', 'a', 'b', 'b', 'd'])
+    cycles = np.array([0, 0, 0, 1, 1, 1, 1])
+    assert unique_locations([lat, sid], cycles).tolist() == [0, 1, 2, 6]
+
+
+def test_duplicates_within_a_cycle_are_kept():
+    lat = floats([10.0, 10.0, 10.0])
+    assert unique_locations([lat], np.array([0, 0, 1])).tolist() == [0, 1]
+
+
+def test_earlier_cycle_is_kept():
+    # whatever the order of the locations, the report of the earlier cycle stays
+    lat = floats([10.0, 20.0, 10.0, 30.0])
+    cycles = np.array([2, 2, 1, 0])
+    assert unique_locations([lat], cycles).tolist() == [1, 2, 3]
+
+
+def test_masked_values():
+    # masked the same way is the same location, whatever the data under the mask;
+    # a masked value and an unmasked fill value are not
+    temp = floats([280.0, 1.0, 285.0, 2.0, FLOAT_FILL], mask=[False, True, False, True, False])
+    lat = floats([10.0, 20.0, 10.0, 20.0, 20.0])
+    cycles = np.array([0, 0, 1, 1, 1])
+    assert unique_locations([lat, temp], cycles).tolist() == [0, 1, 2, 4]
+    # nan is one value
+    assert unique_locations([floats([np.nan, np.nan])], np.array([0, 1])).tolist() == [0]
+
+
+def test_levels():
+    # a location of a profile is its row
+    temp = ma.masked_array(np.array([[1.0, 2.0], [1.0, 3.0], [1.0, 2.0]], dtype=np.float32),
+                           mask=[[False, False], [False, True], [False, False]])
+    assert unique_locations([temp], np.array([0, 0, 1])).tolist() == [0, 1]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_same_as_pairs(seed):
+    rng = np.random.default_rng(seed)
+    n = 60
+    cycles = np.sort(rng.integers(0, 4, n))
+    # few distinct values, so that locations repeat within and across cycles
+    columns = [floats(rng.integers(0, 3, n), mask=rng.random(n) < 0.2),
+               rng.integers(0, 2, n).astype(np.int32),
+               floats(rng.integers(0, 2, (n, 2)), mask=rng.random((n, 2)) < 0.2)]
+    assert unique_locations(columns, cycles).tolist() == unique_loop(columns, cycles)
+
+
+def test_merge_locations():
+    parts = [{('metadata', 'lat'): floats([10.0, 20.0], mask=[False, True]),
+              ('metadata', 'stationID'): np.array(['a', 'b'])},
+             {('metadata', 'lat'): floats([30.0]),
+              ('metadata', 'stationID'): np.array(['c'])}]
+    merged = merge_locations(parts)
+    lat = merged[('metadata', 'lat')]
+    assert lat.tolist() == [10.0, None, 30.0]
+    # the fill value the ioda variable is written with
+    assert lat.fill_value == FLOAT_FILL
+    assert type(merged[('metadata', 'stationID')]) is np.ndarray
+    assert merged[('metadata', 'stationID')].tolist() == ['a', 'b', 'c']
@@ -0,0 +1,75 @@
+# test_ocean_basin.py
+# OceanBasin.get_station_basin against the per-station loop it replaces
+import numpy as np
+import numpy.ma as ma
+import netCDF4 as nc
+import pytest
+from b2iconverter.ocean import OceanBasin
+
+
+def station_basin_loop(nc_file_path, lat, lon):
+    # the loop of get_station_basin: stations with a masked latitude are skipped
+    with nc.Dataset(nc_file_path, 'r') as f:
+        latitudes = f.variables['lat'][:]
+        longitudes = f.variables['lon'][:]
+        basin_array = np.reshape(f.variables['open_ocean'][:], (f.dimensions['lat'].size, f.dimensions['lon'].size))
+    lat0 = latitudes[0]
+    dlat = latitudes[1] - latitudes[0]
+    lon0 = longitudes[0]
+    dlon = longitudes[1] - longitudes[0]
+    ocean_basin = []
+    for i in range(len(lon)):
+        if not ma.is_masked(lat[i]):
+            i1 = round((lat[i] - lat0) / dlat)
+            i2 = round((lon[i] - lon0) / dlon)
+            ocean_basin.append(basin_array[i1][i2])
+    return ocean_basin
+
+
+@pytest.fixture
+def ocean(ocean_basin_nc_file):
+    ocean = OceanBasin()
+    ocean.set_ocean_basin_nc_file(ocean_basin_nc_file)
+    ocean.read_nc_file()
+    return ocean
+
+
+def test_same_as_loop(ocean, ocean_basin_nc_file):
+    rng = np.random.default_rng(0)
+    n = 1000
+    lat = ma.masked_array(rng.uniform(-85, 85, n).astype(np.float32), mask=rng.random(n) < 0.1)
+    lon = ma.masked_array(rng.uniform(5, 355, n).astype(np.float32))
+    basin = ocean.get_station_basin(lat, lon)
+    assert len(basin) == n
+    assert ma.getmaskarray(basin).tolist() == ma.getmaskarray(lat).tolist()
+    assert basin.compressed().tolist() == [int(b) for b in station_basin_loop(ocean_basin_nc_file, lat, lon)]
+
+
+def test_half_grid_rounds_to_even(ocean, ocean_basin_nc_file):
+    # halfway between grid points, as round() in the loop
+    lat = np.array([-80.0, -70.0, 0.0, 10.0])
+    lon = np.array([10.0, 20.0, 30.0, 40.0])
+    basin = ocean.get_station_basin(lat, lon)
+    assert basin.tolist() == [int(b) for b in station_basin_loop(ocean_basin_nc_file, lat, lon)]
+
+
+def test_wraps_longitudes(ocean):
+    # west of the first grid longitude, east of the last, and as negative degrees
+    basin = ocean.get_station_basin(np.array([5.0, 5.0, 5.0]), np.array([1.0, 359.0, -1.0]))
+    reference = ocean.get_station_basin(np.array([5.0, 5.0, 5.0]), np.array([5.0, 355.0, 355.0]))
+    assert basin.tolist() == reference.tolist()
+
+
+def test_invalid_coordinates_are_masked(ocean):
+    lat = ma.masked_array([10.0, np.nan, 20.0, 30.0], mask=[False, False, True, False])
+    lon = ma.masked_array([10.0, 20.0, 30.0, np.inf])
+    basin = ocean.get_station_basin(lat, lon, fill_value=-999)
+    assert ma.getmaskarray(basin).tolist() == [False, True, True, True]
+    assert ma.getdata(basin)[1:].tolist() == [-999, -999, -999]
+    assert basin.dtype == np.int32
+
+
+def test_empty(ocean):
+    basin = ocean.get_station_basin(ma.masked_array([], dtype=np.float32), ma.masked_array([], dtype=np.float32))
+    assert basin.shape == (0,)
+    assert station_basin_loop(ocean.ocean_basin_nc_file_path, [], []) == []
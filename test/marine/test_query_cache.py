@@ -0,0 +1,214 @@
+# test_query_cache.py
+# the cached query results against the ResultSet they were recorded from
+import logging
+import os
+import types
+import numpy as np
+import numpy.ma as ma
+import pytest
+from b2iconverter import bufr2ioda_converter, query_cache
+from b2iconverter.query_cache import (CachedResultSet, QueryCacheMiss, RecordedQuerySet, RecordingResultSet,
+                                      query_cache_dir, query_cache_path)
+
+
+class QuerySet:
+    def add(self, name, path):
+        pass
+
+
+class ResultSet:
+    # get and get_datetime of a bufr.ResultSet
+    def __init__(self, columns):
+        self.columns = columns
+
+    def get(self, name, group_by=None, type=None):
+        return self.columns[name].copy()
+
+    def get_datetime(self, *names, group_by=None):
+        return self.columns['dateTime'].copy()
+
+
+@pytest.fixture(autouse=True)
+def bufr(monkeypatch):
+    monkeypatch.setattr(query_cache, 'bufr', types.SimpleNamespace(QuerySet=QuerySet))
+
+
+@pytest.fixture
+def result():
+    temp = np.array([[290.0, 288.0], [287.5, np.nan], [286.0, 285.0]], dtype=np.float32)
+    return ResultSet({
+        'temp': ma.masked_array(temp, mask=np.isnan(temp), fill_value=np.float32(10e10)),
+        'depth': ma.masked_array(np.array([0, 10, 20], dtype=np.int32), mask=[False, True, False],
+                                 fill_value=np.int32(2147483647)),
+        'stationID': np.array(['5901234', '5901235', ''], dtype=object),
+        'dateTime': ma.masked_array(np.array(['2021-06-30T06:00', '2021-06-30T07:30', 'NaT'], dtype='M8[s]'),
+                                    mask=[False, False, True]),
+        'empty': ma.masked_array(np.array([], dtype=np.float64), fill_value=-1.0),
+        'plain': np.arange(4, dtype=np.uint8),
+    })
+
+
+calls = [(('temp',), {'group_by': 'depth'}),
+         (('depth',), {'group_by': 'depth'}),
+         (('stationID',), {}),
+         (('empty',), {}),
+         (('plain',), {'type': 'int'})]
+
+
+def same_result(a, b):
+    return (type(a) is type(b) and a.dtype == b.dtype and a.shape == b.shape and
+            np.array_equal(ma.getdata(a), ma.getdata(b), equal_nan=a.dtype.kind in 'fmM') and
+            np.array_equal(ma.getmaskarray(a), ma.getmaskarray(b)) and
+            # the same bits, NaT included
+            (not isinstance(a, ma.MaskedArray) or np.asarray(a.fill_value).tobytes() == np.asarray(b.fill_value).tobytes()))
+
+
+def test_round_trip(tmp_path, result):
+    recording = RecordingResultSet(result)
+    originals = [recording.get(*args, **kwargs) for args, kwargs in calls]
+    originals.append(recording.get_datetime('year', 'month', 'day', 'hour', 'minute', group_by='depth'))
+    path = str(tmp_path / 'cache' / 'tank.npz')
+    assert recording.save(path)
+
+    cached = CachedResultSet(path)
+    for (args, kwargs), original in zip(calls, originals):
+        assert same_result(cached.get(*args, **kwargs), original), args
+    assert same_result(cached.get_datetime('year', 'month', 'day', 'hour', 'minute', group_by='depth'),
+                       originals[-1])
+
+
+def test_cached_arrays_are_copies(tmp_path, result):
+    recording = RecordingResultSet(result)
+    recording.get('temp', group_by='depth')
+    path = str(tmp_path / 'tank.npz')
+    recording.save(path)
+    cached = CachedResultSet(path)
+    temp = cached.get('temp', group_by='depth')
+    temp -= 273.15
+    temp.mask[:] = True
+    assert same_result(cached.get('temp', group_by='depth'), result.get('temp'))
+
+
+def test_miss(tmp_path, result):
+    recording = RecordingResultSet(result)
+    recording.get('temp', group_by='depth')
+    path = str(tmp_path / 'tank.npz')
+    recording.save(path)
+    cached = CachedResultSet(path)
+    # another name, other arguments, another method
+    for call in (lambda: cached.get('saln', group_by='depth'),
+                 lambda: cached.get('temp'),
+                 lambda: cached.get_datetime('temp', group_by='depth')):
+        with pytest.raises(QueryCacheMiss):
+            call()
+
+
+def test_objects_are_not_saved(tmp_path):
+    recording = RecordingResultSet(ResultSet({'mixed': np.array(['a', 1], dtype=object)}))
+    recording.get('mixed')
+    path = str(tmp_path / 'tank.npz')
+    assert not recording.save(path)
+    assert not os.path.exists(path)
+
+
+def test_cache_path(tmp_path):
+    bufrfile = tmp_path / 'subpfl.bufr_d'
+    bufrfile.write_bytes(b'BUFR')
+    q = RecordedQuerySet()
+    q.add('latitude', '*/CLATH')
+    q.add('temp', '*/GLPFDATA/SSTH')
+    path = query_cache_path(str(tmp_path), str(bufrfile), q)
+    assert os.path.basename(path).startswith('subpfl.bufr_d.')
+
+    # the order of the queries does not matter, their content does
+    reordered = RecordedQuerySet()
+    reordered.add('temp', '*/GLPFDATA/SSTH')
+    reordered.add('latitude', '*/CLATH')
+    assert query_cache_path(str(tmp_path), str(bufrfile), reordered) == path
+    reordered.add('saln', '*/GLPFDATA/SALNH')
+    assert query_cache_path(str(tmp_path), str(bufrfile), reordered) != path
+
+    # a rewritten bufr file is another bundle
+    bufrfile.write_bytes(b'BUFR7777')
+    assert query_cache_path(str(tmp_path), str(bufrfile), q) != path
+
+    # queries that are not recorded are not cached
+    assert query_cache_path(str(tmp_path), str(bufrfile), QuerySet()) is None
+
+
+def test_cache_dir(monkeypatch):
+    monkeypatch.delenv(query_cache.QUERY_CACHE_ENV, raising=False)
+    assert query_cache_dir(None) is None
+    monkeypatch.setenv(query_cache.QUERY_CACHE_ENV, '/env/cache')
+    assert query_cache_dir(None) == '/env/cache'
+    assert query_cache_dir('/config/cache') == '/config/cache'
+
+
+class Variables:
+    # ioda variables that get the named columns of the query result
+    def __init__(self, names):
+        self.names = names
+
+    def set_from_query_result(self, r):
+        self.columns = {name: r.get(name, group_by='depth') for name in self.names}
+
+    def number_of_obs(self):
+        return len(self.columns['temp'])
+
+    def number_of_temp_obs(self):
+        return self.number_of_obs()
+
+    def number_of_saln_obs(self):
+        return 0
+
+    def filter(self):
+        pass
+
+
+class Timer:
+    def stage(self, name):
+        pass
+
+    def obs_in(self, n):
+        pass
+
+
+def test_read_cycle_decodes_on_miss(monkeypatch, tmp_path, result):
+    bufrfile = tmp_path / 'subpfl.bufr_d'
+    bufrfile.write_bytes(b'BUFR')
+    decoded = []
+
+    class File:
+        def __init__(self, path):
+            decoded.append(path)
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def execute(self, q):
+            return result
+
+    monkeypatch.setattr(bufr2ioda_converter, 'bufr', types.SimpleNamespace(File=File))
+    converter = bufr2ioda_converter.Bufr2ioda_Converter.__new__(bufr2ioda_converter.Bufr2ioda_Converter)
+    converter.logger = logging.getLogger('test_query_cache')
+    converter.bufr2ioda_config = types.SimpleNamespace(stream_messages=None, query_cache=str(tmp_path / 'cache'),
+                                                       bufr_filepath=lambda: str(bufrfile))
+    converter.query = RecordedQuerySet()
+    converter.query.add('temp', '*/GLPFDATA/SSTH')
+
+    def read(names):
+        converter.ioda_vars = Variables(names)
+        assert converter.read_cycle(Timer())
+        for name in names:
+            assert same_result(converter.ioda_vars.columns[name], result.get(name))
+        return len(decoded)
+
+    # decoded and cached, then read from the cache
+    assert read(['temp']) == 1
+    assert read(['temp']) == 1
+    # a column that was not recorded is decoded, and recorded with the others
+    assert read(['temp', 'depth']) == 2
+    assert read(['temp', 'depth']) == 2
@@ -0,0 +1,70 @@
+# test_seq_num.py
+# compute_seq_num against the np.unique numbering it replaces
+import numpy as np
+import numpy.ma as ma
+import pytest
+from b2iconverter.ioda_addl_vars import compute_seq_num
+
+
+def seq_num_unique(*columns):
+    # the profiles as numbered by np.unique over the stacked coordinates
+    unique_combined, seqNum = np.unique(np.stack([ma.getdata(c) for c in columns], axis=-1), axis=0,
+                                        return_inverse=True)
+    return seqNum.reshape(-1).astype(np.int32)
+
+
+def test_same_as_unique():
+    rng = np.random.default_rng(0)
+    n = 5000
+    # repeated levels of a few hundred profiles
+    lon = rng.choice(rng.uniform(-180, 180, 300), n).astype(np.float32)
+    lat = rng.choice(rng.uniform(-90, 90, 300), n).astype(np.float32)
+    assert np.array_equal(compute_seq_num(lon, lat), seq_num_unique(lon, lat))
+
+
+def test_same_as_unique_with_keys():
+    # more than 64 bits of keys, grouped by a lexsort
+    rng = np.random.default_rng(1)
+    n = 2000
+    lon = rng.choice([-30.5, 0.0, 12.25], n)
+    lat = rng.choice([-10.0, 5.5], n)
+    dateTime = rng.choice([1700000000, 1700003600], n).astype(np.int64)
+    stationID = rng.choice(['5901234', '5905678', '7900001'], n)
+    seqNum = compute_seq_num(lon, lat, dateTime, stationID)
+    assert seqNum.dtype == np.int32
+    assert np.array_equal(seqNum, seq_num_unique(lon, lat, dateTime, np.unique(stationID, return_inverse=True)[1]))
+
+
+def test_masked_coordinates_use_their_data():
+    lon = ma.masked_array(np.array([1.0, 2.0, 1.0], dtype=np.float32), mask=[False, True, False])
+    lat = ma.masked_array(np.array([3.0, 3.0, 3.0], dtype=np.float32), mask=[False, False, True])
+    assert np.array_equal(compute_seq_num(lon, lat), seq_num_unique(lon, lat))
+
+
+def test_signed_zero_is_one_coordinate():
+    lon = np.array([0.0, -0.0, 0.0, 1.0], dtype=np.float32)
+    lat = np.array([-0.0, 0.0, 0.0, 1.0], dtype=np.float32)
+    seqNum = compute_seq_num(lon, lat)
+    assert seqNum.tolist() == [0, 0, 0, 1]
+    assert np.array_equal(seqNum, seq_num_unique(lon, lat))
+
+
+def test_negative_coordinates_order():
+    lon = np.array([-1.0, -2.0, 1.0, -0.5], dtype=np.float32)
+    lat = np.zeros(4, dtype=np.float32)
+    assert compute_seq_num(lon, lat).tolist() == [1, 0, 3, 2]
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_nan(dtype):
+    lon = np.array([np.nan, 1.0, np.nan, 1.0, -2.0], dtype=dtype)
+    lat = np.array([0.0, 2.0, 0.0, 2.0, np.nan], dtype=dtype)
+    assert np.array_equal(compute_seq_num(lon, lat), seq_num_unique(lon, lat))
+
+
+def test_empty():
+    lon = np.array([], dtype=np.float32)
+    lat = np.array([], dtype=np.float32)
+    seqNum = compute_seq_num(lon, lat)
+    assert seqNum.shape == (0,)
+    assert seqNum.dtype == np.int32
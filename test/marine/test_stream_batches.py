@@ -0,0 +1,163 @@
+# test_stream_batches.py
+# the streamed query, batch_size messages at a time, against the query of
+# the whole file it replaces, and the message count the batches come from
+import logging
+import types
+import numpy as np
+import numpy.ma as ma
+import pytest
+from b2iconverter import bufr2ioda_converter
+from b2iconverter.bufr2ioda_converter import Bufr2ioda_Converter, location_arrays
+from b2iconverter.util import count_bufr_messages
+from argo_ioda_variables import ArgoIODAVariables
+
+
+def bufr_message(payload):
+    # section 0 holds the total length of the message
+    length = 8 + len(payload) + 4
+    return b'BUFR' + length.to_bytes(3, 'big') + b'\x04' + payload + b'7777'
+
+
+def count_loop(data):
+    # the messages read one after the other, skipping the bytes between them
+    count = 0
+    pos = 0
+    while True:
+        pos = data.find(b'BUFR', pos)
+        if pos == -1:
+            return count
+        count += 1
+        pos += int.from_bytes(data[pos + 4:pos + 7], 'big')
+
+
+@pytest.mark.parametrize('data', [
+    b''.join(bufr_message(bytes(10 * k)) for k in range(5)),
+    b'header' + bufr_message(b'BUFR inside the payload') + b'\n\n' + bufr_message(b'x' * 70000) + b'trailer',
+    b'no messages',
+    b'',
+], ids=['back to back', 'bytes between', 'no messages', 'empty'])
+def test_count_bufr_messages(tmp_path, data):
+    path = tmp_path / 'tank.bufr_d'
+    path.write_bytes(data)
+    assert count_bufr_messages(str(path)) == count_loop(data)
+
+
+def masked(values, dtype):
+    # a column of a ResultSet: missing values masked, with the bufr fill value of its type
+    values = np.asarray(values, dtype=dtype)
+    if values.dtype.kind == 'f':
+        return ma.masked_array(values, mask=np.isnan(values), fill_value=np.float32(10e10))
+    return ma.masked_array(values, fill_value='' if values.dtype.kind == 'U' else 2147483647)
+
+
+class Profile:
+    # the levels of one message of a subpfl tank
+    def __init__(self, stationID, lat, lon, temp, saln):
+        n = len(temp)
+        self.stationID = stationID
+        self.values = {'stationID': masked([stationID] * n, str),
+                       'latitude': masked([lat] * n, np.float32),
+                       'longitude': masked([lon] * n, np.float32),
+                       'depth': masked(np.arange(n) * 10000, np.int32),
+                       'temp': masked(temp, np.float32),
+                       'saln': masked(saln, np.float32)}
+
+
+class ResultSet:
+    # get and get_datetime of bufr.ResultSet over some messages
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    def get(self, name, group_by=None):
+        if not self.profiles:
+            return masked([], np.float32)
+        values = [p.values[name] for p in self.profiles]
+        merged = ma.concatenate(values)
+        merged.fill_value = values[0].fill_value
+        return merged
+
+    def get_datetime(self, *names, group_by=None):
+        n = sum(len(p.values['temp']) for p in self.profiles)
+        return ma.masked_array(np.full(n, np.datetime64('2021-06-30T06:00:00', 's')))
+
+
+class File:
+    # bufr.File over the profiles, one per message
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, q, next=None):
+        end = len(self.profiles) if next is None else self.pos + next
+        result = ResultSet(self.profiles[self.pos:end])
+        self.pos = end
+        return result
+
+
+class Timer:
+    def stage(self, name):
+        pass
+
+    def obs_in(self, n):
+        pass
+
+
+nan = np.nan
+profiles = [
+    Profile('5901234', 10.0, 20.0, [290.0, 288.0, nan], [35.0, 35.5, 36.0]),
+    # not an ARGO float, filtered out
+    Profile('4800001', 11.0, 21.0, [291.0, 289.0], [34.0, 34.5]),
+    # no obs in the message
+    Profile('5901235', 12.0, 22.0, [nan, nan], [nan, nan]),
+    Profile('5901236', -5.0, 150.0, [300.0, 270.0, 285.0, 280.0], [30.0, 50.0, 34.0, nan]),
+    Profile('5901237', -6.0, 151.0, [295.0], [35.0]),
+]
+
+
+def make_converter(monkeypatch, tmp_path, profiles):
+    path = tmp_path / 'subpfl.bufr_d'
+    path.write_bytes(b''.join(bufr_message(p.stationID.encode()) for p in profiles))
+    monkeypatch.setattr(bufr2ioda_converter, 'bufr', types.SimpleNamespace(File=lambda path: File(profiles)))
+    converter = Bufr2ioda_Converter.__new__(Bufr2ioda_Converter)
+    converter.ioda_vars = ArgoIODAVariables()
+    converter.logger = logging.getLogger('test_stream_batches')
+    return converter, str(path)
+
+
+def whole_file(profiles):
+    # the query of the whole file, derived and filtered at once
+    ioda_vars = ArgoIODAVariables()
+    ioda_vars.set_from_query_result(File(profiles).execute(None))
+    ioda_vars.filter()
+    return location_arrays(ioda_vars)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 3, 5, 100])
+def test_same_as_whole_file(monkeypatch, tmp_path, batch_size):
+    converter, path = make_converter(monkeypatch, tmp_path, profiles)
+    assert converter.read_cycle_streamed(Timer(), None, path, batch_size)
+    streamed = location_arrays(converter.ioda_vars)
+    reference = whole_file(profiles)
+    assert streamed.keys() == reference.keys()
+    for key, value in reference.items():
+        assert np.array_equal(ma.getdata(streamed[key]), ma.getdata(value)), key
+        assert np.array_equal(ma.getmaskarray(streamed[key]), ma.getmaskarray(value)), key
+        assert streamed[key].dtype == value.dtype, key
+        if isinstance(value, ma.MaskedArray):
+            assert streamed[key].fill_value == value.fill_value, key
+
+
+def test_no_obs(monkeypatch, tmp_path):
+    converter, path = make_converter(monkeypatch, tmp_path, profiles[1:3])
+    assert not converter.read_cycle_streamed(Timer(), None, path, 1)
+
+
+def test_empty_file(monkeypatch, tmp_path):
+    converter, path = make_converter(monkeypatch, tmp_path, [])
+    assert not converter.read_cycle_streamed(Timer(), None, path, 10)
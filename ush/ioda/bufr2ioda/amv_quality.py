@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# amv_quality.py
+# quality indicators of the AMV converters: the percent confidence (PCCF) of
+# a wind is replicated once per generating application (GNAP), and the
+# replication holding a given application, e.g. the QI without forecast, is
+# the column of the GNAP array where every observation has its code.
+# The columns are found in one vectorized comparison of the whole array and
+# returned as views of the GNAP and PCCF arrays, nothing is copied.
+import numpy as np
+import numpy.ma as ma
+
+
+def application_columns(ga, code):
+    """
+    Indices of the columns of ga (nobs, ncol) where every entry equals code,
+    masked entries never do. A 1-D ga, a replication already selected by the
+    query, is a single column.
+    """
+    ga = ga.reshape(len(ga), -1)
+    return np.flatnonzero(ma.filled(ga == code, False).all(axis=0))
+
+
+def select_application(ga, qi, code, logger):
+    """
+    The GNAP and PCCF columns of generating application code, as views of ga
+    and qi, or (None, None) if no column of ga has it or the column is outside
+    of qi. With several candidates the last one is taken.
+    """
+    ga2 = ga.reshape(len(ga), -1)
+    qi2 = qi.reshape(len(qi), -1)
+    logger.info(f'Generating Application and Quality Information SEARCH:')
+    logger.info(f'Dimension size of GNAP {np.shape(ga2)}')
+    logger.info(f'Dimension size of PCCF {np.shape(qi2)}')
+
+    gnap = None
+    qifn = None
+    for i in application_columns(ga2, code).tolist():
+        if i < qi2.shape[1]:
+            logger.info(f'GNAP/PCCF found for column {i}')
+            gnap = ga2[:, i]
+            qifn = qi2[:, i]
+        else:
+            logger.info(f'ERROR: GNAP column {i} outside of PCCF dimension {qi2.shape[1]}')
+    if gnap is None:
+        logger.info(f'ERROR: GNAP == {code} NOT FOUND OR OUT OF PCCF DIMENSION-RANGE, WILL FAIL!')
+    return gnap, qifn
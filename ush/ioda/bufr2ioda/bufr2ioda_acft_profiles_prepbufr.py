@@ -12,61 +12,39 @@ import argparse
 import math
 import calendar
 import time
-import copy
 from datetime import datetime
 import json
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from obstype_mask import Mask_typ_for_vars
+from prepbufr_time import Compute_dateTime
 
 
-def Compute_dateTime(cycleTimeSinceEpoch, dhr):
+def Compute_typ_other(typ, *variables):
 
-    int64_fill_value = np.int64(0)
+    typ_other = typ.copy()
+    typ_other[(typ_other > 300) & (typ_other < 400)] -= 200
+    typ_other[(typ_other > 400) & (typ_other < 500)] -= 300
+    typ_other[(typ_other > 500) & (typ_other < 600)] -= 400
 
-    dateTime = np.zeros(dhr.shape, dtype=np.int64)
-    for i in range(len(dateTime)):
-        if ma.is_masked(dhr[i]):
-            continue
-        else:
-            dateTime[i] = np.int64(dhr[i]*3600) + cycleTimeSinceEpoch
+    return Mask_typ_for_vars(typ_other, *variables)
 
-    dateTime = ma.array(dateTime)
-    dateTime = ma.masked_values(dateTime, int64_fill_value)
 
-    return dateTime
+def Compute_typ_uv(typ, *variables):
 
+    typ_uv = typ.copy()
+    typ_uv[(typ_uv > 300) & (typ_uv < 400)] -= 100
+    typ_uv[(typ_uv > 400) & (typ_uv < 500)] -= 200
+    typ_uv[(typ_uv > 500) & (typ_uv < 600)] -= 300
 
-def Compute_typ_other(typ, var):
+    return Mask_typ_for_vars(typ_uv, *variables)
 
-    typ_var = copy.deepcopy(typ)
-    typ_var[(typ_var > 300) & (typ_var < 400)] -= 200
-    typ_var[(typ_var > 400) & (typ_var < 500)] -= 300
-    typ_var[(typ_var > 500) & (typ_var < 600)] -= 400
 
-    for i in range(len(typ_var)):
-        if ma.is_masked(var[i]):
-            typ_var[i] = typ_var.fill_value
-
-    return typ_var
-
-
-def Compute_typ_uv(typ, var):
-
-    typ_var = copy.deepcopy(typ)
-    typ_var[(typ_var > 300) & (typ_var < 400)] -= 100
-    typ_var[(typ_var > 400) & (typ_var < 500)] -= 200
-    typ_var[(typ_var > 500) & (typ_var < 600)] -= 300
-
-    for i in range(len(typ_var)):
-        if ma.is_masked(var[i]):
-            typ_var[i] = typ_var.fill_value
-
-    return typ_var
-
-
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -107,7 +85,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug(f"Making QuerySet ...")
     q = bufr.QuerySet(subsets)
@@ -149,15 +127,11 @@ def bufr_to_ioda(config, logger):
     q.add('windNorthward', '*/PRSLEVLA/W___INFO/W__EVENT{1}/VOB')
     q.add('windEastward', '*/PRSLEVLA/W___INFO/W__EVENT{1}/UOB')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.debug(f"Executing QuerySet to get ResultSet ...")
     with bufr.File(DATA_PATH) as f:
@@ -284,15 +258,12 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     uob       type  = {uob.dtype}")
     logger.debug(f"     vob       type  = {vob.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet to get ResultSet: \
-                {running_time} seconds")
+    timer.obs_in(len(typ))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.debug(f"Creating derived variables - dateTime ...")
 
@@ -308,12 +279,8 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     dateTime max = {dateTime_max}")
     logger.debug(f"     dateTime min = {dateTime_min}")
 
-    typ_zob = Compute_typ_other(typ, zob)
-    typ_pob = Compute_typ_other(typ, pob)
-    typ_tob = Compute_typ_other(typ, tob)
-    typ_tvo = Compute_typ_other(typ, tvo)
-    typ_qob = Compute_typ_other(typ, qob)
-    typ_uv = Compute_typ_uv(typ, uob)
+    typ_zob, typ_pob, typ_tob, typ_tvo, typ_qob = Compute_typ_other(typ, zob, pob, tob, tvo, qob)
+    typ_uv, = Compute_typ_uv(typ, uob)
 
     logger.debug(f"     Check drived variables (typ*) shape & type ... ")
     logger.debug(f"     typ_zob shape = {typ_zob.shape}")
@@ -329,15 +296,11 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     typ_uv shape = {typ_uv.shape}")
     logger.debug(f"     typ_uv type = {typ_uv.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for creating derived variables: \
-                {running_time} seconds")
-
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Create the dimensions
     dims = {'Location': np.arange(0, lat.shape[0])}
@@ -350,7 +313,8 @@ def bufr_to_ioda(config, logger):
     if path and not os.path.exists(path):
         os.makedirs(path)
 
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -592,18 +556,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Northward Wind') \
         .write_data(vob)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for splitting and output IODA: {running_time} \
-                 seconds")
-
     logger.debug(f"All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration', required=True)
@@ -620,7 +577,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
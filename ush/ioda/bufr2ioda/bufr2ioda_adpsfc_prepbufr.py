@@ -16,28 +16,41 @@ from datetime import datetime
 import json
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from prepbufr_time import Compute_dateTime
 
 
-def Compute_dateTime(cycleTimeSinceEpoch, dhr):
+def build_query(q):
 
-    int64_fill_value = np.int64(0)
+    # ObsType
+    q.add('observationType', '*/TYP')
 
-    dateTime = np.zeros(dhr.shape, dtype=np.int64)
-    for i in range(len(dateTime)):
-        if ma.is_masked(dhr[i]):
-            continue
-        else:
-            dateTime[i] = np.int64(dhr[i]*3600) + cycleTimeSinceEpoch
+    # MetaData
+    q.add('stationIdentification', '*/SID')
+    q.add('latitude', '*/YOB')
+    q.add('longitude', '*/XOB')
+    q.add('obsTimeMinusCycleTime', '*/DHR')
+    q.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
+    q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
 
-    dateTime = ma.array(dateTime)
-    dateTime = ma.masked_values(dateTime, int64_fill_value)
+    # Quality Marker
+    q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
+    q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
 
-    return dateTime
+    # ObsError
+    q.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
+
+    # ObsValue
+    q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
+    q.add('stationElevation', '*/ELV')
 
+    return q
 
-def bufr_to_ioda(config, logger):
+
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer, r=None):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -79,50 +92,26 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug('Making QuerySet ...')
-    q = bufr.QuerySet(subsets)
-
-    # ObsType
-    q.add('observationType', '*/TYP')
-
-    # MetaData
-    q.add('stationIdentification', '*/SID')
-    q.add('latitude', '*/YOB')
-    q.add('longitude', '*/XOB')
-    q.add('obsTimeMinusCycleTime', '*/DHR')
-    q.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
-    q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
-
-    # Quality Marker
-    q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
-    q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
-
-    # ObsError
-    q.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
-
-    # ObsValue
-    q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
-    q.add('stationElevation', '*/ELV')
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
+    q = build_query(bufr.QuerySet(subsets))
 
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
-    # Use the ResultSet returned to get numpy arrays of the data
+    # Use the ResultSet returned to get numpy arrays of the data,
+    # unless prepbufr_fanout.py already decoded the subset for us
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
-    logger.debug(f"Executing QuerySet to get ResultSet ...")
-    with bufr.File(DATA_PATH) as f:
-        try:
-            r = f.execute(q)
-        except Exception as err:
-            logger.info(f'Return with {err}')
-            return
+    if r is None:
+        logger.debug(f"Executing QuerySet to get ResultSet ...")
+        with bufr.File(DATA_PATH) as f:
+            try:
+                r = f.execute(q)
+            except Exception as err:
+                logger.info(f'Return with {err}')
+                return
 
     # ObsType
     logger.debug(" ... Executing QuerySet: get ObsType ...")
@@ -199,15 +188,12 @@ def bufr_to_ioda(config, logger):
 
     logger.debug(f"     dhr       type  = {dhr.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet to get ResultSet: \
-                {running_time} seconds")
+    timer.obs_in(len(typ))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.debug(f"Creating derived variables - dateTime ...")
 
@@ -219,15 +205,11 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     dateTime shape = {dateTime.shape}")
     logger.debug(f"     dateTime type = {dateTime.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for creating derived variables: \
-                {running_time} seconds")
-
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Create the dimensions
     dims = {'Location': np.arange(0, lat.shape[0])}
@@ -240,7 +222,8 @@ def bufr_to_ioda(config, logger):
     if path and not os.path.exists(path):
         os.makedirs(path)
 
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -353,18 +336,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Station Pressure') \
         .write_data(pob)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for splitting and output IODA: \
-                {running_time} seconds")
-
     logger.debug("All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration',
@@ -382,7 +358,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
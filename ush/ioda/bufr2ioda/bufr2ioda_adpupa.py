@@ -11,13 +11,13 @@ import json
 import numpy as np
 import numpy.ma as ma
 import calendar
-import time
 import math
 from datetime import datetime
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
 import copy
 import warnings
 # suppress warnings
@@ -52,7 +52,8 @@ def Compute_SpecificHumidity_from_dewPoint_and_Pressure(tmdp, prlc):
     return qob
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -87,7 +88,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
     q = bufr.QuerySet()
@@ -126,15 +127,11 @@ def bufr_to_ioda(config, logger):
     q.add('dewpointTemperatureQM', '*/UARLV/UATMP/QMDD')
     q.add('windSpeedQM', '*/UARLV/UAWND/QMWN')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Running time for making QuerySet : {running_time} seconds')
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.info(f"Executing QuerySet for ADPUPA BUFR DUMP to get ResultSet ...")
     with bufr.File(DATA_PATH) as f:
@@ -207,14 +204,12 @@ def bufr_to_ioda(config, logger):
     windEastwardOE = np.float32(np.ma.masked_array(np.full((len(wspd)), 0.0)))
     windNorthwardOE = np.float32(np.ma.masked_array(np.full((len(wspd)), 0.0)))
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f'Processing time for executing QuerySet to get ResultSet : {running_time} seconds')
+    timer.obs_in(len(clat))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.info('Creating derived variables')
     logger.debug('Creating derived variables - wind components (uob and vob)')
@@ -227,10 +222,6 @@ def bufr_to_ioda(config, logger):
     logger.debug(f'   qob min/max = {qob.min()} {qob.max()}')
     specificHumidityOE = np.float32(np.ma.masked_array(np.full((len(qob)), 0.0)))
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f'Processing time for creating derived variables : {running_time} seconds')
-
     logger.debug('Executing QuerySet for ADPUPA: Check BUFR variable generic dimension and type')
     # Check BUFR variable generic dimension and type
     logger.debug(f'     clat      shape = {clat.shape}')
@@ -295,6 +286,7 @@ def bufr_to_ioda(config, logger):
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Create the dimensions
     dims = {'Location': np.arange(0, clat.shape[0])}
@@ -303,7 +295,8 @@ def bufr_to_ioda(config, logger):
     iodafile = f"{cycle_type}.t{hh}z.{data_type}.tm00.nc"
     OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
     logger.info(f"Create output file: {OUTPUT_PATH}")
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(' ... ... Create global attributes')
@@ -453,17 +446,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Specific Humidity Observation Error') \
         .write_data(specificHumidityOE)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Running time for splitting and output IODA: {running_time} seconds")
-
     logger.info("All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -477,7 +464,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time: {running_time} seconds")
@@ -11,13 +11,15 @@ import numpy.ma as ma
 import calendar
 import json
 import time
-import copy
 import math
 import datetime
 import os
 from datetime import datetime
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from obstype_mask import Mask_typ_for_vars
+from prepbufr_time import Compute_dateTime
 from pyiodaconv import bufr
 from collections import namedtuple
 import warnings
@@ -33,33 +35,51 @@ warnings.filterwarnings('ignore')
 # ====================================================================
 
 
-def Compute_dateTime(cycleTimeSinceEpoch, hrdr):
+def build_query(q):
 
-    int64_fill_value = np.int64(0)
-    dateTime = np.zeros(hrdr.shape, dtype=np.int64)
-    for i in range(len(dateTime)):
-        if ma.is_masked(hrdr[i]):
-            continue
-        else:
-            dateTime[i] = np.int64(hrdr[i]*3600) + cycleTimeSinceEpoch
-
-    dateTime = ma.array(dateTime)
-    dateTime = ma.masked_values(dateTime, int64_fill_value)
+    # ObsType
+    q.add('observationType', '*/TYP')
 
-    return dateTime
+    # MetaData
+    q.add('prepbufrDataLevelCategory', '*/PRSLEVEL/CAT')
+    q.add('latitude', '*/PRSLEVEL/DRFTINFO/YDR')
+    q.add('longitude', '*/PRSLEVEL/DRFTINFO/XDR')
+    q.add('stationIdentification', '*/SID')
+    q.add('stationElevation', '*/ELV')
+    q.add('timeOffset', '*/PRSLEVEL/DRFTINFO/HRDR')
+    q.add('releaseTime', '*/PRSLEVEL/DRFTINFO/HRDR')
+    q.add('temperatureEventProgramCode', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TPC')
+    q.add('pressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
+    q.add('height', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZOB')
 
+    # ObsValue
+    q.add('stationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
+    q.add('airTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TOB')
+    q.add('virtualTemperature', '*/PRSLEVEL/T___INFO/TVO')
+    q.add('specificHumidity', '*/PRSLEVEL/Q___INFO/Q__EVENT{1}/QOB')
+    q.add('windEastward', '*/PRSLEVEL/W___INFO/W__EVENT{1}/UOB')
+    q.add('windNorthward', '*/PRSLEVEL/W___INFO/W__EVENT{1}/VOB')
 
-def Mask_typ_for_var(typ, var):
+    # QualityMark
+    q.add('pressureQM', '*/PRSLEVEL/P___INFO/P__EVENT{1}/PQM')
+    q.add('airTemperatureQM', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
+    q.add('virtualTemperatureQM', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
+    q.add('specificHumidityQM', '*/PRSLEVEL/Q___INFO/Q__EVENT{1}/QQM')
+    q.add('windEastwardQM', '*/PRSLEVEL/W___INFO/W__EVENT{1}/WQM')
+    q.add('windNorthwardQM', '*/PRSLEVEL/W___INFO/W__EVENT{1}/WQM')
 
-    typ_var = copy.deepcopy(typ)
-    for i in range(len(typ_var)):
-        if ma.is_masked(var[i]):
-            typ_var[i] = typ.fill_value
+    # ObsError
+    q.add('pressureOE', '*/PRSLEVEL/P___INFO/P__BACKG/POE')
+    q.add('airTemperatureOE', '*/PRSLEVEL/T___INFO/T__BACKG/TOE')
+    q.add('specificHumidityOE', '*/PRSLEVEL/Q___INFO/Q__BACKG/QOE')
+    q.add('windEastwardOE', '*/PRSLEVEL/W___INFO/W__BACKG/WOE')
+    q.add('windNorthwardOE', '*/PRSLEVEL/W___INFO/W__BACKG/WOE')
 
-    return typ_var
+    return q
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer, r=None):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -96,66 +116,26 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
-    q = bufr.QuerySet(subsets)
-
-    # ObsType
-    q.add('observationType', '*/TYP')
-
-    # MetaData
-    q.add('prepbufrDataLevelCategory', '*/PRSLEVEL/CAT')
-    q.add('latitude', '*/PRSLEVEL/DRFTINFO/YDR')
-    q.add('longitude', '*/PRSLEVEL/DRFTINFO/XDR')
-    q.add('stationIdentification', '*/SID')
-    q.add('stationElevation', '*/ELV')
-    q.add('timeOffset', '*/PRSLEVEL/DRFTINFO/HRDR')
-    q.add('releaseTime', '*/PRSLEVEL/DRFTINFO/HRDR')
-    q.add('temperatureEventProgramCode', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TPC')
-    q.add('pressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
-    q.add('height', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZOB')
-
-    # ObsValue
-    q.add('stationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
-    q.add('airTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TOB')
-    q.add('virtualTemperature', '*/PRSLEVEL/T___INFO/TVO')
-    q.add('specificHumidity', '*/PRSLEVEL/Q___INFO/Q__EVENT{1}/QOB')
-    q.add('windEastward', '*/PRSLEVEL/W___INFO/W__EVENT{1}/UOB')
-    q.add('windNorthward', '*/PRSLEVEL/W___INFO/W__EVENT{1}/VOB')
-
-    # QualityMark
-    q.add('pressureQM', '*/PRSLEVEL/P___INFO/P__EVENT{1}/PQM')
-    q.add('airTemperatureQM', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
-    q.add('virtualTemperatureQM', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
-    q.add('specificHumidityQM', '*/PRSLEVEL/Q___INFO/Q__EVENT{1}/QQM')
-    q.add('windEastwardQM', '*/PRSLEVEL/W___INFO/W__EVENT{1}/WQM')
-    q.add('windNorthwardQM', '*/PRSLEVEL/W___INFO/W__EVENT{1}/WQM')
-
-    # ObsError
-    q.add('pressureOE', '*/PRSLEVEL/P___INFO/P__BACKG/POE')
-    q.add('airTemperatureOE', '*/PRSLEVEL/T___INFO/T__BACKG/TOE')
-    q.add('specificHumidityOE', '*/PRSLEVEL/Q___INFO/Q__BACKG/QOE')
-    q.add('windEastwardOE', '*/PRSLEVEL/W___INFO/W__BACKG/WOE')
-    q.add('windNorthwardOE', '*/PRSLEVEL/W___INFO/W__BACKG/WOE')
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Running time for making QuerySet : {running_time} seconds')
+    q = build_query(bufr.QuerySet(subsets))
 
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
-    # Use the ResultSet returned to get numpy arrays of the data
+    # Use the ResultSet returned to get numpy arrays of the data,
+    # unless prepbufr_fanout.py already decoded the subset for us
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
-    logger.info('Executing QuerySet to get ResultSet')
-    with bufr.File(DATA_PATH) as f:
-        try:
-            r = f.execute(q)
-        except Exception as err:
-            logger.info(f'Return with {err}')
-            return
+    if r is None:
+        logger.info('Executing QuerySet to get ResultSet')
+        with bufr.File(DATA_PATH) as f:
+            try:
+                r = f.execute(q)
+            except Exception as err:
+                logger.info(f'Return with {err}')
+                return
 
     # ObsType
     logger.debug(" ... Executing QuerySet for ADPUPA: get ObsType ...")
@@ -219,11 +199,9 @@ def bufr_to_ioda(config, logger):
     psoe = ma.masked_values(psoe, 0)
     toboe = r.get('airTemperatureOE', 'prepbufrDataLevelCategory', type='float32')
     toboe = ma.masked_values(toboe, 0)
-    tsenoe = copy.deepcopy(toboe)
     tsenoef = ma.array(np.full(toboe.shape[0], toboe.fill_value))
     tsenoe = ma.where(((tpc >= 1) & (tpc < 8)), toboe, tsenoef)
     tsenoe = ma.masked_values(tsenoe, 0)
-    tvooe = copy.deepcopy(toboe)
     tvooef = ma.array(np.full(toboe.shape[0], toboe.fill_value))
     tvooe = ma.where(((tpc == 8)), toboe, tvooef)
     tvooe = ma.masked_values(tvooe, 0)
@@ -310,14 +288,12 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     uoboe     type  = {uoboe.dtype}")
     logger.debug(f"     voboe     type  = {voboe.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Running time for executing QuerySet to get ResultSet : {running_time} seconds")
+    timer.obs_in(len(obstyp))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.info('Creating derived variables - dateTime from hrdr')
 
@@ -327,18 +303,10 @@ def bufr_to_ioda(config, logger):
     logger.debug('     Check derived variables type ... ')
     logger.debug(f'    dateTime      type = {dateTime.dtype}')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Running time for creating derived variables : {running_time} seconds")
-
+    timer.stage('filter')
     # Mask Certain Variables
     logger.debug(f"Mask typ for certain variables where data is available...")
-    typ_ps = Mask_typ_for_var(obstyp, ps)
-    typ_tsen = Mask_typ_for_var(obstyp, tsen)
-    typ_tvo = Mask_typ_for_var(obstyp, tvo)
-    typ_qob = Mask_typ_for_var(obstyp, qob)
-    typ_uob = Mask_typ_for_var(obstyp, uob)
-    typ_vob = Mask_typ_for_var(obstyp, vob)
+    typ_ps, typ_tsen, typ_tvo, typ_qob, typ_uob, typ_vob = Mask_typ_for_vars(obstyp, ps, tsen, tvo, qob, uob, vob)
 
     logger.debug(f"     Check drived variables (typ*) shape & type ... ")
     logger.debug(f"     typ_ps shape, type = {typ_ps.shape}, {typ_ps.dtype}")
@@ -348,6 +316,7 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     typ_uob shape, type = {typ_uob.shape}, {typ_uob.dtype}")
     logger.debug(f"     typ_vob shape, type = {typ_vob.shape}, {typ_vob.dtype}")
 
+    timer.stage('write')
     # Create the dimensions
     dims = {'Location': np.arange(0, lat.shape[0])}
 
@@ -355,7 +324,8 @@ def bufr_to_ioda(config, logger):
     iodafile = f"{cycle_type}.t{hh}z.{data_type}.tm00.nc"
     OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
     logger.info(f"Create output file: {OUTPUT_PATH}")
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(' ... ... Create global attributes')
@@ -572,17 +542,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Northward Wind Observation Error') \
         .write_data(voboe)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Running time for splitting and output IODA: {running_time} seconds")
-
     logger.info("All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -596,7 +560,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time: {running_time} seconds")
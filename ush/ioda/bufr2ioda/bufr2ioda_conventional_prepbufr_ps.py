@@ -17,35 +17,12 @@ import copy
 import json
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
-
-
-def Compute_dateTime(cycleTimeSinceEpoch, dhr):
-
-    int64_fill_value = np.int64(0)
-
-    dateTime = np.zeros(dhr.shape, dtype=np.int64)
-    for i in range(len(dateTime)):
-        if ma.is_masked(dhr[i]):
-            continue
-        else:
-            dateTime[i] = np.int64(dhr[i]*3600) + cycleTimeSinceEpoch
-
-    dateTime = ma.array(dateTime)
-    dateTime = ma.masked_values(dateTime, int64_fill_value)
-
-    return dateTime
-
-
-def Mask_typ_for_var(typ, var):
-
-    typ_var = copy.deepcopy(typ)
-    for i in range(len(typ_var)):
-        if ma.is_masked(var[i]):
-            typ_var[i] = typ.fill_value
-
-    return typ_var
+from stage_timer import timed
+from output_policy import create_obsspace
+from obstype_mask import Mask_typ_for_vars
+from prepbufr_time import Compute_dateTime
+from record_filter import RecordFilter
 
 
 def Compute_ObsSubType(typ, t29):
@@ -67,7 +44,106 @@ def Compute_ObsSubType(typ, t29):
     return obssubtype
 
 
-def bufr_to_ioda(config, logger):
+def build_query(q, subset):
+
+    if subset == "ADPSFC":
+        # ObsType
+        q.add('observationType', '*/TYP')
+
+        # MetaData
+        q.add('stationIdentification', '*/SID')
+        q.add('prepbufrDataLevelCategory', '*/CAT')
+        q.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
+        q.add('latitude', '*/YOB')
+        q.add('longitude', '*/XOB')
+        q.add('t29', '*/T29')
+        q.add('obsTimeMinusCycleTime', '*/DHR')
+        q.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
+        q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
+
+        # QualityMarker
+        q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
+        q.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
+        q.add('qualityMarkerVirtualTemperature', '*/T___INFO/T__EVENT{1}/TQM')
+        q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
+
+        # ObsError
+        q.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
+        q.add('obsErrorAirTemperature', '*/T___INFO/T__BACKG{1}/TOE')
+        q.add('obsErrorVirtualTemperature', '*/T___INFO/T__BACKG{1}/TOE')
+
+        # ObsValue
+        q.add('stationElevation', '*/ELV')
+        q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
+        q.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
+
+    elif subset == "SFCSHP":
+        # ObsType
+        q.add('observationType', '*/TYP')
+
+        # MetaData
+        q.add('stationIdentification', '*/SID')
+        q.add('prepbufrDataLevelCategory', '*/CAT')
+        q.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
+        q.add('latitude', '*/YOB')
+        q.add('longitude', '*/XOB')
+        q.add('t29', '*/T29')
+        q.add('obsTimeMinusCycleTime', '*/DHR')
+        q.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
+        q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
+
+        # QualityMarker
+        q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
+        q.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
+        q.add('qualityMarkerVirtualTemperature', '*/T___INFO/T__EVENT{1}/TQM')
+        q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
+
+        # ObsError
+        q.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
+        q.add('obsErrorAirTemperature', '*/T___INFO/T__BACKG{1}/TOE')
+        q.add('obsErrorVirtualTemperature', '*/T___INFO/T__BACKG{1}/TOE')
+
+        # ObsValue
+        q.add('stationElevation', '*/ELV')
+        q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
+        q.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
+
+    elif subset == "ADPUPA":
+        # ObsType
+        q.add('observationType', '*/TYP')
+
+        # MetaData
+        q.add('stationIdentification', 'ADPUPA/SID')
+        q.add('prepbufrDataLevelCategory', '*/PRSLEVEL/CAT')
+        q.add('temperatureEventCode', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TPC')
+        q.add('latitude', '*/PRSLEVEL/DRFTINFO/YDR')
+        q.add('longitude', '*/PRSLEVEL/DRFTINFO/XDR')
+        q.add('t29', '*/T29')
+        q.add('height', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZOB')
+        q.add('timeOffset', '*/PRSLEVEL/DRFTINFO/HRDR')
+        q.add('releaseTime', '*/PRSLEVEL/DRFTINFO/HRDR')
+        q.add('pressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
+
+        # QualityMarker
+        q.add('qualityMarkerStationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/PQM')
+        q.add('qualityMarkerStationElevation', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZQM')
+        q.add('qualityMarkerAirTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
+        q.add('qualityMarkerVirtualTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
+
+        # ObsError
+        q.add('obsErrorStationPressure', '*/PRSLEVEL/P___INFO/P__BACKG{1}/POE')
+        q.add('obsErrorAirTemperature', '*/PRSLEVEL/T___INFO/T__BACKG{1}/TOE')
+
+        # ObsValue
+        q.add('stationElevation', '*/ELV')
+        q.add('stationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
+        q.add('airTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TOB')
+
+    return q
+
+
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer, results=None):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -110,7 +186,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug('Making QuerySet ...')
     q = bufr.QuerySet(["ADPSFC"])
@@ -118,136 +194,47 @@ def bufr_to_ioda(config, logger):
     s = bufr.QuerySet(["ADPUPA"])
 
     for i in range(len(subsets)):
+        logger.debug(f"Making QuerySet for {subsets[i]}")
         if subsets[i] == "ADPSFC":
-            logger.debug("Making QuerySet for ADPSFC")
-
-            # ObsType
-            q.add('observationType', '*/TYP')
-
-            # MetaData
-            q.add('stationIdentification', '*/SID')
-            q.add('prepbufrDataLevelCategory', '*/CAT')
-            q.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
-            q.add('latitude', '*/YOB')
-            q.add('longitude', '*/XOB')
-            q.add('t29', '*/T29')
-            q.add('obsTimeMinusCycleTime', '*/DHR')
-            q.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
-            q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
-
-            # QualityMarker
-            q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
-            q.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
-            q.add('qualityMarkerVirtualTemperature', '*/T___INFO/T__EVENT{1}/TQM')
-            q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
-
-            # ObsError
-            q.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
-            q.add('obsErrorAirTemperature', '*/T___INFO/T__BACKG{1}/TOE')
-            q.add('obsErrorVirtualTemperature', '*/T___INFO/T__BACKG{1}/TOE')
-
-            # ObsValue
-            q.add('stationElevation', '*/ELV')
-            q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
-            q.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
-
+            build_query(q, "ADPSFC")
         elif subsets[i] == "SFCSHP":
-            logger.debug("Making QuerySet for SFCSHP")
-
-            # ObsType
-            r.add('observationType', '*/TYP')
-
-            # MetaData
-            r.add('stationIdentification', '*/SID')
-            r.add('prepbufrDataLevelCategory', '*/CAT')
-            r.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
-            r.add('latitude', '*/YOB')
-            r.add('longitude', '*/XOB')
-            r.add('t29', '*/T29')
-            r.add('obsTimeMinusCycleTime', '*/DHR')
-            r.add('height', '*/Z___INFO/Z__EVENT{1}/ZOB')
-            r.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
-
-            # QualityMarker
-            r.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
-            r.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
-            r.add('qualityMarkerVirtualTemperature', '*/T___INFO/T__EVENT{1}/TQM')
-            r.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
-
-            # ObsError
-            r.add('obsErrorStationPressure', '*/P___INFO/P__BACKG{1}/POE')
-            r.add('obsErrorAirTemperature', '*/T___INFO/T__BACKG{1}/TOE')
-            r.add('obsErrorVirtualTemperature', '*/T___INFO/T__BACKG{1}/TOE')
-
-            # ObsValue
-            r.add('stationElevation', '*/ELV')
-            r.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
-            r.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
-
+            build_query(r, "SFCSHP")
         elif subsets[i] == "ADPUPA":
-            logger.debug("Making QuerySet for ADPUPA")
-            # ObsType
-            s.add('observationType', '*/TYP')
-
-            # MetaData
-            s.add('stationIdentification', 'ADPUPA/SID')
-            s.add('prepbufrDataLevelCategory', '*/PRSLEVEL/CAT')
-            s.add('temperatureEventCode', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TPC')
-            s.add('latitude', '*/PRSLEVEL/DRFTINFO/YDR')
-            s.add('longitude', '*/PRSLEVEL/DRFTINFO/XDR')
-            s.add('t29', '*/T29')
-            s.add('height', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZOB')
-            s.add('timeOffset', '*/PRSLEVEL/DRFTINFO/HRDR')
-            s.add('releaseTime', '*/PRSLEVEL/DRFTINFO/HRDR')
-            s.add('pressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
-
-            # QualityMarker
-            s.add('qualityMarkerStationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/PQM')
-            s.add('qualityMarkerStationElevation', '*/PRSLEVEL/Z___INFO/Z__EVENT{1}/ZQM')
-            s.add('qualityMarkerAirTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
-            s.add('qualityMarkerVirtualTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TQM')
-
-            # ObsError
-            s.add('obsErrorStationPressure', '*/PRSLEVEL/P___INFO/P__BACKG{1}/POE')
-            s.add('obsErrorAirTemperature', '*/PRSLEVEL/T___INFO/T__BACKG{1}/TOE')
-
-            # ObsValue
-            s.add('stationElevation', '*/ELV')
-            s.add('stationPressure', '*/PRSLEVEL/P___INFO/P__EVENT{1}/POB')
-            s.add('airTemperature', '*/PRSLEVEL/T___INFO/T__EVENT{1}/TOB')
-
-    end_time = time.time()
-
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
+            build_query(s, "ADPUPA")
 
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
-    # Use the ResultSet returned to get numpy arrays of the data
+    # Use the ResultSet returned to get numpy arrays of the data,
+    # unless prepbufr_fanout.py already decoded the subsets for us
     # ==============================================================
-    start_time = time.time()
-
-    logger.debug(f"Executing QuerySet to get ResultSet ...")
-    with bufr.File(DATA_PATH) as f:
-        try:
-            t = f.execute(q)
-        except Exception as err:
-            logger.info(f'Return t with {err}')
-            return
-
-    with bufr.File(DATA_PATH) as f:
-        try:
-            u = f.execute(r)
-        except Exception as err:
-            logger.info(f'Return u with {err}')
-            return
-
-    with bufr.File(DATA_PATH) as f:
-        try:
-            v = f.execute(s)
-        except Exception as err:
-            logger.info(f'Return v with {err}')
-            return
+    timer.stage('execute')
+
+    if results is not None:
+        t = results["ADPSFC"]
+        u = results["SFCSHP"]
+        v = results["ADPUPA"]
+    else:
+        logger.debug(f"Executing QuerySet to get ResultSet ...")
+        with bufr.File(DATA_PATH) as f:
+            try:
+                t = f.execute(q)
+            except Exception as err:
+                logger.info(f'Return t with {err}')
+                return
+
+        with bufr.File(DATA_PATH) as f:
+            try:
+                u = f.execute(r)
+            except Exception as err:
+                logger.info(f'Return u with {err}')
+                return
+
+        with bufr.File(DATA_PATH) as f:
+            try:
+                v = f.execute(s)
+            except Exception as err:
+                logger.info(f'Return v with {err}')
+                return
 
     # ADPSFC
     # ObsType
@@ -289,53 +276,29 @@ def bufr_to_ioda(config, logger):
     toborig1 += 273.15
 
     logger.debug(f" ... Make new arrays for certain Obstypes of ADSPFC")
-    typ1 = np.array([], dtype=np.int32)
-
-    sid1 = np.array([]).astype('str')
-    cat1 = np.array([], dtype=np.int32)
-    tpc1 = np.array([], dtype=np.int32)
-    lat1 = np.array([], dtype=np.float32)
-    lon1 = np.array([], dtype=np.float32)
-    t291 = np.array([], dtype=np.int32)
-    zob1 = np.array([], dtype=np.float32)
-    dhr1 = np.array([], dtype=np.float32)
-    pressure1 = np.array([], dtype=np.float32)
-
-    pobqm1 = np.array([], dtype=np.int32)
-    zobqm1 = np.array([], dtype=np.int32)
-    tobqm1 = np.array([], dtype=np.int32)
-
-    poboe1 = np.array([], dtype=np.float32)
-    toboe1 = ma.array([], dtype=np.float32)
-
-    elv1 = np.array([], dtype=np.float32)
-    pob1 = np.array([], dtype=np.float32)
-    tob1 = np.array([], dtype=np.float32)
-
-    for i in range(len(typorig1)):
-        if typorig1[i] < 200:
-            typ1 = np.append(typ1, typorig1[i])
-
-            sid1 = np.append(sid1, sidorig1[i])
-            cat1 = np.append(cat1, catorig1[i])
-            tpc1 = np.append(tpc1, tpcorig1[i])
-            lat1 = np.append(lat1, latorig1[i])
-            lon1 = np.append(lon1, lonorig1[i])
-            t291 = np.append(t291, t29orig1[i])
-            zob1 = np.append(zob1, zoborig1[i])
-            dhr1 = np.append(dhr1, dhrorig1[i])
-            pressure1 = np.append(pressure1, pressureorig1[i])
-
-            pobqm1 = np.append(pobqm1, pobqmorig1[i]).astype('int32')
-            zobqm1 = np.append(pobqm1, pobqmorig1[i]).astype('int32')
-            tobqm1 = np.append(tobqm1, tobqmorig1[i]).astype('int32')
-
-            poboe1 = np.append(poboe1, poboeorig1[i])
-            toboe1 = np.append(toboe1, toboeorig1[i])
-
-            elv1 = np.append(elv1, elvorig1[i])
-            pob1 = np.append(pob1, poborig1[i])
-            tob1 = np.append(tob1, toborig1[i])
+    adpsfc = RecordFilter(typorig1 < 200)
+    typ1 = adpsfc.appended(np.array([], dtype=np.int32), typorig1)
+
+    sid1 = adpsfc.appended(np.array([]).astype('str'), sidorig1)
+    cat1 = adpsfc.appended(np.array([], dtype=np.int32), catorig1)
+    tpc1 = adpsfc.appended(np.array([], dtype=np.int32), tpcorig1)
+    lat1 = adpsfc.appended(np.array([], dtype=np.float32), latorig1)
+    lon1 = adpsfc.appended(np.array([], dtype=np.float32), lonorig1)
+    t291 = adpsfc.appended(np.array([], dtype=np.int32), t29orig1)
+    zob1 = adpsfc.appended(np.array([], dtype=np.float32), zoborig1)
+    dhr1 = adpsfc.appended(np.array([], dtype=np.float32), dhrorig1)
+    pressure1 = adpsfc.appended(np.array([], dtype=np.float32), pressureorig1)
+
+    pobqm1 = adpsfc.appended(np.array([], dtype=np.int32), pobqmorig1).astype('int32')
+    zobqm1 = adpsfc.appended(np.array([], dtype=np.int32), zobqmorig1).astype('int32')
+    tobqm1 = adpsfc.appended(np.array([], dtype=np.int32), tobqmorig1).astype('int32')
+
+    poboe1 = adpsfc.appended(np.array([], dtype=np.float32), poboeorig1)
+    toboe1 = adpsfc.appended(ma.array([], dtype=np.float32), toboeorig1)
+
+    elv1 = adpsfc.appended(np.array([], dtype=np.float32), elvorig1)
+    pob1 = adpsfc.appended(np.array([], dtype=np.float32), poborig1)
+    tob1 = adpsfc.appended(np.array([], dtype=np.float32), toborig1)
 
     typ1 = ma.array(typ1)
     typ1 = ma.masked_values(typ1, typorig1.fill_value)
@@ -365,11 +328,9 @@ def bufr_to_ioda(config, logger):
     zobqm1 = ma.masked_values(zobqm1, 0)
     tobqm1 = ma.array(tobqm1).astype('int32')
     tobqm1 = ma.masked_values(tobqm1, tobqmorig1.fill_value)
-    tsenqm1 = copy.deepcopy(tobqm1)
     tsenqm1f = ma.array(np.full(tobqm1.shape[0], tobqm1.fill_value))
     tsenqm1 = ma.where(((tpc1 >= 1) & (tpc1 < 8)), tobqm1, tsenqm1f)
     tsenqm1 = ma.masked_values(tsenqm1, 0)
-    tvoqm1 = copy.deepcopy(tobqm1)
     tvoqm1f = ma.array(np.full(tobqm1.shape[0], tobqm1.fill_value))
     tvoqm1 = ma.where((tpc1 == 8), tobqm1, tvoqm1f)
     tvoqm1 = ma.masked_values(tvoqm1, 0)
@@ -380,7 +341,6 @@ def bufr_to_ioda(config, logger):
     toboe1 = ma.array(toboe1).astype('float32')
     toboe1a = ma.array(toboe1)
     toboe1 = ma.masked_values(toboe1, toboeorig1.fill_value)
-    tsenoe1 = copy.deepcopy(toboe1)
     tsenoe1f = ma.array(np.full(toboe1.shape[0], toboe1.fill_value))
     tsenoe1 = ma.where(((tpc1 >= 1) & (tpc1 < 8)), toboe1, tsenoe1f)
     tsenoe1 = ma.masked_values(tsenoe1, 0)
@@ -395,7 +355,6 @@ def bufr_to_ioda(config, logger):
     pob1 = ma.masked_values(pob1, poborig1.fill_value)
     tob1 = ma.array(tob1).astype('float32')
     tob1 = ma.masked_values(tob1, toborig1.fill_value)
-    tsen1 = copy.deepcopy(tob1)
     tsen1f = ma.array(np.full(tob1.shape[0], tob1.fill_value))
     tsen1 = ma.where(((tpc1 >= 1) & (tpc1 < 8)), tob1, tsen1f)
     tvo1 = ma.array(np.full(tob1.shape[0], tob1.fill_value))
@@ -444,52 +403,28 @@ def bufr_to_ioda(config, logger):
     toborig2 += 273.15
 
     logger.debug(f" ... Make new arrays for certain ObsTypes of SFCSHP")
-    typ2 = np.array([], dtype=np.int32)
-
-    sid2 = np.array([]).astype('str')
-    cat2 = np.array([], dtype=np.int32)
-    tpc2 = np.array([], dtype=np.int32)
-    lat2 = np.array([], dtype=np.float32)
-    lon2 = np.array([], dtype=np.float32)
-    t292 = np.array([], dtype=np.int32)
-    zob2 = np.array([], dtype=np.float32)
-    dhr2 = np.array([], dtype=np.float32)
-    pressure2 = np.array([], dtype=np.float32)
-
-    pobqm2 = np.array([], dtype=np.int32)
-    zobqm2 = np.array([], dtype=np.int32)
-    tobqm2 = np.array([], dtype=np.int32)
-
-    poboe2 = np.array([], dtype=np.float32)
-    toboe2 = np.array([], dtype=np.float32)
-
-    elv2 = np.array([], dtype=np.float32)
-    pob2 = np.array([], dtype=np.float32)
-    tob2 = np.array([], dtype=np.float32)
-
-    for i in range(len(typorig2)):
-        if typorig2[i] < 200:
-            typ2 = np.append(typ2, typorig2[i])
-            sid2 = np.append(sid2, sidorig2[i])
-            cat2 = np.append(cat2, catorig2[i])
-            tpc2 = np.append(tpc2, tpcorig2[i])
-            lat2 = np.append(lat2, latorig2[i])
-            lon2 = np.append(lon2, lonorig2[i])
-            t292 = np.append(t292, t29orig2[i])
-            zob2 = np.append(zob2, zoborig2[i])
-            dhr2 = np.append(dhr2, dhrorig2[i])
-            pressure2 = np.append(pressure2, pressureorig2[i])
-
-            pobqm2 = np.append(pobqm2, pobqmorig2[i])
-            zobqm2 = np.append(zobqm2, pobqmorig2[i])
-            tobqm2 = np.append(tobqm2, tobqmorig2[i])
-
-            poboe2 = np.append(poboe2, poboeorig2[i])
-            toboe2 = np.append(toboe2, toboeorig2[i])
-
-            elv2 = np.append(elv2, elvorig2[i])
-            pob2 = np.append(pob2, poborig2[i])
-            tob2 = np.append(tob2, toborig2[i])
+    sfcshp = RecordFilter(typorig2 < 200)
+    typ2 = sfcshp.appended(np.array([], dtype=np.int32), typorig2)
+    sid2 = sfcshp.appended(np.array([]).astype('str'), sidorig2)
+    cat2 = sfcshp.appended(np.array([], dtype=np.int32), catorig2)
+    tpc2 = sfcshp.appended(np.array([], dtype=np.int32), tpcorig2)
+    lat2 = sfcshp.appended(np.array([], dtype=np.float32), latorig2)
+    lon2 = sfcshp.appended(np.array([], dtype=np.float32), lonorig2)
+    t292 = sfcshp.appended(np.array([], dtype=np.int32), t29orig2)
+    zob2 = sfcshp.appended(np.array([], dtype=np.float32), zoborig2)
+    dhr2 = sfcshp.appended(np.array([], dtype=np.float32), dhrorig2)
+    pressure2 = sfcshp.appended(np.array([], dtype=np.float32), pressureorig2)
+
+    pobqm2 = sfcshp.appended(np.array([], dtype=np.int32), pobqmorig2)
+    zobqm2 = sfcshp.appended(np.array([], dtype=np.int32), zobqmorig2)
+    tobqm2 = sfcshp.appended(np.array([], dtype=np.int32), tobqmorig2)
+
+    poboe2 = sfcshp.appended(np.array([], dtype=np.float32), poboeorig2)
+    toboe2 = sfcshp.appended(np.array([], dtype=np.float32), toboeorig2)
+
+    elv2 = sfcshp.appended(np.array([], dtype=np.float32), elvorig2)
+    pob2 = sfcshp.appended(np.array([], dtype=np.float32), poborig2)
+    tob2 = sfcshp.appended(np.array([], dtype=np.float32), toborig2)
 
     typ2 = ma.array(typ2)
     typ2 = ma.masked_values(typ2, typorig2.fill_value)
@@ -535,7 +470,6 @@ def bufr_to_ioda(config, logger):
     toboe2 = ma.array(toboe2).astype('float32')
     toboe2 = ma.masked_values(toboe2, toboeorig2.fill_value)
     toboe2 = ma.masked_values(toboe2, 0)
-    tsenoe2 = copy.deepcopy(toboe2)
     tsenoe2f = ma.array(np.full(toboe2.shape[0], toboe2.fill_value))
     tsenoe2 = ma.where(((tpc2 >= 1) & (tpc2 < 8)), toboe2, tsenoe2f)
     tsenoe2 = ma.masked_values(tsenoe2, 0)
@@ -550,7 +484,6 @@ def bufr_to_ioda(config, logger):
     pob2 = ma.masked_values(pob2, poborig2.fill_value)
     tob2 = ma.array(tob2).astype('float32')
     tob2 = ma.masked_values(tob2, toborig2.fill_value)
-    tsen2 = copy.deepcopy(tob2)
     tsen2f = ma.array(np.full(tob2.shape[0], tob2.fill_value))
     tsen2 = ma.where(((tpc2 >= 1) & (tpc2 < 8)), tob2, tsen2f)
     tvo2 = ma.array(np.full(tob2.shape[0], tob2.fill_value))
@@ -586,11 +519,9 @@ def bufr_to_ioda(config, logger):
     psqm3 = ma.masked_values(psqm3, 0)
     zobqm3 = v.get('qualityMarkerStationElevation', 'prepbufrDataLevelCategory')
     tobqm3 = v.get('qualityMarkerAirTemperature', 'prepbufrDataLevelCategory')
-    tsenqm3 = copy.deepcopy(tobqm3)
     tsenqm3f = ma.array(np.full(tobqm3.shape[0], tobqm3.fill_value))
     tsenqm3 = ma.where(((tpc3 >= 1) & (tpc3 < 8) & (cat3 == 0)), tobqm3, tsenqm3f)
     tsenqm3 = ma.masked_values(tsenqm3, 0)
-    tvoqm3 = copy.deepcopy(tobqm3)
     tvoqm3f = ma.array(np.full(tobqm3.shape[0], tobqm3.fill_value))
     tvoqm3 = ma.where(((tpc3 == 8) & (cat3 == 0)), tobqm3, tvoqm3f)
     tvoqm3 = ma.masked_values(tvoqm3, 0)
@@ -604,11 +535,9 @@ def bufr_to_ioda(config, logger):
     psoe3 = ma.masked_values(psoe3, 0)
     toboe3 = v.get('obsErrorAirTemperature', 'prepbufrDataLevelCategory', type='float32')
     toboe3 = ma.masked_values(toboe3, 0)
-    tsenoe3 = copy.deepcopy(toboe3)
     tsenoe3f = ma.array(np.full(toboe3.shape[0], toboe3.fill_value))
     tsenoe3 = ma.where(((tpc3 >= 1) & (tpc3 < 8) & (cat3 == 0)), toboe3, tsenoe3f)
     tsenoe3 = ma.masked_values(tsenoe3, 0)
-    tvooe3 = copy.deepcopy(toboe3)
     tvooe3f = ma.array(np.full(toboe3.shape[0], toboe3.fill_value))
     tvooe3 = ma.where(((tpc3 == 8) & (cat3 == 0)), toboe3, tvooe3f)
     tvooe3 = ma.masked_values(tvooe3, 0)
@@ -622,20 +551,14 @@ def bufr_to_ioda(config, logger):
     ps3 = ma.where(cat3 == 0, pressure3, ps3)
     tob3 = v.get('airTemperature', 'prepbufrDataLevelCategory', type='float32')
     tob3 += 273.15
-    tsen3 = copy.deepcopy(tob3)
     tsen3f = ma.array(np.full(tob3.shape[0], tob3.fill_value))
     tsen3 = ma.where(((tpc3 >= 1) & (tpc3 < 8) & (cat3 == 0)), tob3, tsen3f)
-    tvo3 = copy.deepcopy(tob3)
     tvo3f = ma.array(np.full(tob3.shape[0], tob3.fill_value))
     tvo3 = ma.where(((tpc3 == 8) & (cat3 == 0)), tob3, tvo3f)
 
     logger.debug(f" ... QuerySet execution for ADPUPA ... done!")
     logger.debug(f" ... Executing QuerySet: Done!")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet: {running_time} seconds")
-
     # Check BUFR variable dimension and type
     logger.debug(f"     Check shapes and dtypes of all 3 variables")
     logger.debug(f"     typ1       shape, type = {typ1.shape}, {typ1.dtype}, {typ1.fill_value}")
@@ -808,10 +731,12 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"  new tsen      shape = {tsen.shape}, {tsen.dtype}")
     logger.debug(f"  new tvo       shape = {tvo.shape}, {tvo.dtype}")
 
+    timer.obs_in(len(typorig1) + len(typorig2) + len(typ3))
+
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.debug(f"Creating derived variables - dateTime ...")
 
@@ -838,12 +763,10 @@ def bufr_to_ioda(config, logger):
     # =========================
     # Mask Certain Variables
     # =========================
+    timer.stage('filter')
 
     logger.debug(f"Mask typ for certain variables where data is available...")
-    typ_ps = Mask_typ_for_var(typ, ps)
-    typ_tsen = Mask_typ_for_var(typ, tsen)
-    typ_tvo = Mask_typ_for_var(typ, tvo)
-    typ_zob = Mask_typ_for_var(typ, zob)
+    typ_ps, typ_tsen, typ_tvo, typ_zob = Mask_typ_for_vars(typ, ps, tsen, tvo, zob)
 
     logger.debug(f"     Check drived variables (typ*) shape & type ... ")
     logger.debug(f"     typ_ps shape, type = {typ_ps.shape}, {typ_ps.dtype}")
@@ -851,15 +774,11 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     typ_tvo shape, type = {typ_tvo.shape}, {typ_tvo.dtype}")
     logger.debug(f"     typ_zob shape, type = {typ_zob.shape}, {typ_zob.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for creating derived variables: \
-                {running_time} seconds")
-
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Create the dimensions
     dims = {'Location': np.arange(0, lat.shape[0])}
@@ -872,7 +791,8 @@ def bufr_to_ioda(config, logger):
     if path and not os.path.exists(path):
         os.makedirs(path)
 
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -1075,8 +995,6 @@ def bufr_to_ioda(config, logger):
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration',
@@ -1094,7 +1012,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
@@ -12,12 +12,12 @@ import numpy as np
 import numpy.ma as ma
 import math
 import calendar
-import time
 import datetime
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
 
 # ====================================================================
 # GPS-RO BUFR dump file
@@ -26,13 +26,16 @@ from wxflow import Logger
 # ====================================================================
 
 
+def Id_as_str(ids):
+
+    # a masked id prints as str(ma.masked)
+    return np.where(ma.getmaskarray(ids), str(ma.masked), ma.getdata(ids).astype('str'))
+
+
 def Derive_stationIdentification(said, ptid):
 
-    stid = []
-    for i in range(len(said)):
-        newval = str(said[i]).zfill(4)+str(ptid[i]).zfill(4)
-        stid.append(str(newval))
-    stid = np.array(stid).astype(dtype='str')
+    stid = np.char.add(np.char.zfill(Id_as_str(said), 4), np.char.zfill(Id_as_str(ptid), 4))
+    stid = stid.astype(f"U{np.char.str_len(stid).max(initial=1)}")
     stid = ma.array(stid)
     ma.set_fill_value(stid, "")
 
@@ -41,9 +44,10 @@ def Derive_stationIdentification(said, ptid):
 
 def Compute_Grid_Location(degrees):
 
-    for i in range(len(degrees)):
-        if degrees[i] <= 360 and degrees[i] >= -180:
-            degrees[i] = np.deg2rad(degrees[i])
+    # converted in place, masked and out of range values are left as they are
+    data = ma.getdata(degrees)
+    valid = ma.filled((degrees <= 360) & (degrees >= -180), False)
+    data[valid] = np.deg2rad(data[valid])
     rad = degrees
 
     return rad
@@ -56,7 +60,8 @@ def Compute_imph(impp, elrc):
     return imph
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -88,7 +93,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug(f"Making QuerySet ...")
     q = bufr.QuerySet(subsets)
@@ -148,15 +153,11 @@ def bufr_to_ioda(config, logger):
     q.add('obsTypeBendingAngle', '*/SAID')
     q.add('obsTypeAtmosphericRefractivity', '*/SAID')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.debug(f"Executing QuerySet to get ResultSet ...")
     with bufr.File(DATA_PATH) as f:
@@ -286,15 +287,12 @@ def bufr_to_ioda(config, logger):
 
     logger.debug(f"     bndaot    shape, type = {bndaot.shape}, {bndaot.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet to get ResultSet: \
-                {running_time} seconds")
+    timer.obs_in(len(clath))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.debug(f"Creating derived variables - stationIdentification")
     stid = Derive_stationIdentification(said, ptid)
@@ -321,19 +319,16 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     imph3 min/max = {imph3.min()}, {imph3.max()}")
 
     logger.debug(f"Keep bending angle with Freq = 0.0")
-    for i in range(len(said)):
-        if (mefr2[i] == 0.0):
-            bnda1[i] = bnda2[i]
-            mefr1[i] = mefr2[i]
-            impp1[i] = impp2[i]
-            imph1[i] = imph2[i]
-            bndaoe1[i] = bndaoe2[i]
-        if (mefr3[i] == 0.0):
-            bnda1[i] = bnda3[i]
-            mefr1[i] = mefr3[i]
-            impp1[i] = impp3[i]
-            imph1[i] = imph3[i]
-            bndaoe1[i] = bndaoe3[i]
+    # the third replication wins over the second, the values replace data and mask
+    # of the first replication in place so that its fill values are kept
+    for mefr, bnda, impp, imph, bndaoe in ((mefr2, bnda2, impp2, imph2, bndaoe2),
+                                           (mefr3, bnda3, impp3, imph3, bndaoe3)):
+        swap = ma.filled(mefr == 0.0, False)
+        bnda1[swap] = bnda[swap]
+        mefr1[swap] = mefr[swap]
+        impp1[swap] = impp[swap]
+        imph1[swap] = imph[swap]
+        bndaoe1[swap] = bndaoe[swap]
 
     logger.debug(f"     new bnda1 shape, type, min/max {bnda1.shape}, \
                 {bnda1.dtype}, {bnda1.min()}, {bnda1.max()}")
@@ -346,53 +341,28 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     new bndaoe1 shape, type, min/max {bndaoe1.shape}, \
                 {bndaoe1.dtype}, {bndaoe1.min()}, {bndaoe1.max()}")
 
-#   find ibit for qfro (16bit from left to right)
-    bit3 = []
-    bit5 = []
-    bit6 = []
-    for quality in qfro:
-        if quality & 8192 > 0:
-            bit3.append(1)
-        else:
-            bit3.append(0)
-
-        if quality & 2048 > 0:
-            bit5.append(1)
-        else:
-            bit5.append(0)
-
-        if quality & 1024 > 0:
-            bit6.append(1)
-        else:
-            bit6.append(0)
-    bit3 = np.array(bit3)
-    bit5 = np.array(bit5)
-    bit6 = np.array(bit6)
+#   find ibit for qfro (16bit from left to right), none set when qfro is missing
+    quality = ma.filled(qfro, 0)
+    bit3 = ((quality & 8192) > 0).astype(int)
+    bit5 = ((quality & 2048) > 0).astype(int)
+    bit6 = ((quality & 1024) > 0).astype(int)
     logger.debug(f"     new bit3 shape, type, min/max {bit3.shape}, \
                 {bit3.dtype}, {bit3.min()}, {bit3.max()}")
 
 #   overwrite satelliteAscendingFlag and QFRO
-    for quality in range(len(bit3)):
-        satasc[quality] = 0
-        qfro2[quality] = 0.0
-        if bit3[quality] == 1:
-            satasc[quality] = 1
-        if (bit5[quality] == 1) or (bit6[quality] == 1):
-            qfro2[quality] = 1.0
+    satasc[:] = np.where(bit3 == 1, 1, 0)
+    qfro2[:] = np.where((bit5 == 1) | (bit6 == 1), 1.0, 0.0)
 
     logger.debug(f"     new satasc shape, type, min/max {satasc.shape}, \
                 {satasc.dtype}, {satasc.min()}, {satasc.max()}")
     logger.debug(f"     new qfro2 shape, type, min/max {qfro2.shape}, \
                 {qfro2.dtype}, {qfro2.min()}, {qfro2.max()}, {qfro2.fill_value}")
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for creating derived variables: {running_time} \
-                seconds")
 
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Find unique satellite identifiers in data to process
     unique_satids = np.unique(said)
@@ -412,7 +382,8 @@ def bufr_to_ioda(config, logger):
         os.makedirs(path)
 
     # Create IODA ObsSpace
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -624,18 +595,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Atmospheric Refractivity ObsType') \
         .write_data(arfrot)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for splitting and output IODA for gnssro bufr: \
-                {running_time} seconds")
-
     logger.debug("All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration', required=True)
@@ -652,7 +616,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
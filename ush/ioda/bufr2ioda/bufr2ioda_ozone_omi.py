@@ -5,13 +5,15 @@ import numpy.ma as ma
 from pyiodaconv import bufr
 import calendar
 import json
-import time
 import math
 import datetime
 import os
 from datetime import datetime
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from ioda_schema import IodaVar, write_global_attrs, write_ioda_vars
+from satellite_splitter import SatelliteSplitter
 
 # =======================================================================
 # Subset    |  Description                                              |
@@ -21,7 +23,8 @@ from wxflow import Logger
 # =======================================================================
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     # ==================================
     # Get parameters from configuration
@@ -70,7 +73,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
     q = bufr.QuerySet()
@@ -96,15 +99,11 @@ def bufr_to_ioda(config, logger):
     # ObsValue
     q.add('ozoneTotal', '*/OZON')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for making QuerySet : {running_time} seconds')
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.info('Executing QuerySet to get ResultSet')
     with bufr.File(DATA_PATH) as f:
@@ -140,41 +139,52 @@ def bufr_to_ioda(config, logger):
     # IODA has no support for numpy datetime arrays dtype=datetime64[s]
     timestamp = r.get_datetime('year', 'month', 'day', 'hour', 'minute', 'second').astype(np.int64)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for executing QuerySet to get ResultSet : {running_time} seconds')
+    timer.obs_in(len(satid))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     # Create pressure variable and fill in with zeros
     pressure = np.ma.array(np.zeros(lat.shape[0], dtype=np.float32))
     pressure.mask = lat.mask
     pressure.fill_value = lat.fill_value
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    print('Running time for creating derived variables : ', running_time, 'seconds')
-
     # =====================================
     # Split output based on satellite id
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('split')
     logger.info('Split data based on satellite id, Create IODA ObsSpace and Write IODA output')
 
-    # Find unique satellite identifiers in data to process
-    unique_satids = np.unique(satid)
+    # Sort the data by satellite identifier once, the data of a satellite is then a contiguous slice
+    splitter = SatelliteSplitter(satid)
+    unique_satids = splitter.satids
+    lon, lat, satid, solzenang, scanpos, timestamp, pressure, toqc, toqf, afbo, o3val = \
+        splitter.sort(lon, lat, satid, solzenang, scanpos, timestamp, pressure, toqc, toqf, afbo, o3val)
     logger.info(f'Number of Unique satellite identifiers : {len(unique_satids)}')
     logger.info(f'Unique satellite identifiers: {unique_satids}')
 
     logger.debug(f'Loop through unique satellite identifier : {unique_satids}')
-    total_ob_processed = 0
-    for sat in unique_satids.tolist():
-        start_time = time.time()
 
+    # IODA variables of each satellite file
+    schema = [
+        IodaVar('MetaData/longitude', units='degrees_east', long_name='Longitude', valid_range=np.array([-180, 180], dtype=np.float32)),
+        IodaVar('MetaData/latitude', units='degrees_north', long_name='Latitude', valid_range=np.array([-90, 90], dtype=np.float32)),
+        IodaVar('MetaData/dateTime', units='seconds since 1970-01-01T00:00:00Z', long_name='Unix Epoch'),
+        IodaVar('MetaData/satelliteIdentifier', long_name='Satellite Identifier'),
+        IodaVar('MetaData/totalOzoneQualityFlag', long_name='Total Ozone Quality Flag  '),
+        IodaVar('MetaData/totalOzoneQualityCode', long_name='OMI Total Ozone Quality Code'),
+        IodaVar('MetaData/pressure', units='pa', long_name='Pressure'),
+        IodaVar('MetaData/bestOzoneAlgorithmFlag', long_name='Algorithm Flag for Best Ozone'),
+        IodaVar('MetaData/solarZenithAngle', units='m', long_name='Solar Zenith Angle'),
+        IodaVar('MetaData/sensorScanPosition', long_name='Sensor Scan Position'),
+        IodaVar('ObsValue/ozoneTotal', units='DU', long_name='Total Column Ozone'),
+    ]
+
+    def write_satellite(sat):
         matched = False
         for satellite_info in satellite_info_array:
             if (satellite_info["satellite_id"] == sat):
@@ -186,24 +196,13 @@ def bufr_to_ioda(config, logger):
 
         if matched:
 
-            # Define a boolean mask to subset data from the original data object
-            mask = satid == sat
+            # Rows of the satellite in the data sorted by satellite identifier, as views
             # MetaData
-            lon2 = lon[mask]
-            lat2 = lat[mask]
-            satid2 = satid[mask]
-            solzenang2 = solzenang[mask]
-            scanpos2 = scanpos[mask]
-            timestamp2 = timestamp[mask]
-            pressure2 = pressure[mask]
-
-            # QC Info
-            toqc2 = toqc[mask]
-            toqf2 = toqf[mask]
-            afbo2 = afbo[mask]
-
-            # ObsValue
-            o3val2 = o3val[mask]
+            lon2, lat2, satid2, solzenang2, scanpos2, timestamp2, pressure2 = \
+                splitter.take(sat, lon, lat, satid, solzenang, scanpos, timestamp, pressure)
+
+            # QC Info and ObsValue
+            toqc2, toqf2, afbo2, o3val2 = splitter.take(sat, toqc, toqf, afbo, o3val)
 
             timestamp2_min = datetime.fromtimestamp(timestamp2.min())
             timestamp2_max = datetime.fromtimestamp(timestamp2.max())
@@ -218,106 +217,60 @@ def bufr_to_ioda(config, logger):
             iodafile = f"{cycle_type}.t{hh}z.{ioda_type}_{sat}.tm00.nc"
             OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
             logger.info(f'Create output file : {OUTPUT_PATH}')
-            obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+            obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
 
             # Create Global attributes
             logger.debug('Create global attributes')
-            obsspace.write_attr('sourceFiles', bufrfile)
-            obsspace.write_attr('source', source)
-            obsspace.write_attr('description', data_description)
-            obsspace.write_attr('datetimeReference', reference_time)
-            obsspace.write_attr('Converter', converter)
-            obsspace.write_attr('platformLongDescription', platform_description)
-            obsspace.write_attr('platformCommonName', satellite_name)
-            obsspace.write_attr('platform', satellite_id)
-            obsspace.write_attr('sensorLongDescription', sensor_description)
-            obsspace.write_attr('sensorCommonName', sensor_name)
-            obsspace.write_attr('sensor', sensor_id)
-            obsspace.write_attr('dataProviderOrigin', data_provider)
-            obsspace.write_attr('processingLevel', process_level)
-            obsspace.write_attr('datetimeRange', [str(timestamp2_min), str(timestamp2_max)])
+            write_global_attrs(obsspace, {
+                'sourceFiles': bufrfile,
+                'source': source,
+                'description': data_description,
+                'datetimeReference': reference_time,
+                'Converter': converter,
+                'platformLongDescription': platform_description,
+                'platformCommonName': satellite_name,
+                'platform': satellite_id,
+                'sensorLongDescription': sensor_description,
+                'sensorCommonName': sensor_name,
+                'sensor': sensor_id,
+                'dataProviderOrigin': data_provider,
+                'processingLevel': process_level,
+                'datetimeRange': [str(timestamp2_min), str(timestamp2_max)],
+            })
 
             # Create IODA variables
             logger.debug('Create variables: name, type, units, and attributes')
-            # Longitude
-            obsspace.create_var('MetaData/longitude', dtype=lon2.dtype, fillval=lon2.fill_value) \
-                .write_attr('units', 'degrees_east') \
-                .write_attr('valid_range', np.array([-180, 180], dtype=np.float32)) \
-                .write_attr('long_name', 'Longitude') \
-                .write_data(lon2)
-
-            # Latitude
-            obsspace.create_var('MetaData/latitude', dtype=lat2.dtype, fillval=lat2.fill_value) \
-                .write_attr('units', 'degrees_north') \
-                .write_attr('valid_range', np.array([-90, 90], dtype=np.float32)) \
-                .write_attr('long_name', 'Latitude') \
-                .write_data(lat2)
-
-            # Datetime
-            obsspace.create_var('MetaData/dateTime', dtype=timestamp2.dtype, fillval=timestamp2.fill_value) \
-                .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-                .write_attr('long_name', 'Unix Epoch') \
-                .write_data(timestamp2)
-
-            # Satellite Identifier
-            obsspace.create_var('MetaData/satelliteIdentifier', dtype=satid2.dtype, fillval=satid2.fill_value) \
-                .write_attr('long_name', 'Satellite Identifier') \
-                .write_data(satid2)
-
-            # Total Ozone Quality Flag
-            obsspace.create_var('MetaData/totalOzoneQualityFlag', dtype=toqf2.dtype, fillval=toqf2.fill_value) \
-                .write_attr('long_name', 'Total Ozone Quality Flag  ') \
-                .write_data(toqf2)
-
-            # Total Ozone Quality Code
-            obsspace.create_var('MetaData/totalOzoneQualityCode', dtype=toqc2.dtype, fillval=toqc2.fill_value) \
-                .write_attr('long_name', 'OMI Total Ozone Quality Code') \
-                .write_data(toqc2)
-
-            # Pressure
-            obsspace.create_var('MetaData/pressure', dtype=pressure2.dtype, fillval=pressure2.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Pressure') \
-                .write_data(pressure2)
-
-            # Algorithm Flag for Best Ozone
-            obsspace.create_var('MetaData/bestOzoneAlgorithmFlag', dtype=afbo2.dtype, fillval=afbo2.fill_value) \
-                .write_attr('long_name', 'Algorithm Flag for Best Ozone') \
-                .write_data(afbo2)
-
-            # Solar Zenith Angle
-            obsspace.create_var('MetaData/solarZenithAngle', dtype=solzenang2.dtype, fillval=solzenang2.fill_value) \
-                .write_attr('units', 'm') \
-                .write_attr('long_name', 'Solar Zenith Angle') \
-                .write_data(solzenang2)
-
-            # Sensor Scan Position
-            obsspace.create_var('MetaData/sensorScanPosition', dtype=scanpos2.dtype, fillval=scanpos2.fill_value) \
-                .write_attr('long_name', 'Sensor Scan Position') \
-                .write_data(scanpos2)
-
-            # Total Ozone
-            obsspace.create_var('ObsValue/ozoneTotal', dtype=o3val2.dtype, fillval=o3val2.fill_value) \
-                .write_attr('units', 'DU') \
-                .write_attr('long_name', 'Total Column Ozone') \
-                .write_data(o3val2)
-
-            end_time = time.time()
-            running_time = end_time - start_time
-            total_ob_processed += len(satid2)
-            logger.debug(f'Processing time for splitting and output IODA for {satinst} : {running_time}, seconds')
+            write_ioda_vars(obsspace, schema, {
+                'MetaData/longitude': lon2,
+                'MetaData/latitude': lat2,
+                'MetaData/dateTime': timestamp2,
+                'MetaData/satelliteIdentifier': satid2,
+                'MetaData/totalOzoneQualityFlag': toqf2,
+                'MetaData/totalOzoneQualityCode': toqc2,
+                'MetaData/pressure': pressure2,
+                'MetaData/bestOzoneAlgorithmFlag': afbo2,
+                'MetaData/solarZenithAngle': solzenang2,
+                'MetaData/sensorScanPosition': scanpos2,
+                'ObsValue/ozoneTotal': o3val2,
+            })
+
+            return OUTPUT_PATH, len(satid2)
 
         else:
             logger.info(f'Do not find this satellite id in the configuration: satid = {sat}')
 
+    timer.stage('write')
+    total_ob_processed = 0
+    for OUTPUT_PATH, nobs in splitter.write(write_satellite):
+        timer.output(OUTPUT_PATH, nobs)
+        total_ob_processed += nobs
+
     logger.info('All Done!')
     logger.info(f'Total number of observation processed : {total_ob_processed}')
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -331,7 +284,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time : {running_time} seconds")
@@ -5,13 +5,16 @@ import numpy.ma as ma
 from pyiodaconv import bufr
 import calendar
 import json
-import time
 import math
 import datetime
 import os
 from datetime import datetime
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from ioda_schema import IodaVar, write_global_attrs, write_ioda_vars
+from satellite_splitter import SatelliteSplitter
+from debug_dump import DebugDump
 
 # ==================================================================================================
 # Subset    |  Description (OMPS NP)                                                               |
@@ -24,20 +27,10 @@ from wxflow import Logger
 # ==================================================================================================
 
 
-def format_element(x):
-
-    field_width = 15
-    decimal_places = 5
-    scientific_notation_threshold = 1000
-
-    if abs(x) < scientific_notation_threshold:
-        return f"{x:>{field_width}.{decimal_places}f}"
-    else:
-        return f"{x:>{field_width}.5e}"
-
-
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
+    debug_dump = DebugDump(__file__, config)
     # Get parameters from configuration
     subsets = config["subsets"]
     source = config["source"]
@@ -83,7 +76,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
     q = bufr.QuerySet()
@@ -109,15 +102,11 @@ def bufr_to_ioda(config, logger):
     # ObsValue
     q.add('ozoneLayer', '*/OZOPQLSQ/OZOP[2]')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for making QuerySet : {running_time} seconds')
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.info('Executing QuerySet to get ResultSet')
     with bufr.File(DATA_PATH) as f:
@@ -153,14 +142,12 @@ def bufr_to_ioda(config, logger):
     # IODA has no support for numpy datetime arrays dtype=datetime64[s]
     timestamp = r.get_datetime('year', 'month', 'day', 'hour', 'minute', 'second', 'ozoneLayer').astype(np.int64)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for executing QuerySet to get ResultSet : {running_time} seconds')
+    timer.obs_in(len(satid))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     # Set reference pressure
     nlevs = 21
@@ -245,14 +232,15 @@ def bufr_to_ioda(config, logger):
     pbot1 = arrays_dict['pbot']
     presv1 = presv.reshape(nprofs, 22, 2)
 
-    # Print the profiles for debugging
-    for i in range(o3val1.shape[0]):
-        for k in reversed(range(o3val1.shape[1])):
-            row = np.array([i+1, k+1, lat1[i, k], lon1[i, k], ptop1[i, k], pbot1[i, k], pressure1[i, k], presv1[i, k, 0], presv1[i, k, 1],
-                            o3val1[i, k], toqc1[i, k], poqc1[i, k], solzenang1[i, k]])
-            frow = [format_element(x) for x in row.flatten()]
-            row = ' '.join(frow)
-            logger.debug(row)
+    # Dump the profiles for debugging, one row per profile and level from the top level down
+    if debug_dump.enabled:
+        nlevels = o3val1.shape[1]
+        debug_dump.write(logger,
+                         profile=np.repeat(np.arange(1, nprofs + 1), nlevels),
+                         level=np.tile(np.arange(nlevels, 0, -1), nprofs),
+                         lat=lat1[:, ::-1], lon=lon1[:, ::-1], ptop=ptop1[:, ::-1], pbot=pbot1[:, ::-1],
+                         pressure=pressure1[:, ::-1], presv_top=presv1[:, ::-1, 0], presv_bot=presv1[:, ::-1, 1],
+                         o3val=o3val1[:, ::-1], toqc=toqc1[:, ::-1], poqc=poqc1[:, ::-1], solzenang=solzenang1[:, ::-1])
 
     # Update the variables with the modified arrays
     lat1 = arrays_dict['lat'].flatten()
@@ -268,27 +256,43 @@ def bufr_to_ioda(config, logger):
     pbot1 = arrays_dict['pbot'].flatten()
     presv1 = presv1.reshape(-1, presv1.shape[-1])
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Running time for creating derived variables : {running_time} seconds')
-
     # =====================================
     # Split output based on satellite id
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('split')
     logger.info('Split data based on satellite id, Create IODA ObsSpace and Write IODA output')
 
-    # Find unique satellite identifiers in data to process
-    unique_satids = np.unique(satid)
+    # Sort the data by satellite identifier once, the data of a satellite is then a contiguous slice
+    splitter = SatelliteSplitter(satid1)
+    unique_satids = splitter.satids
+    lon1, lat1, satid1, solzenang1, timestamp1, pressure1, presv1, ptop1, pbot1, toqc1, poqc1, o3val1 = \
+        splitter.sort(lon1, lat1, satid1, solzenang1, timestamp1, pressure1, presv1, ptop1, pbot1, toqc1, poqc1, o3val1)
     logger.info(f'Number of Unique satellite identifiers : {len(unique_satids)}')
     logger.info(f'Unique satellite identifiers: {unique_satids}')
 
     logger.debug(f'Loop through unique satellite identifier : {unique_satids}')
-    total_ob_processed = 0
-    for sat in unique_satids.tolist():
-        start_time = time.time()
 
+    # IODA variables of each satellite file
+    schema = [
+        IodaVar('MetaData/longitude', units='degrees_east', long_name='Longitude', valid_range=np.array([-180, 180], dtype=np.float32), fillval=lon.fill_value),
+        IodaVar('MetaData/latitude', units='degrees_north', long_name='Latitude', valid_range=np.array([-90, 90], dtype=np.float32), fillval=lat.fill_value),
+        IodaVar('MetaData/dateTime', units='seconds since 1970-01-01T00:00:00Z', long_name='Unix Epoch', fillval=timestamp.fill_value),
+        IodaVar('MetaData/satelliteIdentifier', long_name='Satellite Identifier', fillval=satid.fill_value),
+        IodaVar('MetaData/totalOzoneQuality', long_name='Total Ozone Quality', fillval=toqc.fill_value),
+        IodaVar('MetaData/profileOzoneQuality', long_name='Layer Ozone Quality', fillval=poqc.fill_value),
+        IodaVar('MetaData/pressure', units='pa', long_name='Pressure', fillval=lat.fill_value),
+        IodaVar('RetrievalAncillaryData/pressureVertice', units='pa', long_name='Retrieval Pressure Vertices', dim_list=['Location', 'Vertice'],
+                dtype=pbot1.dtype, fillval=lat.fill_value),
+        IodaVar('MetaData/topLevelPressure', units='pa', long_name='Top Level Pressure', fillval=lat.fill_value),
+        IodaVar('MetaData/bottomLevelPressure', units='pa', long_name='Bottom Level Pressure', fillval=lat.fill_value),
+        IodaVar('MetaData/solarZenithAngle', units='degree', long_name='Solar Zenith Angle', valid_range=np.array([0, 180], dtype=np.float32),
+                fillval=solzenang.fill_value),
+        IodaVar('ObsValue/ozoneLayer', units='DU', long_name='Layer Ozone', fillval=o3val.fill_value),
+    ]
+
+    def write_satellite(sat):
         matched = False
         for satellite_info in satellite_info_array:
             if (satellite_info["satellite_id"] == sat):
@@ -300,25 +304,15 @@ def bufr_to_ioda(config, logger):
 
         if matched:
 
-            # Define a boolean mask to subset data from the original data object
-            mask = satid1 == sat
+            # Rows of the satellite in the data sorted by satellite identifier, as views;
+            # all but the layer bounds are written in reverse order
             # MetaData
-            lon2 = np.flip(lon1[mask], axis=0)
-            lat2 = np.flip(lat1[mask], axis=0)
-            satid2 = np.flip(satid1[mask], axis=0)
-            solzenang2 = np.flip(solzenang1[mask], axis=0)
-            timestamp2 = np.flip(timestamp1[mask], axis=0)
-            pressure2 = np.flip(pressure1[mask], axis=0)
-            presv2 = np.flip(presv1[mask], axis=0)
-            ptop2 = ptop1[mask]
-            pbot2 = pbot1[mask]
-
-            # QC Info
-            toqc2 = np.flip(toqc1[mask], axis=0)
-            poqc2 = np.flip(poqc1[mask], axis=0)
-
-            # ObsValue
-            o3val2 = np.flip(o3val1[mask], axis=0)
+            lon2, lat2, satid2, solzenang2, timestamp2, pressure2, presv2 = \
+                [np.flip(var, axis=0) for var in splitter.take(sat, lon1, lat1, satid1, solzenang1, timestamp1, pressure1, presv1)]
+            ptop2, pbot2 = splitter.take(sat, ptop1, pbot1)
+
+            # QC Info and ObsValue
+            toqc2, poqc2, o3val2 = [np.flip(var, axis=0) for var in splitter.take(sat, toqc1, poqc1, o3val1)]
 
             timestamp2_min = datetime.fromtimestamp(timestamp1.min())
             timestamp2_max = datetime.fromtimestamp(timestamp1.max())
@@ -336,110 +330,60 @@ def bufr_to_ioda(config, logger):
             sat = satellite_name.lower()
             iodafile = f"{cycle_type}.t{hh}z.{ioda_type}_{sat}.tm00.nc"
             OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
-            obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+            obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
             logger.info(f'Create output file : {OUTPUT_PATH}')
 
             # Create Global attributes
             logger.debug('Create global attributes')
-            obsspace.write_attr('sourceFiles', bufrfile)
-            obsspace.write_attr('source', source)
-            obsspace.write_attr('description', data_description)
-            obsspace.write_attr('datetimeReference', reference_time)
-            obsspace.write_attr('Converter', converter)
-            obsspace.write_attr('platformLongDescription', platform_description)
-            obsspace.write_attr('platformCommonName', satellite_name)
-            obsspace.write_attr('platform', satellite_id)
-            obsspace.write_attr('sensorLongDescription', sensor_description)
-            obsspace.write_attr('sensorCommonName', sensor_name)
-            obsspace.write_attr('sensor', sensor_id)
-            obsspace.write_attr('dataProviderOrigin', data_provider)
-            obsspace.write_attr('processingLevel', process_level)
-            obsspace.write_attr('datetimeRange', [str(timestamp2_min), str(timestamp2_max)])
-
-            # Create IODA variables
-            # Longitude
-            obsspace.create_var('MetaData/longitude', dtype=lon2.dtype, fillval=lon.fill_value) \
-                .write_attr('units', 'degrees_east') \
-                .write_attr('valid_range', np.array([-180, 180], dtype=np.float32)) \
-                .write_attr('long_name', 'Longitude') \
-                .write_data(lon2)
-
-            # Latitude
-            obsspace.create_var('MetaData/latitude', dtype=lat2.dtype, fillval=lat.fill_value) \
-                .write_attr('units', 'degrees_north') \
-                .write_attr('valid_range', np.array([-90, 90], dtype=np.float32)) \
-                .write_attr('long_name', 'Latitude') \
-                .write_data(lat2)
-
-            # Datetime
-            obsspace.create_var('MetaData/dateTime', dtype=timestamp2.dtype, fillval=timestamp.fill_value) \
-                .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-                .write_attr('long_name', 'Unix Epoch') \
-                .write_data(timestamp2)
-
-            # Satellite Identifier
-            obsspace.create_var('MetaData/satelliteIdentifier', dtype=satid2.dtype, fillval=satid.fill_value) \
-                .write_attr('long_name', 'Satellite Identifier') \
-                .write_data(satid2)
-
-            # Total Ozone Quality
-            obsspace.create_var('MetaData/totalOzoneQuality', dtype=toqc2.dtype, fillval=toqc.fill_value) \
-                .write_attr('long_name', 'Total Ozone Quality') \
-                .write_data(toqc2)
-
-            # Profile Ozone Quality
-            obsspace.create_var('MetaData/profileOzoneQuality', dtype=poqc2.dtype, fillval=poqc.fill_value) \
-                .write_attr('long_name', 'Layer Ozone Quality') \
-                .write_data(poqc2)
-
-            # Pressure
-            obsspace.create_var('MetaData/pressure', dtype=pressure2.dtype, fillval=lat.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Pressure') \
-                .write_data(pressure2)
-
-            # Pressure vertices
-            obsspace.create_var('RetrievalAncillaryData/pressureVertice', dim_list=['Location', 'Vertice'], dtype=pbot2.dtype, fillval=lat.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Retrieval Pressure Vertices') \
-                .write_data(presv2)
-
-            # Top-level Pressure
-            obsspace.create_var('MetaData/topLevelPressure', dtype=ptop2.dtype, fillval=lat.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Top Level Pressure') \
-                .write_data(ptop2)
-
-            # Bottom-level Pressure
-            obsspace.create_var('MetaData/bottomLevelPressure', dtype=pbot2.dtype, fillval=lat.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Bottom Level Pressure') \
-                .write_data(pbot2)
-
-            # Solar Zenith Angle
-            obsspace.create_var('MetaData/solarZenithAngle', dtype=solzenang2.dtype, fillval=solzenang.fill_value) \
-                .write_attr('units', 'degree') \
-                .write_attr('valid_range', np.array([0, 180], dtype=np.float32)) \
-                .write_attr('long_name', 'Solar Zenith Angle') \
-                .write_data(solzenang2)
-
-            # Layer Ozone and Total Ozone
-            obsspace.create_var('ObsValue/ozoneLayer', dtype=o3val2.dtype, fillval=o3val.fill_value) \
-                .write_attr('units', 'DU') \
-                .write_attr('long_name', 'Layer Ozone') \
-                .write_data(o3val2)
+            write_global_attrs(obsspace, {
+                'sourceFiles': bufrfile,
+                'source': source,
+                'description': data_description,
+                'datetimeReference': reference_time,
+                'Converter': converter,
+                'platformLongDescription': platform_description,
+                'platformCommonName': satellite_name,
+                'platform': satellite_id,
+                'sensorLongDescription': sensor_description,
+                'sensorCommonName': sensor_name,
+                'sensor': sensor_id,
+                'dataProviderOrigin': data_provider,
+                'processingLevel': process_level,
+                'datetimeRange': [str(timestamp2_min), str(timestamp2_max)],
+            })
+
+            write_ioda_vars(obsspace, schema, {
+                'MetaData/longitude': lon2,
+                'MetaData/latitude': lat2,
+                'MetaData/dateTime': timestamp2,
+                'MetaData/satelliteIdentifier': satid2,
+                'MetaData/totalOzoneQuality': toqc2,
+                'MetaData/profileOzoneQuality': poqc2,
+                'MetaData/pressure': pressure2,
+                'RetrievalAncillaryData/pressureVertice': presv2,
+                'MetaData/topLevelPressure': ptop2,
+                'MetaData/bottomLevelPressure': pbot2,
+                'MetaData/solarZenithAngle': solzenang2,
+                'ObsValue/ozoneLayer': o3val2,
+            })
+
+            return OUTPUT_PATH, len(satid2)
 
         else:
             logger.info(f'Do not find this satellite id in the configuration: satid = {sat}')
 
+    timer.stage('write')
+    total_ob_processed = 0
+    for OUTPUT_PATH, nobs in splitter.write(write_satellite):
+        timer.output(OUTPUT_PATH, nobs)
+        total_ob_processed += nobs
+
     logger.info('All Done!')
     logger.info(f'Total number of observation processed : {total_ob_processed}')
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -453,7 +397,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time : {running_time} seconds")
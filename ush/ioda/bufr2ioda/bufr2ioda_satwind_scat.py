@@ -5,13 +5,15 @@ import numpy.ma as ma
 from pyiodaconv import bufr
 import calendar
 import json
-import time
 import math
 import datetime
 import os
 from datetime import datetime
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from ioda_schema import IodaVar, write_global_attrs, write_ioda_vars
+from satellite_splitter import SatelliteSplitter
 
 # ==============================================================================================
 # Subset    |  Description                                              |  PrepBUFR Report Type
@@ -35,7 +37,8 @@ def Compute_WindComponents_from_WindDirection_and_WindSpeed(wdir, wspd):
     return uob, vob
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     subsets = config['subsets']
     logger.debug(f'Checking subsets = {subsets}')
@@ -86,7 +89,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
     q = bufr.QuerySet(subsets)
@@ -109,15 +112,11 @@ def bufr_to_ioda(config, logger):
     q.add('windDirectionAt10M', '*/WD10')
     q.add('windSpeedAt10M', '*/WS10')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for making QuerySet : {running_time} seconds')
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.info('Executing QuerySet to get ResultSet')
     with bufr.File(DATA_PATH) as f:
@@ -150,14 +149,12 @@ def bufr_to_ioda(config, logger):
     # IODA has no support for numpy datetime arrays dtype=datetime64[s]
     timestamp = r.get_datetime('year', 'month', 'day', 'hour', 'minute', 'second').astype(np.int64)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for executing QuerySet to get ResultSet : {running_time} seconds')
+    timer.obs_in(len(satid))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.info('Creating derived variables')
     logger.debug('Creating derived variables - wind components (uob and vob)')
@@ -180,27 +177,41 @@ def bufr_to_ioda(config, logger):
     logger.debug('Creating derived variables - station elevation')
     stnelv = np.full_like(lat, 0.)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for creating derived variables : {running_time} seconds')
-
     # =====================================
     # Split output based on satellite id
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('split')
     logger.info('Create IODA ObsSpace and Write IODA output based on satellite ID')
 
-    # Find unique satellite identifiers in data to process
-    unique_satids = np.unique(satid)
+    # Sort the data by satellite identifier once, the data of a satellite is then a contiguous slice
+    splitter = SatelliteSplitter(satid)
+    unique_satids = splitter.satids
+    lon, lat, satid, timestamp, pressure, height, stnelv, obstype, wvcq, wdir, wspd, uob, vob = \
+        splitter.sort(lon, lat, satid, timestamp, pressure, height, stnelv, obstype, wvcq, wdir, wspd, uob, vob)
     logger.info(f'Number of Unique satellite identifiers : {len(unique_satids)}')
     logger.info(f'Unique satellite identifiers : {unique_satids}')
 
     logger.debug(f'Loop through unique satellite identifier : {unique_satids}')
-    total_ob_processed = 0
-    for sat in unique_satids.tolist():
-        start_time = time.time()
 
+    # IODA variables of each satellite file
+    schema = [
+        IodaVar('MetaData/longitude', units='degrees_east', long_name='Longitude', valid_range=np.array([-180, 180], dtype=np.float32)),
+        IodaVar('MetaData/latitude', units='degrees_north', long_name='Latitude', valid_range=np.array([-90, 90], dtype=np.float32)),
+        IodaVar('MetaData/dateTime', units='seconds since 1970-01-01T00:00:00Z', long_name='Unix Epoch'),
+        IodaVar('MetaData/satelliteIdentifier', long_name='Satellite Identifier'),
+        IodaVar('MetaData/qualityFlags', long_name='Wind Vector Cell Quality'),
+        IodaVar('MetaData/pressure', units='pa', long_name='Pressure'),
+        IodaVar('MetaData/height', units='m', long_name='Height of Observation'),
+        IodaVar('MetaData/stationElevation', units='m', long_name='Station Elevation'),
+        IodaVar('ObsType/windEastward', long_name='PrepBUFR Report Type'),
+        IodaVar('ObsType/windNorthward', long_name='PrepBUFR Report Type'),
+        IodaVar('ObsValue/windEastward', units='m s-1', long_name='Eastward Wind Component at 10 Meters'),
+        IodaVar('ObsValue/windNorthward', units='m s-1', long_name='Northward Wind Component at 10 Meters'),
+    ]
+
+    def write_satellite(sat):
         matched = False
         for satellite_info in satellite_info_array:
             if (satellite_info["satellite_id"] == sat):
@@ -211,26 +222,13 @@ def bufr_to_ioda(config, logger):
 
         if matched:
 
-            # Define a boolean mask to subset data from the original data object
-            mask = satid == sat
+            # Rows of the satellite in the data sorted by satellite identifier, as views
             # MetaData
-            lon2 = lon[mask]
-            lat2 = lat[mask]
-            satid2 = satid[mask]
-            timestamp2 = timestamp[mask]
-            pressure2 = pressure[mask]
-            height2 = height[mask]
-            stnelv2 = stnelv[mask]
-            obstype2 = obstype[mask]
-
-            # QC Info
-            wvcq2 = wvcq[mask]
-
-            # ObsValue
-            wdir2 = wdir[mask]
-            wspd2 = wspd[mask]
-            uob2 = uob[mask]
-            vob2 = vob[mask]
+            lon2, lat2, satid2, timestamp2, pressure2, height2, stnelv2, obstype2 = \
+                splitter.take(sat, lon, lat, satid, timestamp, pressure, height, stnelv, obstype)
+
+            # QC Info and ObsValue
+            wvcq2, wdir2, wspd2, uob2, vob2 = splitter.take(sat, wvcq, wdir, wspd, uob, vob)
 
             # Timestamp Range
             timestamp2_min = datetime.fromtimestamp(timestamp2.min())
@@ -249,113 +247,61 @@ def bufr_to_ioda(config, logger):
             iodafile = f"{cycle_type}.t{hh}z.{data_type}.{satinst}.tm00.nc"
             OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
             logger.info(f"Create output file : {OUTPUT_PATH}")
-            obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+            obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
 
             # Create Global attributes
             logger.debug('Write global attributes')
-            obsspace.write_attr('Converter', converter)
-            obsspace.write_attr('sourceFiles', bufrfile)
-            obsspace.write_attr('dataProviderOrigin', data_provider)
-            obsspace.write_attr('description', data_description)
-            obsspace.write_attr('datetimeReference', reference_time)
-            obsspace.write_attr('datetimeRange', [str(timestamp2_min), str(timestamp2_max)])
-            obsspace.write_attr('sensor', sensor_id)
-            obsspace.write_attr('platform', satellite_id)
-            obsspace.write_attr('platformCommonName', satellite_name)
-            obsspace.write_attr('sensorCommonName', sensor_name)
-            obsspace.write_attr('processingLevel', process_level)
-            obsspace.write_attr('platformLongDescription', platform_description)
-            obsspace.write_attr('sensorLongDescription', sensor_description)
+            write_global_attrs(obsspace, {
+                'Converter': converter,
+                'sourceFiles': bufrfile,
+                'dataProviderOrigin': data_provider,
+                'description': data_description,
+                'datetimeReference': reference_time,
+                'datetimeRange': [str(timestamp2_min), str(timestamp2_max)],
+                'sensor': sensor_id,
+                'platform': satellite_id,
+                'platformCommonName': satellite_name,
+                'sensorCommonName': sensor_name,
+                'processingLevel': process_level,
+                'platformLongDescription': platform_description,
+                'sensorLongDescription': sensor_description,
+            })
 
             # Create IODA variables
             logger.debug('Write variables: name, type, units, and attributes')
-            # Longitude
-            obsspace.create_var('MetaData/longitude', dtype=lon2.dtype, fillval=lon2.fill_value) \
-                .write_attr('units', 'degrees_east') \
-                .write_attr('valid_range', np.array([-180, 180], dtype=np.float32)) \
-                .write_attr('long_name', 'Longitude') \
-                .write_data(lon2)
-
-            # Latitude
-            obsspace.create_var('MetaData/latitude', dtype=lat2.dtype, fillval=lat2.fill_value) \
-                .write_attr('units', 'degrees_north') \
-                .write_attr('valid_range', np.array([-90, 90], dtype=np.float32)) \
-                .write_attr('long_name', 'Latitude') \
-                .write_data(lat2)
-
-            # Datetime
-            obsspace.create_var('MetaData/dateTime', dtype=timestamp2.dtype, fillval=timestamp2.fill_value) \
-                .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-                .write_attr('long_name', 'Unix Epoch') \
-                .write_data(timestamp2)
-
-            # Satellite Identifier
-            obsspace.create_var('MetaData/satelliteIdentifier', dtype=satid2.dtype, fillval=satid2.fill_value) \
-                .write_attr('long_name', 'Satellite Identifier') \
-                .write_data(satid2)
-
-            # Quality: Wind Vector Cell Quality
-            obsspace.create_var('MetaData/qualityFlags', dtype=wvcq2.dtype, fillval=wvcq2.fill_value) \
-                .write_attr('long_name', 'Wind Vector Cell Quality') \
-                .write_data(wvcq2)
-
-            # Pressure
-            obsspace.create_var('MetaData/pressure', dtype=pressure2.dtype, fillval=pressure2.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Pressure') \
-                .write_data(pressure2)
-
-            # Height
-            obsspace.create_var('MetaData/height', dtype=height2.dtype, fillval=height2.fill_value) \
-                .write_attr('units', 'm') \
-                .write_attr('long_name', 'Height of Observation') \
-                .write_data(height2)
-
-            # Station Elevation
-            obsspace.create_var('MetaData/stationElevation', dtype=stnelv2.dtype, fillval=stnelv2.fill_value) \
-                .write_attr('units', 'm') \
-                .write_attr('long_name', 'Station Elevation') \
-                .write_data(stnelv2)
-
-            # ObsType based on sensor type
-            obsspace.create_var('ObsType/windEastward', dtype=obstype2.dtype, fillval=obstype2.fill_value) \
-                .write_attr('long_name', 'PrepBUFR Report Type') \
-                .write_data(obstype2)
-
-            # ObsType based on sensor type
-            obsspace.create_var('ObsType/windNorthward', dtype=obstype2.dtype, fillval=obstype2.fill_value) \
-                .write_attr('long_name', 'PrepBUFR Report Type') \
-                .write_data(obstype2)
-
-            # U-Wind Component
-            obsspace.create_var('ObsValue/windEastward', dtype=uob2.dtype, fillval=uob2.fill_value) \
-                .write_attr('units', 'm s-1') \
-                .write_attr('long_name', 'Eastward Wind Component at 10 Meters') \
-                .write_data(uob2)
-
-            # V-Wind Component
-            obsspace.create_var('ObsValue/windNorthward', dtype=vob2.dtype, fillval=vob2.fill_value) \
-                .write_attr('units', 'm s-1') \
-                .write_attr('long_name', 'Northward Wind Component at 10 Meters') \
-                .write_data(vob2)
-
-            end_time = time.time()
-            running_time = end_time - start_time
-            total_ob_processed += len(satid2)
+            write_ioda_vars(obsspace, schema, {
+                'MetaData/longitude': lon2,
+                'MetaData/latitude': lat2,
+                'MetaData/dateTime': timestamp2,
+                'MetaData/satelliteIdentifier': satid2,
+                'MetaData/qualityFlags': wvcq2,
+                'MetaData/pressure': pressure2,
+                'MetaData/height': height2,
+                'MetaData/stationElevation': stnelv2,
+                'ObsType/windEastward': obstype2,
+                'ObsType/windNorthward': obstype2,
+                'ObsValue/windEastward': uob2,
+                'ObsValue/windNorthward': vob2,
+            })
+
             logger.debug(f'Number of observation processed : {len(satid2)}')
-            logger.debug(f'Processing time for splitting and output IODA for {satinst} : {running_time} seconds')
+            return OUTPUT_PATH, len(satid2)
 
         else:
             logger.info(f'Do not find this satellite id in the configuration: satid = {sat}')
 
+    timer.stage('write')
+    total_ob_processed = 0
+    for OUTPUT_PATH, nobs in splitter.write(write_satellite):
+        timer.output(OUTPUT_PATH, nobs)
+        total_ob_processed += nobs
+
     logger.info('All Done!')
     logger.info(f'Total number of observation processed : {total_ob_processed}')
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -369,7 +315,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f'Total processing time : {running_time} seconds')
@@ -5,13 +5,16 @@ import numpy.ma as ma
 from pyiodaconv import bufr
 import calendar
 import json
-import time
 import math
 import datetime
 import os
 from datetime import datetime
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from ioda_schema import IodaVar, write_global_attrs, write_ioda_vars
+from satellite_splitter import SatelliteSplitter
+from amv_quality import select_application
 
 # ====================================================================
 # Satellite Winds (AMV) BUFR dump file for AVHRR
@@ -52,7 +55,41 @@ def Get_ObsType(swcm, chanfreq):
     return obstype
 
 
-def bufr_to_ioda(config, logger):
+def build_query(q):
+
+    # MetaData
+    q.add('latitude', '*/CLAT')
+    q.add('longitude', '*/CLON')
+    q.add('satelliteId', '*/SAID')
+    q.add('year', '*/YEAR')
+    q.add('month', '*/MNTH')
+    q.add('day', '*/DAYS')
+    q.add('hour', '*/HOUR')
+    q.add('minute', '*/MINU')
+    q.add('second', '*/SECO')
+    q.add('satelliteZenithAngle', '*/SAZA')
+    q.add('sensorCentralFrequency', '*/SCCF')
+    q.add('pressure', '*/PRLC')
+
+    # Processing Center
+    q.add('dataProviderOrigin', '*/OGCE')
+    q.add('windGeneratingApplication', '*/GQCPRMS[1]/GNAP')
+
+#   # Quality Infomation (Quality Indicator w/o forecast)
+    q.add('qualityInformationWithoutForecast', '*/GQCPRMS[1]/PCCF')
+
+    # Wind Retrieval Method Information
+    q.add('windComputationMethod', '*/SWCM')
+
+    # ObsValue
+    q.add('windDirection', '*/WDIR')
+    q.add('windSpeed', '*/WSPD')
+
+    return q
+
+
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer, r=None):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -102,56 +139,26 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info('Making QuerySet')
-    q = bufr.QuerySet(subsets)
-
-    # MetaData
-    q.add('latitude', '*/CLAT')
-    q.add('longitude', '*/CLON')
-    q.add('satelliteId', '*/SAID')
-    q.add('year', '*/YEAR')
-    q.add('month', '*/MNTH')
-    q.add('day', '*/DAYS')
-    q.add('hour', '*/HOUR')
-    q.add('minute', '*/MINU')
-    q.add('second', '*/SECO')
-    q.add('satelliteZenithAngle', '*/SAZA')
-    q.add('sensorCentralFrequency', '*/SCCF')
-    q.add('pressure', '*/PRLC')
-
-    # Processing Center
-    q.add('dataProviderOrigin', '*/OGCE')
-    q.add('windGeneratingApplication', '*/GQCPRMS[1]/GNAP')
-
-#   # Quality Infomation (Quality Indicator w/o forecast)
-    q.add('qualityInformationWithoutForecast', '*/GQCPRMS[1]/PCCF')
-
-    # Wind Retrieval Method Information
-    q.add('windComputationMethod', '*/SWCM')
-
-    # ObsValue
-    q.add('windDirection', '*/WDIR')
-    q.add('windSpeed', '*/WSPD')
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f'Processing time for making QuerySet : {running_time} seconds')
+    q = build_query(bufr.QuerySet(subsets))
 
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
-    # Use the ResultSet returned to get numpy arrays of the data
+    # Use the ResultSet returned to get numpy arrays of the data,
+    # unless satwnd_amv_fanout.py already decoded the dump for us
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
-    logger.info('Executing QuerySet to get ResultSet')
-    with bufr.File(DATA_PATH) as f:
-        try:
-            r = f.execute(q)
-        except Exception as err:
-            logger.info(f'Return with {err}')
-            return
+    if r is None:
+        logger.info('Executing QuerySet to get ResultSet')
+        with bufr.File(DATA_PATH) as f:
+            try:
+                r = f.execute(q)
+            except Exception as err:
+                logger.info(f'Return with {err}')
+                return
 
     # MetaData
     satid = r.get('satelliteId')
@@ -178,29 +185,10 @@ def bufr_to_ioda(config, logger):
     # packaged in same vector of qi with ga=4 (Estimated Error (EE) in m/s
     # converted to a percent confidence)shape (4,nobs). Must conduct a
     # search and extract the correct vector for gnap and qi
-    # 1. Find dimension-sizes of ga and qi (should be the same!)
-    gDim1, gDim2 = np.shape(ga)
-    qDim1, qDim2 = np.shape(qi)
-    logger.info(f'Generating Application and Quality Information SEARCH:')
-    logger.info(f'Dimension size of GNAP ({gDim1},{gDim2})')
-    logger.info(f'Dimension size of PCCF ({qDim1},{qDim2})')
-    # 2. Initialize gnap and qifn as None, and search for dimension of
-    #    ga with values of 1. If the same column exists for qi, assign
-    #    gnap to ga[:,i] and qifn to qi[:,i], else raise warning that no
-    #    appropriate GNAP/PCCF combination was found
-    gnap = None
-    qifn = None
-    for i in range(gDim2):
-        if np.unique(ga[:, i].squeeze()) == 1:
-            if i <= qDim2:
-                logger.info(f'GNAP/PCCF found for column {i}')
-                gnap = ga[:, i].squeeze()
-                qifn = qi[:, i].squeeze()
-            else:
-                logger.info(f'ERROR: GNAP column {i} outside of PCCF dimension {qDim2}')
-    if (gnap is None) & (qifn is None):
-        logger.info(f'ERROR: GNAP == 1 NOT FOUND OR OUT OF PCCF DIMENSION-RANGE, WILL FAIL!')
-    # If EE is needed, key search on np.unique(ga[:,i].squeeze()) == 4 instead
+    # The column of ga holding 1 is found in one comparison of the
+    # whole array, gnap and qifn are views of the columns of ga and qi
+    gnap, qifn = select_application(ga, qi, 1, logger)
+    # If EE is needed, select the application 4 instead
 
     # Wind Retrieval Method Information
     swcm = r.get('windComputationMethod')
@@ -222,14 +210,12 @@ def bufr_to_ioda(config, logger):
     int32_fill_value = satid.fill_value
     int64_fill_value = timestamp.fill_value.astype(np.int64)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f'Processing time for executing QuerySet to get ResultSet : {running_time} seconds')
+    timer.obs_in(len(satid))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.info('Creating derived variables')
     logger.debug('Creating derived variables - wind components (uob and vob)')
@@ -244,27 +230,47 @@ def bufr_to_ioda(config, logger):
     height = np.full_like(pressure, fill_value=pressure.fill_value, dtype=np.float32)
     stnelev = np.full_like(pressure, fill_value=pressure.fill_value, dtype=np.float32)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f'Processing time for creating derived variables : {running_time} seconds')
-
     # =====================================
     # Split output based on satellite id
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('split')
     logger.info('Create IODA ObsSpace and Write IODA output based on satellite ID')
 
-    # Find unique satellite identifiers in data to process
-    unique_satids = np.unique(satid)
+    # Sort the data by satellite identifier once, the data of a satellite is then a contiguous slice
+    splitter = SatelliteSplitter(satid)
+    unique_satids = splitter.satids
+    lon, lat, timestamp, satid, satzenang, chanfreq, obstype, pressure, height, stnelev, ogce, qifn, swcm, wdir, wspd, uob, vob = \
+        splitter.sort(lon, lat, timestamp, satid, satzenang, chanfreq, obstype, pressure, height, stnelev, ogce, qifn, swcm, wdir, wspd, uob, vob)
     logger.info(f'Number of Unique satellite identifiers: {len(unique_satids)}')
     logger.info(f'Unique satellite identifiers: {unique_satids}')
 
     logger.debug(f'Loop through unique satellite identifier {unique_satids}')
-    total_ob_processed = 0
-    for sat in unique_satids.tolist():
-        start_time = time.time()
 
+    # IODA variables of each satellite file
+    schema = [
+        IodaVar('MetaData/longitude', units='degrees_east', long_name='Longitude', valid_range=np.array([-180, 180], dtype=np.float32)),
+        IodaVar('MetaData/latitude', units='degrees_north', long_name='Latitude', valid_range=np.array([-90, 90], dtype=np.float32)),
+        IodaVar('MetaData/dateTime', units='seconds since 1970-01-01T00:00:00Z', long_name='Datetime', dtype=np.int64, fillval=int64_fill_value),
+        IodaVar('MetaData/satelliteIdentifier', long_name='Satellite Identifier'),
+        IodaVar('MetaData/satelliteZenithAngle', units='degree', long_name='Satellite Zenith Angle', valid_range=np.array([0, 90], dtype=np.float32)),
+        IodaVar('MetaData/sensorCentralFrequency', units='Hz', long_name='Satellite Channel Center Frequency'),
+        IodaVar('MetaData/dataProviderOrigin', long_name='Identification of Originating/Generating Center'),
+        IodaVar('MetaData/qiWithoutForecast', long_name='QI Without Forecast'),
+        IodaVar('MetaData/windComputationMethod', long_name='Satellite-derived Wind Computation Method'),
+        IodaVar('MetaData/pressure', units='pa', long_name='Pressure'),
+        IodaVar('MetaData/height', units='m', long_name='Height of Observation'),
+        IodaVar('MetaData/stationElevation', units='m', long_name='Station Elevation'),
+        IodaVar('ObsType/windEastward', long_name='Observation Type based on Satellite-derived Wind Computation Method and Spectral Band',
+                fillval=swcm.fill_value),
+        IodaVar('ObsType/windNorthward', long_name='Observation Type based on Satellite-derived Wind Computation Method and Spectral Band',
+                fillval=swcm.fill_value),
+        IodaVar('ObsValue/windEastward', units='m s-1', long_name='Eastward Wind Component'),
+        IodaVar('ObsValue/windNorthward', units='m s-1', long_name='Northward Wind Component'),
+    ]
+
+    def write_satellite(sat):
         matched = False
         for satellite_info in satellite_info_array:
             if (satellite_info["satellite_id"] == sat):
@@ -276,34 +282,16 @@ def bufr_to_ioda(config, logger):
 
         if matched:
 
-            # Define a boolean mask to subset data from the original data object
-            mask = satid == sat
+            # Rows of the satellite in the data sorted by satellite identifier, as views
             # MetaData
-            lon2 = lon[mask]
-            lat2 = lat[mask]
-            timestamp2 = timestamp[mask]
-            satid2 = satid[mask]
-            satzenang2 = satzenang[mask]
-            chanfreq2 = chanfreq[mask]
-            obstype2 = obstype[mask]
-            pressure2 = pressure[mask]
-            height2 = height[mask]
-            stnelev2 = stnelev[mask]
-
-            # Processing Center
-            ogce2 = ogce[mask]
-
-            # QC Info
-            qifn2 = qifn[mask]
-
-            # Method
-            swcm2 = swcm[mask]
-
-            # ObsValue
-            wdir2 = wdir[mask]
-            wspd2 = wspd[mask]
-            uob2 = uob[mask]
-            vob2 = vob[mask]
+            lon2, lat2, timestamp2, satid2, satzenang2, chanfreq2, obstype2, pressure2, height2, stnelev2 = \
+                splitter.take(sat, lon, lat, timestamp, satid, satzenang, chanfreq, obstype, pressure, height, stnelev)
+
+            # Processing Center and QC Info
+            ogce2, qifn2 = splitter.take(sat, ogce, qifn)
+
+            # Method and ObsValue
+            swcm2, wdir2, wspd2, uob2, vob2 = splitter.take(sat, swcm, wdir, wspd, uob, vob)
 
             # Timestamp Range
             timestamp2_min = datetime.fromtimestamp(timestamp2.min())
@@ -322,136 +310,65 @@ def bufr_to_ioda(config, logger):
             iodafile = f"{cycle_type}.t{hh}z.{data_type}.{satinst}.tm00.nc"
             OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
             logger.info(f'Create output file : {OUTPUT_PATH}')
-            obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+            obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
 
             # Create Global attributes
             logger.debug('Write global attributes')
-            obsspace.write_attr('Converter', converter)
-            obsspace.write_attr('sourceFiles', bufrfile)
-            obsspace.write_attr('dataProviderOrigin', data_provider)
-            obsspace.write_attr('description', data_description)
-            obsspace.write_attr('datetimeReference', reference_time)
-            obsspace.write_attr('datetimeRange', [str(timestamp2_min), str(timestamp2_max)])
-            obsspace.write_attr('sensor', sensor_id)
-            obsspace.write_attr('platform', satellite_id)
-            obsspace.write_attr('platformCommonName', satellite_name)
-            obsspace.write_attr('sensorCommonName', sensor_name)
-            obsspace.write_attr('processingLevel', process_level)
-            obsspace.write_attr('platformLongDescription', platform_description)
-            obsspace.write_attr('sensorLongDescription', sensor_description)
+            write_global_attrs(obsspace, {
+                'Converter': converter,
+                'sourceFiles': bufrfile,
+                'dataProviderOrigin': data_provider,
+                'description': data_description,
+                'datetimeReference': reference_time,
+                'datetimeRange': [str(timestamp2_min), str(timestamp2_max)],
+                'sensor': sensor_id,
+                'platform': satellite_id,
+                'platformCommonName': satellite_name,
+                'sensorCommonName': sensor_name,
+                'processingLevel': process_level,
+                'platformLongDescription': platform_description,
+                'sensorLongDescription': sensor_description,
+            })
 
             # Create IODA variables
             logger.debug('Write variables: name, type, units, and attributes')
-            # Longitude
-            obsspace.create_var('MetaData/longitude', dtype=lon2.dtype, fillval=lon2.fill_value) \
-                .write_attr('units', 'degrees_east') \
-                .write_attr('valid_range', np.array([-180, 180], dtype=np.float32)) \
-                .write_attr('long_name', 'Longitude') \
-                .write_data(lon2)
-
-            # Latitude
-            obsspace.create_var('MetaData/latitude', dtype=lat.dtype, fillval=lat2.fill_value) \
-                .write_attr('units', 'degrees_north') \
-                .write_attr('valid_range', np.array([-90, 90], dtype=np.float32)) \
-                .write_attr('long_name', 'Latitude') \
-                .write_data(lat2)
-
-            # Datetime
-            obsspace.create_var('MetaData/dateTime', dtype=np.int64, fillval=int64_fill_value) \
-                .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-                .write_attr('long_name', 'Datetime') \
-                .write_data(timestamp2)
-
-            # Satellite Identifier
-            obsspace.create_var('MetaData/satelliteIdentifier', dtype=satid2.dtype, fillval=satid2.fill_value) \
-                .write_attr('long_name', 'Satellite Identifier') \
-                .write_data(satid2)
-
-            # Sensor Zenith Angle
-            obsspace.create_var('MetaData/satelliteZenithAngle', dtype=satzenang2.dtype, fillval=satzenang2.fill_value) \
-                .write_attr('units', 'degree') \
-                .write_attr('valid_range', np.array([0, 90], dtype=np.float32)) \
-                .write_attr('long_name', 'Satellite Zenith Angle') \
-                .write_data(satzenang2)
-
-            # Sensor Centrall Frequency
-            obsspace.create_var('MetaData/sensorCentralFrequency', dtype=chanfreq2.dtype, fillval=chanfreq2.fill_value) \
-                .write_attr('units', 'Hz') \
-                .write_attr('long_name', 'Satellite Channel Center Frequency') \
-                .write_data(chanfreq2)
-
-            # Data Provider
-            obsspace.create_var('MetaData/dataProviderOrigin', dtype=ogce2.dtype, fillval=ogce2.fill_value) \
-                .write_attr('long_name', 'Identification of Originating/Generating Center') \
-                .write_data(ogce2)
-
-            # Quality: Percent Confidence - Quality Information Without Forecast
-            obsspace.create_var('MetaData/qiWithoutForecast', dtype=qifn2.dtype, fillval=qifn2.fill_value) \
-                .write_attr('long_name', 'QI Without Forecast') \
-                .write_data(qifn2)
-
-            # Wind Computation Method
-            obsspace.create_var('MetaData/windComputationMethod', dtype=swcm2.dtype, fillval=swcm2.fill_value) \
-                .write_attr('long_name', 'Satellite-derived Wind Computation Method') \
-                .write_data(swcm2)
-
-            # Pressure
-            obsspace.create_var('MetaData/pressure', dtype=pressure2.dtype, fillval=pressure2.fill_value) \
-                .write_attr('units', 'pa') \
-                .write_attr('long_name', 'Pressure') \
-                .write_data(pressure2)
-
-            # Height (mimic prepbufr)
-            obsspace.create_var('MetaData/height', dtype=height2.dtype, fillval=height2.fill_value) \
-                .write_attr('units', 'm') \
-                .write_attr('long_name', 'Height of Observation') \
-                .write_data(height2)
-
-            # Station Elevation (mimic prepbufr)
-            obsspace.create_var('MetaData/stationElevation', dtype=stnelev2.dtype, fillval=stnelev2.fill_value) \
-                .write_attr('units', 'm') \
-                .write_attr('long_name', 'Station Elevation') \
-                .write_data(stnelev2)
-
-            # ObsType based on computation method/spectral band
-            obsspace.create_var('ObsType/windEastward', dtype=obstype2.dtype, fillval=swcm2.fill_value) \
-                .write_attr('long_name', 'Observation Type based on Satellite-derived Wind Computation Method and Spectral Band') \
-                .write_data(obstype2)
-
-            # ObsType based on computation method/spectral band
-            obsspace.create_var('ObsType/windNorthward', dtype=obstype2.dtype, fillval=swcm2.fill_value) \
-                .write_attr('long_name', 'Observation Type based on Satellite-derived Wind Computation Method and Spectral Band') \
-                .write_data(obstype2)
-
-            # U-Wind Component
-            obsspace.create_var('ObsValue/windEastward', dtype=uob2.dtype, fillval=uob2.fill_value) \
-                .write_attr('units', 'm s-1') \
-                .write_attr('long_name', 'Eastward Wind Component') \
-                .write_data(uob2)
-
-            # V-Wind Component
-            obsspace.create_var('ObsValue/windNorthward', dtype=vob2.dtype, fillval=vob2.fill_value) \
-                .write_attr('units', 'm s-1') \
-                .write_attr('long_name', 'Northward Wind Component') \
-                .write_data(vob2)
-
-            end_time = time.time()
-            running_time = end_time - start_time
-            total_ob_processed += len(satid2)
+            write_ioda_vars(obsspace, schema, {
+                'MetaData/longitude': lon2,
+                'MetaData/latitude': lat2,
+                'MetaData/dateTime': timestamp2,
+                'MetaData/satelliteIdentifier': satid2,
+                'MetaData/satelliteZenithAngle': satzenang2,
+                'MetaData/sensorCentralFrequency': chanfreq2,
+                'MetaData/dataProviderOrigin': ogce2,
+                'MetaData/qiWithoutForecast': qifn2,
+                'MetaData/windComputationMethod': swcm2,
+                'MetaData/pressure': pressure2,
+                'MetaData/height': height2,
+                'MetaData/stationElevation': stnelev2,
+                'ObsType/windEastward': obstype2,
+                'ObsType/windNorthward': obstype2,
+                'ObsValue/windEastward': uob2,
+                'ObsValue/windNorthward': vob2,
+            })
+
             logger.debug(f'Number of observation processed : {len(satid2)}')
-            logger.debug(f'Processing time for splitting and output IODA for {satinst} : {running_time} seconds')
+            return OUTPUT_PATH, len(satid2)
 
         else:
             logger.info(f"Do not find this satellite id in the configuration: satid = {sat}")
 
+    timer.stage('write')
+    total_ob_processed = 0
+    for OUTPUT_PATH, nobs in splitter.write(write_satellite):
+        timer.output(OUTPUT_PATH, nobs)
+        total_ob_processed += nobs
+
     logger.info("All Done!")
     logger.info(f'Total number of observation processed : {total_ob_processed}')
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str, help='Input JSON configuration', required=True)
     parser.add_argument('-v', '--verbose', help='print debug logging information',
@@ -465,7 +382,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time: {running_time} seconds")
@@ -5,14 +5,16 @@ import datetime
 import json
 import math
 import os
-import time
 from datetime import datetime
 
 import numpy as np
 import numpy.ma as ma
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
+from ioda_schema import IodaVar, write_global_attrs, write_ioda_vars
+from satellite_splitter import SatelliteSplitter
 
-from pyioda import ioda_obs_space as ioda_ospace
 from pyiodaconv import bufr
 
 # Define and initialize  global variables
@@ -25,7 +27,8 @@ int32_fill_value = np.int32(0)
 int64_fill_value = np.int64(0)
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
 
@@ -74,7 +77,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.info("Making QuerySet")
     q = bufr.QuerySet(subsets)
@@ -97,15 +100,11 @@ def bufr_to_ioda(config, logger):
     q.add("brightnessTemperature", "*/RPSEQ7/TMBRST")
     q.add("ClearSkyStdDev", "*/RPSEQ7/SDTB")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Processing time for making QuerySet : {running_time} seconds")
-
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
     # Use the ResultSet returned to get numpy arrays of the data
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.info("Executing QuerySet to get ResultSet")
     with bufr.File(DATA_PATH) as f:
@@ -143,16 +142,12 @@ def bufr_to_ioda(config, logger):
     int32_fill_value = satid.fill_value
     int64_fill_value = timestamp.fill_value.astype(np.int64)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(
-        f"Processing time for executing QuerySet to get ResultSet : {running_time} seconds"
-    )
+    timer.obs_in(len(satid))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     nfov = satzenang.shape[0]
     scanpos = np.zeros(nfov, dtype=np.int32)
@@ -201,28 +196,56 @@ def bufr_to_ioda(config, logger):
 
     logger.info("Creating derived variables")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(
-        f"Processing time for creating derived variables : {running_time} seconds"
-    )
-
     # =====================================
     # Split output based on satellite id
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('split')
     logger.info("Create IODA ObsSpace and Write IODA output based on satellite ID")
 
-    # Find nique satellite identifiers in data to process
-    unique_satids = np.unique(satid)
+    # Sort the data with 0 < satzenang < 80 by satellite identifier once, the data of a satellite is then a contiguous slice
+    splitter = SatelliteSplitter(satid, keep=np.logical_and(0 < satzenang, satzenang < 80))
+    unique_satids = splitter.satids
+    lon, lat, timestamp, satid, instid, satzenang, scanpos, solzenang = \
+        splitter.sort(lon, lat, timestamp, satid, instid, satzenang, scanpos, solzenang)
+    cldFree, cloudAmount, BT, clrStdDev, viewang, sataziang, solaziang = \
+        splitter.sort(cldFree, cloudAmount, BT, clrStdDev, viewang.flatten(), sataziang.flatten(), solaziang.flatten())
     logger.info(f"Number of Unique satellite identifiers: {len(unique_satids)}")
     logger.info(f"Unique satellite identifiers: {unique_satids}")
     logger.debug(f"Loop through unique satellite identifier {unique_satids}")
-    total_ob_processed = 0
-    for sat in unique_satids.tolist():
-        start_time = time.time()
 
+    # IODA variables along Channel of each satellite file
+    channel_schema = [
+        IodaVar("MetaData/sensorChannelNumber", long_name="Sensor Channel Number", dim_list=["Channel"], dtype=np.int32, fillval=int32_fill_value),
+        IodaVar("MetaData/sensorCentralFrequency", units="Hz", long_name="Satellite Channel Center Frequency", dim_list=["Channel"]),
+        IodaVar("MetaData/sensorCentralWavenumber", units="m-1", long_name="Sensor Central Wavenumber", dim_list=["Channel"], fillval=wavenum_fill_value),
+    ]
+
+    # IODA variables along Location of each satellite file
+    location_schema = [
+        IodaVar("MetaData/longitude", units="degrees_east", long_name="Longitude", valid_range=np.array([-180, 180], dtype=np.float32)),
+        IodaVar("MetaData/latitude", units="degrees_north", long_name="Latitude", valid_range=np.array([-90, 90], dtype=np.float32)),
+        IodaVar("MetaData/dateTime", units="seconds since 1970-01-01T00:00:00Z", long_name="Datetime", dtype=np.int64, fillval=int64_fill_value),
+        IodaVar("MetaData/satelliteIdentifier", long_name="Satellite Identifier"),
+        IodaVar("MetaData/instrumentIdentifier", long_name="Satellite Instrument Identifier"),
+        IodaVar("MetaData/sensorScanPosition", long_name="Sensor Scan Position", dtype=np.int32, fillval=int32_fill_value),
+        IodaVar("MetaData/sensorZenithAngle", units="degree", long_name="Sensor Zenith Angle", valid_range=np.array([0, 90], dtype=np.float32)),
+        IodaVar("MetaData/sensorAzimuthAngle", units="degree", long_name="Sensor Azimuth Angle", valid_range=np.array([0, 360], dtype=np.float32),
+                dtype=np.float32),
+        IodaVar("MetaData/solarAzimuthAngle", units="degree", long_name="Solar Azimuth Angle", valid_range=np.array([0, 360], dtype=np.float32),
+                dtype=np.float32),
+        IodaVar("MetaData/sensorViewAngle", units="degree", long_name="Sensor View Angle", dtype=np.float32),
+        IodaVar("MetaData/solarZenithAngle", units="degree", long_name="Solar Zenith Angle", valid_range=np.array([0, 180], dtype=np.float32)),
+        IodaVar("MetaData/cloudFree", units="1", long_name="Amount Segment Cloud Free", valid_range=np.array([0, 100], dtype=np.int32),
+                fillval=int32_fill_value),
+        IodaVar("MetaData/cloudAmount", units="1", long_name="Amount of cloud coverage in layer", valid_range=np.array([0, 100], dtype=np.float32)),
+        IodaVar("ObsValue/brightnessTemperature", units="k", long_name="Brightness Temperature", dim_list=["Location", "Channel"], dtype=np.float32),
+        IodaVar("ClearSkyStdDev/brightnessTemperature", long_name="Standard Deviation Brightness Temperature", dim_list=["Location", "Channel"],
+                dtype=np.float32, fillval=clrStdDev.fill_value),
+    ]
+
+    def write_satellite(sat):
         matched = False
         for satellite_info in satellite_info_array:
             if satellite_info["satellite_id"] == sat:
@@ -240,38 +263,22 @@ def bufr_to_ioda(config, logger):
                 # If the satellite ID is not in the dictionary
                 logger.debug(f"satellite ID is not in the dictionary {satellite_id}")
 
-            # Define a boolean mask to subset data from the original data object
-            satelite_mask = satid == sat
-
-            # Define a boolean mask based on the condition 0 < satzenang2 < 80
-            satzenang_mask = np.logical_and(0 < satzenang, satzenang < 80)
-
-            combined_mask = satzenang_mask * satelite_mask
+            # Rows of the satellite with 0 < satzenang < 80 in the data sorted by satellite identifier, as views
 
             # MetaData
-            lon2 = lon[combined_mask]
-            lat2 = lat[combined_mask]
-            timestamp2 = timestamp[combined_mask]
-            satid2 = satid[combined_mask]
-            instid2 = instid[combined_mask]
-            satzenang2 = satzenang[combined_mask]
+            lon2, lat2, timestamp2, satid2, instid2, satzenang2, scanpos2, solzenang2 = \
+                splitter.take(sat, lon, lat, timestamp, satid, instid, satzenang, scanpos, solzenang)
             chanfreq2 = chanfreq[3:11]
 
-            # Convert scanpos to np.int32 before applying the mask
-            scanpos2 = scanpos.astype(np.int32)[combined_mask]
+            # Convert scanpos to np.int32
+            scanpos2 = scanpos2.astype(np.int32)
             # Replace masked values with the fill value before writing to IODA variable
             scanpos2 = np.where(scanpos2.mask, int32_fill_value, scanpos2)
-            solzenang2 = solzenang[combined_mask]
-            cldFree2 = cldFree[combined_mask]
-            cloudAmount2 = cloudAmount[combined_mask]
-            BT2 = BT[combined_mask]
+            cldFree2, cloudAmount2, BT2, clrStdDev2, viewang2, sataziang2, solaziang2 = \
+                splitter.take(sat, cldFree, cloudAmount, BT, clrStdDev, viewang, sataziang, solaziang)
 
             # Extract only channels 4 to 11
             BT2 = BT2[:, 3:11]
-            clrStdDev2 = clrStdDev[combined_mask]
-            viewang2 = viewang.flatten()[combined_mask]
-            sataziang2 = sataziang.flatten()[combined_mask]
-            solaziang2 = solaziang.flatten()[combined_mask]
 
             # Timestamp Range
             timestamp2_min = datetime.fromtimestamp(timestamp2.min())
@@ -293,250 +300,77 @@ def bufr_to_ioda(config, logger):
             iodafile = f"{cycle_type}.t{hh}z.{satinst}.tm00.nc"
             OUTPUT_PATH = os.path.join(ioda_dir, iodafile)
             logger.info(f"Create output file : {OUTPUT_PATH}")
-            obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode="w", dim_dict=dims)
+            obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
 
             # Create Global attributes
             logger.debug("Write global attributes")
-            obsspace.write_attr("Converter", converter)
-            obsspace.write_attr("sourceFiles", bufrfile)
-            obsspace.write_attr("description", data_description)
-            obsspace.write_attr("datetimeReference", reference_time)
-            obsspace.write_attr(
-                "datetimeRange", [str(timestamp2_min), str(timestamp2_max)]
-            )
-            obsspace.write_attr("sensor", sensor_id)
-            obsspace.write_attr("platform", satellite_id)
-            obsspace.write_attr("platformCommonName", satellite_name)
-            obsspace.write_attr("sensorCommonName", sensor_name)
-            obsspace.write_attr("processingLevel", process_level)
-            obsspace.write_attr("platformLongDescription", platform_description)
-            obsspace.write_attr("sensorLongDescription", sensor_description)
+            write_global_attrs(obsspace, {
+                "Converter": converter,
+                "sourceFiles": bufrfile,
+                "description": data_description,
+                "datetimeReference": reference_time,
+                "datetimeRange": [str(timestamp2_min), str(timestamp2_max)],
+                "sensor": sensor_id,
+                "platform": satellite_id,
+                "platformCommonName": satellite_name,
+                "sensorCommonName": sensor_name,
+                "processingLevel": process_level,
+                "platformLongDescription": platform_description,
+                "sensorLongDescription": sensor_description,
+            })
 
             # Create IODA variables
             logger.debug("Write variables: name, type, units, and attributes")
 
-            # Sensor Channel Number
-            obsspace.create_var(
-                "MetaData/sensorChannelNumber",
-                dim_list=["Channel"],
-                dtype=np.int32,
-                fillval=int32_fill_value,
-            ).write_attr("long_name", "Sensor Channel Number").write_data(channum)
-
-            # Sensor Central Frequency
-            obsspace.create_var(
-                "MetaData/sensorCentralFrequency",
-                dim_list=["Channel"],
-                dtype=chanfreq2.dtype,
-                fillval=chanfreq2.fill_value,
-            ).write_attr("units", "Hz").write_attr(
-                "long_name", "Satellite Channel Center Frequency"
-            ).write_data(
-                chanfreq2
-            )
-
-            # Sensor Central Wavenumber
-            obsspace.create_var(
-                "MetaData/sensorCentralWavenumber",
-                dim_list=["Channel"],
-                dtype=Wavenum.dtype,
-                fillval=wavenum_fill_value,
-            ).write_attr("units", "m-1").write_attr(
-                "long_name", "Sensor Central Wavenumber"
-            ).write_data(
-                Wavenum
-            )
-
-            if np.any(combined_mask):
-                # Longitude
-                obsspace.create_var(
-                    "MetaData/longitude", dtype=lon2.dtype, fillval=lon2.fill_value
-                ).write_attr("units", "degrees_east").write_attr(
-                    "valid_range", np.array([-180, 180], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Longitude"
-                ).write_data(
-                    lon2
-                )
-
-                # Latitude
-                obsspace.create_var(
-                    "MetaData/latitude", dtype=lat2.dtype, fillval=lat2.fill_value
-                ).write_attr("units", "degrees_north").write_attr(
-                    "valid_range", np.array([-90, 90], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Latitude"
-                ).write_data(
-                    lat2
-                )
-
-                # Datetime
-                obsspace.create_var(
-                    "MetaData/dateTime", dtype=np.int64, fillval=int64_fill_value
-                ).write_attr("units", "seconds since 1970-01-01T00:00:00Z").write_attr(
-                    "long_name", "Datetime"
-                ).write_data(
-                    timestamp2
-                )
-
-                # Satellite Identifier
-                obsspace.create_var(
-                    "MetaData/satelliteIdentifier",
-                    dtype=satid2.dtype,
-                    fillval=satid2.fill_value,
-                ).write_attr("long_name", "Satellite Identifier").write_data(satid2)
-
-                # Instrument Identifier
-                obsspace.create_var(
-                    "MetaData/instrumentIdentifier",
-                    dtype=instid2.dtype,
-                    fillval=instid2.fill_value,
-                ).write_attr("long_name", "Satellite Instrument Identifier").write_data(
-                    instid2
-                )
-
-                # Scan Position (derived variable, need to specified fill value explicitly)
-                obsspace.create_var(
-                    "MetaData/sensorScanPosition",
-                    dtype=scanpos2.astype(np.int32).dtype,
-                    fillval=int32_fill_value,
-                ).write_attr("long_name", "Sensor Scan Position").write_data(scanpos2)
-
-                # Sensor Zenith Angle
-                obsspace.create_var(
-                    "MetaData/sensorZenithAngle",
-                    dtype=satzenang2.dtype,
-                    fillval=satzenang2.fill_value,
-                ).write_attr("units", "degree").write_attr(
-                    "valid_range", np.array([0, 90], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Sensor Zenith Angle"
-                ).write_data(
-                    satzenang2
-                )
-
-                # Sensor Azimuth Angle
-                obsspace.create_var(
-                    "MetaData/sensorAzimuthAngle",
-                    dtype=np.float32,
-                    fillval=sataziang2.fill_value,
-                ).write_attr("units", "degree").write_attr(
-                    "valid_range", np.array([0, 360], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Sensor Azimuth Angle"
-                ).write_data(
-                    sataziang2
-                )
-
-                # Solar Azimuth Angle
-                obsspace.create_var(
-                    "MetaData/solarAzimuthAngle",
-                    dtype=np.float32,
-                    fillval=solaziang2.fill_value,
-                ).write_attr("units", "degree").write_attr(
-                    "valid_range", np.array([0, 360], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Solar Azimuth Angle"
-                ).write_data(
-                    solaziang2
-                )
-
-                # Sensor View Angle
-                obsspace.create_var(
-                    "MetaData/sensorViewAngle",
-                    dtype=np.float32,
-                    fillval=viewang2.fill_value,
-                ).write_attr("units", "degree").write_attr(
-                    "long_name", "Sensor View Angle"
-                ).write_data(
-                    viewang2
-                )
-
-                # Solar Zenith Angle
-                obsspace.create_var(
-                    "MetaData/solarZenithAngle",
-                    dtype=solzenang2.dtype,
-                    fillval=solzenang2.fill_value,
-                ).write_attr("units", "degree").write_attr(
-                    "valid_range", np.array([0, 180], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Solar Zenith Angle"
-                ).write_data(
-                    solzenang2
-                )
-
-                # Cloud free
-                obsspace.create_var(
-                    "MetaData/cloudFree",
-                    dtype=cldFree2.dtype, fillval=int32_fill_value
-                ).write_attr("units", "1").write_attr(
-                    "valid_range", np.array([0, 100], dtype=np.int32)
-                ).write_attr(
-                    "long_name", "Amount Segment Cloud Free"
-                ).write_data(
-                    cldFree2
-                )
-
-                # Cloud amount based on computation
-                obsspace.create_var(
-                    "MetaData/cloudAmount",
-                    dtype=cloudAmount2.dtype,
-                    fillval=cloudAmount2.fill_value,
-                ).write_attr("units", "1").write_attr(
-                    "valid_range", np.array([0, 100], dtype=np.float32)
-                ).write_attr(
-                    "long_name", "Amount of cloud coverage in layer"
-                ).write_data(
-                    cloudAmount2
-                )
-
-                # ObsType based on computation method/spectral band
-                obsspace.create_var(
-                    "ObsValue/brightnessTemperature",
-                    dim_list=["Location", "Channel"],
-                    dtype=np.float32,
-                    fillval=BT2.fill_value,
-                ).write_attr("units", "k").write_attr(
-                    "long_name", "Brightness Temperature"
-                ).write_data(
-                    BT2
-                )
-
-                obsspace.create_var(
-                    "ClearSkyStdDev/brightnessTemperature",
-                    dim_list=["Location", "Channel"],
-                    dtype=np.float32,
-                    fillval=clrStdDev2.fill_value,
-                ).write_attr(
-                    "long_name", "Standard Deviation Brightness Temperature"
-                ).write_data(
-                    clrStdDev2[:, 3:11]
-                )
+            write_ioda_vars(obsspace, channel_schema, {
+                "MetaData/sensorChannelNumber": channum,
+                "MetaData/sensorCentralFrequency": chanfreq2,
+                "MetaData/sensorCentralWavenumber": Wavenum,
+            })
+
+            if len(satid2) > 0:
+                write_ioda_vars(obsspace, location_schema, {
+                    "MetaData/longitude": lon2,
+                    "MetaData/latitude": lat2,
+                    "MetaData/dateTime": timestamp2,
+                    "MetaData/satelliteIdentifier": satid2,
+                    "MetaData/instrumentIdentifier": instid2,
+                    "MetaData/sensorScanPosition": scanpos2,
+                    "MetaData/sensorZenithAngle": satzenang2,
+                    "MetaData/sensorAzimuthAngle": sataziang2,
+                    "MetaData/solarAzimuthAngle": solaziang2,
+                    "MetaData/sensorViewAngle": viewang2,
+                    "MetaData/solarZenithAngle": solzenang2,
+                    "MetaData/cloudFree": cldFree2,
+                    "MetaData/cloudAmount": cloudAmount2,
+                    "ObsValue/brightnessTemperature": BT2,
+                    "ClearSkyStdDev/brightnessTemperature": clrStdDev2[:, 3:11],
+                })
 
             else:
                 logger.debug(
                     "No valid values (0<satzenang2 < 80), skipping writing to IODA"
                 )
 
-            end_time = time.time()
-            running_time = end_time - start_time
-            total_ob_processed += len(satid2)
             logger.debug(f"Number of observation processed : {len(satid2)}")
-            logger.debug(
-                f"Processing time for splitting and output IODA for {satinst} : {running_time} seconds"
-            )
+            return OUTPUT_PATH, len(satid2)
 
         else:
             logger.info(
                 f"Do not find this satellite id in the configuration: satid = {sat}"
             )
 
+    timer.stage('write')
+    total_ob_processed = 0
+    for OUTPUT_PATH, nobs in splitter.write(write_satellite):
+        timer.output(OUTPUT_PATH, nobs)
+        total_ob_processed += nobs
+
     logger.info("All Done!")
     logger.info(f"Total number of observation processed : {total_ob_processed}")
 
 
 if __name__ == "__main__":
-    start_time = time.time()
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -554,7 +388,3 @@ if __name__ == "__main__":
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.info(f"Total running time: {running_time} seconds")
@@ -15,8 +15,9 @@ from datetime import datetime
 import json
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
 
 
 def Compute_dateTime(cycleTimeSinceEpoch, dhr):
@@ -27,7 +28,42 @@ def Compute_dateTime(cycleTimeSinceEpoch, dhr):
     return dateTime
 
 
-def bufr_to_ioda(config, logger):
+def build_query(q):
+
+    # ObsType
+    q.add('observationType', '*/TYP')
+
+    # MetaData
+    q.add('stationIdentification', '*/SID')
+    q.add('latitude', '*/YOB')
+    q.add('longitude', '*/XOB')
+    q.add('obsTimeMinusCycleTime', '*/DHR')
+    q.add('heightOfStation', '*/Z___INFO/Z__EVENT{1}/ZOB')
+    q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
+    q.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
+
+#   # Quality Infomation (Quality Indicator)
+    q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
+    q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
+    q.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
+    q.add('qualityMarkerSpecificHumidity', '*/Q___INFO/Q__EVENT{1}/QQM')
+    q.add('qualityMarkerWindNorthward', '*/W___INFO/W__EVENT{1}/WQM')
+    q.add('qualityMarkerSeaSurfaceTemperature', '*/SST_INFO/SSTEVENT{1}/SSTQM')
+
+    # ObsValue
+    q.add('stationElevation', '*/ELV')
+    q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
+    q.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
+    q.add('specificHumidity', '*/Q___INFO/Q__EVENT{1}/QOB')
+    q.add('windNorthward', '*/W___INFO/W__EVENT{1}/VOB')
+    q.add('windEastward', '*/W___INFO/W__EVENT{1}/UOB')
+    q.add('seaSurfaceTemperature', '*/SST_INFO/SSTEVENT{1}/SST1')
+
+    return q
+
+
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer, r=None):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -69,57 +105,26 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug("Making QuerySet ...")
-    q = bufr.QuerySet(subsets)
-
-    # ObsType
-    q.add('observationType', '*/TYP')
-
-    # MetaData
-    q.add('stationIdentification', '*/SID')
-    q.add('latitude', '*/YOB')
-    q.add('longitude', '*/XOB')
-    q.add('obsTimeMinusCycleTime', '*/DHR')
-    q.add('heightOfStation', '*/Z___INFO/Z__EVENT{1}/ZOB')
-    q.add('pressure', '*/P___INFO/P__EVENT{1}/POB')
-    q.add('temperatureEventCode', '*/T___INFO/T__EVENT{1}/TPC')
-
-#   # Quality Infomation (Quality Indicator)
-    q.add('qualityMarkerStationElevation', '*/Z___INFO/Z__EVENT{1}/ZQM')
-    q.add('qualityMarkerStationPressure', '*/P___INFO/P__EVENT{1}/PQM')
-    q.add('qualityMarkerAirTemperature', '*/T___INFO/T__EVENT{1}/TQM')
-    q.add('qualityMarkerSpecificHumidity', '*/Q___INFO/Q__EVENT{1}/QQM')
-    q.add('qualityMarkerWindNorthward', '*/W___INFO/W__EVENT{1}/WQM')
-    q.add('qualityMarkerSeaSurfaceTemperature', '*/SST_INFO/SSTEVENT{1}/SSTQM')
-
-    # ObsValue
-    q.add('stationElevation', '*/ELV')
-    q.add('stationPressure', '*/P___INFO/P__EVENT{1}/POB')
-    q.add('airTemperature', '*/T___INFO/T__EVENT{1}/TOB')
-    q.add('specificHumidity', '*/Q___INFO/Q__EVENT{1}/QOB')
-    q.add('windNorthward', '*/W___INFO/W__EVENT{1}/VOB')
-    q.add('windEastward', '*/W___INFO/W__EVENT{1}/UOB')
-    q.add('seaSurfaceTemperature', '*/SST_INFO/SSTEVENT{1}/SST1')
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
+    q = build_query(bufr.QuerySet(subsets))
 
     # ==============================================================
     # Open the BUFR file and execute the QuerySet to get ResultSet
-    # Use the ResultSet returned to get numpy arrays of the data
+    # Use the ResultSet returned to get numpy arrays of the data,
+    # unless prepbufr_fanout.py already decoded the subset for us
     # ==============================================================
-    start_time = time.time()
+    timer.stage('execute')
 
-    logger.debug(f"Executing QuerySet to get ResultSet ...")
-    with bufr.File(DATA_PATH) as f:
-        try:
-            r = f.execute(q)
-        except Exception as err:
-            logger.info(f'Return with {err}')
-            return
+    if r is None:
+        logger.debug(f"Executing QuerySet to get ResultSet ...")
+        with bufr.File(DATA_PATH) as f:
+            try:
+                r = f.execute(q)
+            except Exception as err:
+                logger.info(f'Return with {err}')
+                return
 
     logger.debug(f" ... Executing QuerySet: get metadata: basic ...")
     # ObsType
@@ -232,15 +237,12 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     vob       type  = {vob.dtype}")
     logger.debug(f"     sst1      type  = {sst1.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet to get ResultSet: \
-                {running_time} seconds")
+    timer.obs_in(len(typ))
 
     # =========================
     # Create derived variables
     # =========================
-    start_time = time.time()
+    timer.stage('derive')
 
     logger.debug(f"Creating derived variables - dateTime ...")
 
@@ -252,15 +254,11 @@ def bufr_to_ioda(config, logger):
     logger.debug(f"     dateTime shape = {dateTime.shape}")
     logger.debug(f"     dateTime type = {dateTime.dtype}")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for creating derived variables: {running_time} \
-                 seconds")
-
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
     # Create the dimensions
     dims = {'Location': np.arange(0, lat.shape[0])}
@@ -273,7 +271,8 @@ def bufr_to_ioda(config, logger):
     if path and not os.path.exists(path):
         os.makedirs(path)
 
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create Global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -486,18 +485,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Sea Surface Temperature') \
         .write_data(sst1)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for splitting and output IODA: \
-                {running_time} seconds")
-
     logger.debug("All Done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration',
@@ -515,7 +507,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
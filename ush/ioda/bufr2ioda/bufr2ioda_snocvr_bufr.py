@@ -11,15 +11,16 @@ import json
 import numpy as np
 import numpy.ma as ma
 import calendar
-import time
 from datetime import datetime
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
 from wxflow import Logger
+from stage_timer import timed
+from output_policy import create_obsspace
 
 
-def bufr_to_ioda(config, logger):
+@timed(__file__)
+def bufr_to_ioda(config, logger, timer):
 
     subsets = config["subsets"]
     logger.debug(f"Checking subsets = {subsets}")
@@ -54,7 +55,7 @@ def bufr_to_ioda(config, logger):
     # ============================================
     # Make the QuerySet for all the data we want
     # ============================================
-    start_time = time.time()
+    timer.stage('query')
 
     logger.debug('Making QuerySet ...')
     q = bufr.QuerySet()
@@ -74,14 +75,10 @@ def bufr_to_ioda(config, logger):
     # ObsValue
     q.add('totalSnowDepth', '*/TOSD')
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for making QuerySet: {running_time} seconds")
-
     # ================================================
     # Open the BUFR file and execute the QuerySet
     # ================================================
-    start_time = time.time()
+    timer.stage('execute')
 
     logger.debug(f" ... Executing QuerySet: get data ...")
     with bufr.File(DATA_PATH) as f:
@@ -116,17 +113,14 @@ def bufr_to_ioda(config, logger):
 
     logger.debug(f" ... Executing QuerySet: Done! ...")
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for executing QuerySet to get ResultSet: \
-                {running_time} seconds")
+    timer.obs_in(len(lon))
 
     # =====================================
     # Create IODA ObsSpace
     # Write IODA output
     # =====================================
+    timer.stage('write')
 
-    start_time = time.time()
     logger.debug(f" ... executing IODA output ...")
     # Create the dimensions
     dims = {'Location': snod.shape[0]}
@@ -139,7 +133,8 @@ def bufr_to_ioda(config, logger):
     if path and not os.path.exists(path):
         os.makedirs(path)
 
-    obsspace = ioda_ospace.ObsSpace(OUTPUT_PATH, mode='w', dim_dict=dims)
+    obsspace = create_obsspace(OUTPUT_PATH, dims, config.get('output_policy'), logger)
+    timer.output(OUTPUT_PATH, dims['Location'])
 
     # Create the global attributes
     logger.debug(f" ... ... Create global attributes")
@@ -186,18 +181,11 @@ def bufr_to_ioda(config, logger):
         .write_attr('long_name', 'Total Snow Depth') \
         .write_data(snod)
 
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Running time for splitting and output IODA: \
-                {running_time} seconds")
-
     logger.debug("IODA output done!")
 
 
 if __name__ == '__main__':
 
-    start_time = time.time()
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', type=str,
                         help='Input JSON configuration',
@@ -215,7 +203,3 @@ if __name__ == '__main__':
         config = json.load(json_file)
 
     bufr_to_ioda(config, logger)
-
-    end_time = time.time()
-    running_time = end_time - start_time
-    logger.debug(f"Total running time: {running_time} seconds")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# bufr_fanout.py
+# common part of the fan-out converters (satwnd_amv_fanout.py,
+# prepbufr_fanout.py) that decode a BUFR file once for several
+# bufr2ioda_<obtype>.py converters: recording the queries of a
+# converter's build_query, and running the converters' derivation and
+# IODA writing on the decoded data in forked workers, which inherit it
+# instead of having it pickled
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from converter_pool import load_converter, converter_logger
+from runtime_ledger import peak_rss_self
+from wxflow import Logger
+
+# Initialize root logger
+logger = Logger('bufr_fanout.py', level='INFO', colored_log=True)
+
+# converters and their decoded inputs of the current fan-out, inherited by the forked workers
+_fanout = {}
+# summed peak RSS of the forked workers of each fan-out run in this process
+_worker_peaks = []
+
+
+class QueryRecorder:
+    """
+    Stand-in for bufr.QuerySet that records what a converter's build_query adds.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def add(self, name, path):
+        self.queries.append((name, path))
+
+
+def record_queries(script, *args):
+    return load_converter(script).build_query(QueryRecorder(), *args).queries
+
+
+def _convert(index):
+    # runs in a forked worker, or in this process when it cannot fork
+    obtype, script, config = _fanout['converters'][index]
+    start_time = time.time()
+    status = 'ok'
+    try:
+        module = load_converter(script)
+        inputs = _fanout['inputs'](obtype, config)
+        module.bufr_to_ioda(config, converter_logger(obtype, _fanout['log_level']), **inputs)
+    except Exception as e:
+        logger.exception(f"{obtype} failed: {e}")
+        status = 'failed'
+    logger.info(f"{obtype} derived and written in {time.time() - start_time:.3f} seconds")
+    return {'obtype': obtype, 'status': status, 'peak_rss': peak_rss_self(), 'pid': os.getpid()}
+
+
+def run_converters(converters, inputs, workers=None, log_level='INFO'):
+    """
+    Call bufr_to_ioda(config, logger, **inputs(obtype, config)) for a list of
+    (obtype, script, config) converters, in forked workers when this process
+    is allowed to have children. Returns {obtype: status}.
+    """
+    _fanout.update(converters=converters, inputs=inputs, log_level=log_level)
+    workers = min(workers or len(converters), len(converters))
+    start_time = time.time()
+    if workers > 1 and not mp.current_process().daemon:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context('fork')) as executor:
+            records = list(executor.map(_convert, range(len(converters))))
+        # the workers run at the same time, a worker running several converters counts once
+        peaks = {}
+        for record in records:
+            peaks[record['pid']] = max(peaks.get(record['pid'], 0), record['peak_rss'])
+        _worker_peaks.append(sum(peaks.values()))
+    else:
+        if workers > 1:
+            logger.info("Running in a daemonic pool worker, converting serially")
+        records = [_convert(i) for i in range(len(converters))]
+    _fanout.clear()
+    logger.info(f"Derived and wrote {len(converters)} converters with {workers} workers "
+                f"in {time.time() - start_time:.3f} seconds")
+    return {record['obtype']: record['status'] for record in records}
+
+
+def fanout_main(name, convert):
+    """
+    Command line of a fan-out script: one -c OBTYPE CONFIG per converter,
+    convert(converters, workers, log_level) returns {obtype: status}.
+    """
+    start_time = time.time()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', nargs=2, action='append', required=True, metavar=('OBTYPE', 'CONFIG'),
+                        help='obtype and its input JSON configuration (repeatable)')
+    parser.add_argument('-n', '--workers', type=int, default=None,
+                        help='number of forked workers, defaults to one per obtype')
+    parser.add_argument('-v', '--verbose', help='print debug logging information',
+                        action='store_true')
+    parser.add_argument('--peak-rss-file', default=None,
+                        help='write the peak RSS of this process plus its workers to this JSON file')
+    args = parser.parse_args()
+
+    log_level = 'DEBUG' if args.verbose else 'INFO'
+    main_logger = Logger(name, level=log_level, colored_log=True)
+
+    USH_IODA = os.path.dirname(os.path.realpath(__file__))
+    converters = []
+    for obtype, configfile in args.config:
+        with open(configfile, "r") as json_file:
+            config = json.load(json_file)
+        converters.append((obtype, os.path.join(USH_IODA, f"bufr2ioda_{obtype}.py"), config))
+
+    status = convert(converters, args.workers, log_level)
+
+    if args.peak_rss_file:
+        with open(args.peak_rss_file, 'w') as f:
+            json.dump({'peak_rss': peak_rss_self() + max(_worker_peaks, default=0)}, f)
+
+    end_time = time.time()
+    running_time = end_time - start_time
+    main_logger.info(f"Total running time: {running_time} seconds")
+
+    failed = [obtype for obtype, s in status.items() if s != 'ok']
+    if failed:
+        raise SystemExit(f"{name} failed for obtypes: {failed}")
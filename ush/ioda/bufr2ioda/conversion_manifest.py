@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# conversion_manifest.py
+# manifest of the obtypes converted into a COM_OBS directory, used by
+# run_bufr2ioda.py --incremental to skip obtypes that are already done.
+# Each obtype is keyed on a hash of its BUFR input (path, size, mtime and
+# optionally a content digest), its rendered JSON/YAML config and the
+# source of its converter and of the local modules the converter imports,
+# together with the IODA files it wrote.
+import ast
+import glob
+import hashlib
+import json
+import os
+from runtime_ledger import bufr_input_path
+
+MANIFEST_VERSION = 1
+
+# IODA file names written by the python converters, as glob patterns
+# filled from the rendered config; the satellite converters write one file
+# per satellite, <sensor>_<satellite>, hence the wildcards
+OUTPUT_PATTERNS = {
+    'acft_profiles_prepbufr': '{cycle_type}.t{hh}z.aircraft.tm00.nc',
+    'conventional_prepbufr_ps': '{cycle_type}.t{hh}z.{data_description}.tm00.nc',
+    'gsrcsr': '{cycle_type}.t{hh}z.{sensor_name}_*.tm00.nc',
+    'sevcsr': '{cycle_type}.t{hh}z.{sensor_name}_*.tm00.nc',
+    'ozone_omi': '{cycle_type}.t{hh}z.{ioda_type}_*.tm00.nc',
+    'ozone_ompsnp': '{cycle_type}.t{hh}z.{ioda_type}_*.tm00.nc',
+    'ozone_ompstc': '{cycle_type}.t{hh}z.{ioda_type}_*.tm00.nc',
+    'satwind_scat': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_ahi': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_avhrr': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_goes': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_leogeo': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_modis': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_seviri': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'satwnd_amv_viirs': '{cycle_type}.t{hh}z.{data_type}.{sensor_name}_*.tm00.nc',
+    'snocvr_bufr': '{cycle_type}.t{hh}z.{data_type}.nc',
+}
+DEFAULT_OUTPUT_PATTERN = '{cycle_type}.t{hh}z.{data_type}.tm00.nc'
+
+
+def output_pattern(obtype, config):
+    """
+    Glob pattern (with directory) matching the IODA files of an obtype,
+    None if the config does not say where they go.
+    """
+    # bufr2ioda.x YAML: obsdataout with the satellite split substituted
+    for observation in config.get('observations', []):
+        obsdataout = observation.get('ioda', {}).get('obsdataout')
+        if obsdataout:
+            return obsdataout.replace('{splits/satId}', '*')
+
+    try:
+        fields = dict(config)
+        fields['hh'] = config['cycle_datetime'][8:10]
+        if 'sensor_info' in config:
+            fields['sensor_name'] = config['sensor_info']['sensor_name'].lower()
+        pattern = OUTPUT_PATTERNS.get(obtype, DEFAULT_OUTPUT_PATTERN).format(**fields)
+        return os.path.join(config['ioda_directory'], pattern)
+    except KeyError:
+        return None
+
+
+def _sha256_file(path, blocksize=2**20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def local_imports(script):
+    """
+    Paths of the modules next to a python converter that it imports, directly
+    or through one another, e.g. the helpers of ush/ioda/bufr2ioda.
+    """
+    directory = os.path.dirname(os.path.abspath(script))
+    found = set()
+    pending = [os.path.abspath(script)]
+    while pending:
+        with open(pending.pop(), 'r') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                path = os.path.join(directory, f"{name.split('.')[0]}.py")
+                if path not in found and os.path.isfile(path):
+                    found.add(path)
+                    pending.append(path)
+    return sorted(found)
+
+
+def conversion_key(config, converter, digest=False):
+    """
+    Hash identifying one conversion: BUFR input, rendered config and converter,
+    with the local modules of a python converter.
+    """
+    bufrfile = bufr_input_path(config)
+    if bufrfile:
+        stat = os.stat(bufrfile)
+        bufr_id = [bufrfile, stat.st_size, stat.st_mtime_ns]
+        if digest:
+            bufr_id.append(_sha256_file(bufrfile))
+    else:
+        bufr_id = None
+
+    if converter.endswith('.py'):
+        converter_id = [_sha256_file(converter)]
+        converter_id += [[os.path.basename(path), _sha256_file(path)] for path in local_imports(converter)]
+    else:
+        # bufr2ioda.x: a stat is enough to notice a rebuild
+        stat = os.stat(converter) if os.path.exists(converter) else None
+        converter_id = [converter, stat.st_size, stat.st_mtime_ns] if stat else None
+
+    key = {'bufr': bufr_id, 'config': config, 'converter': converter_id}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def written_outputs(pattern, since):
+    # the files matching the pattern written since the job started,
+    # with some slack for coarse file system timestamps
+    if not pattern:
+        return []
+    return sorted(f for f in glob.glob(pattern) if os.path.getmtime(f) >= since - 2.0)
+
+
+class ConversionManifest:
+    """
+    JSON manifest {obtype: {'key': ..., 'outputs': [...]}} of completed conversions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.obtypes = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') == MANIFEST_VERSION:
+                    self.obtypes = manifest.get('obtypes', {})
+            except (OSError, ValueError):
+                self.obtypes = {}
+
+    def stale_reason(self, obtype, key):
+        """
+        None if the obtype is up to date, otherwise why it has to be converted.
+        """
+        entry = self.obtypes.get(obtype)
+        if entry is None:
+            return 'not in manifest'
+        if entry['key'] != key:
+            return 'input, config or converter changed'
+        missing = [f for f in entry['outputs'] if not os.path.isfile(f)]
+        if missing:
+            return f"missing outputs {missing}"
+        return None
+
+    def update(self, obtype, key, pattern, since):
+        self.obtypes[obtype] = {'key': key, 'outputs': written_outputs(pattern, since)}
+
+    def remove(self, obtype):
+        self.obtypes.pop(obtype, None)
+
+    def save(self):
+        manifest = {'version': MANIFEST_VERSION, 'obtypes': self.obtypes}
+        tmpfile = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmpfile, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmpfile, self.path)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# converter_pool.py
+# run the python bufr2ioda converters inside long-lived pool workers.
+# Each worker imports the converter modules, and with them numpy,
+# pyiodaconv, pyioda and wxflow, once, then calls bufr_to_ioda(config, logger)
+# directly with the rendered config instead of starting a new interpreter
+# per obtype. Workers are recycled by the pool after a fixed number of
+# tasks (max_tasks_per_child) to keep memory bounded.
+# The workers are not daemonic, so that a converter may fork workers of its
+# own (SatelliteSplitter.write, the fan-out scripts), which the daemonic
+# workers of a multiprocessing.Pool may not.
+import importlib.util
+import multiprocessing as mp
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from runtime_ledger import peak_rss_reset, peak_rss_self
+from wxflow import Logger
+
+# Initialize root logger
+logger = Logger('converter_pool.py', level='INFO', colored_log=True)
+
+# converter modules and loggers already set up in this worker, and the
+# converters that failed to import, with the error
+_converters = {}
+_loggers = {}
+_import_errors = {}
+
+
+def load_converter(script):
+    """
+    Import a bufr2ioda_<obtype>.py script as a module, once per process.
+    A script that failed to import in the initializer raises its error again.
+    """
+    if script in _import_errors:
+        raise ImportError(f"{script} failed to import: {_import_errors[script]}")
+    if script not in _converters:
+        spec = importlib.util.spec_from_file_location(Path(script).stem, script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _converters[script] = module
+    return _converters[script]
+
+
+def init_worker(scripts):
+    # pool initializer: pay for the imports before the first task arrives.
+    # Raising here would make the pool respawn the worker forever, so a
+    # converter that fails to import is logged and recorded, and its task
+    # fails with the import error
+    for script in scripts:
+        try:
+            load_converter(script)
+        except Exception as e:
+            logger.exception(f"Failed to import {script}: {e}")
+            _import_errors[script] = repr(e)
+
+
+def converter_executor(workers, scripts, tasks_per_worker):
+    """
+    Pool of workers that import scripts when they start and are replaced
+    after tasks_per_worker converters. The recycled workers are spawned, as
+    the executor requires; a python without max_tasks_per_child (before
+    3.11) keeps its forked workers for the whole cycle.
+    """
+    try:
+        return ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn'), initializer=init_worker,
+                                   initargs=(scripts,), max_tasks_per_child=tasks_per_worker)
+    except TypeError:
+        logger.warning("Pool workers cannot be recycled with this python, they run every converter of the cycle")
+        return ProcessPoolExecutor(workers, mp_context=mp.get_context('fork'), initializer=init_worker,
+                                   initargs=(scripts,))
+
+
+def converter_logger(obtype, log_level='INFO'):
+    if obtype not in _loggers:
+        _loggers[obtype] = Logger(f'bufr2ioda_{obtype}.py', level=log_level, colored_log=True)
+    return _loggers[obtype]
+
+
+def run_converter(obtype, script, config, log_level='INFO'):
+    """
+    Convert one obtype in this worker process and return its runtime record.
+    peak_rss is the high-water mark of this converter where the kernel lets
+    us reset it, otherwise of the worker, i.e. an upper bound for this
+    converter once the worker has run more than one task.
+    """
+    logger.info(f"Running {obtype} in process with {script}")
+    peak_rss_reset()
+    status = 'ok'
+    start = time.time()
+    try:
+        module = load_converter(script)
+        module.bufr_to_ioda(config, converter_logger(obtype, log_level))
+    except Exception as e:
+        logger.exception(f"{obtype} failed: {e}")
+        status = 'failed'
+    end = time.time()
+    return {'obtype': obtype, 'start': start, 'end': end, 'wall_time': end - start,
+            'peak_rss': peak_rss_self(), 'status': status}
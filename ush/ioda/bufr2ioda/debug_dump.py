@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# debug_dump.py
+# side file of intermediate arrays of a converter, for debugging: written in
+# one pass as columns of an .npz (or .csv) file instead of one log record per
+# row. A converter dumps only when the debug_dump entry of its config names
+# the file, or when BUFR2IODA_DEBUG_DUMP names a directory for <obtype>.npz;
+# otherwise nothing is computed at all.
+import os
+import numpy as np
+import numpy.ma as ma
+
+# directory of the dumps of all the converters
+DEBUG_DUMP_ENV = 'BUFR2IODA_DEBUG_DUMP'
+
+
+class DebugDump:
+    """
+    The debug dump of one converter run, enabled is False when there is
+    nothing to write: the caller checks it before building the columns.
+    """
+
+    def __init__(self, obtype, config):
+        # a converter passes its __file__
+        obtype = os.path.basename(obtype).replace('bufr2ioda_', '').replace('.py', '')
+        path = config.get('debug_dump')
+        dump_dir = os.environ.get(DEBUG_DUMP_ENV)
+        if path is None and dump_dir:
+            path = os.path.join(dump_dir, f"{obtype}.npz")
+        self.path = path
+        self.enabled = path is not None
+
+    def write(self, logger, **columns):
+        """
+        Write the columns, arrays of the same size flattened in C order,
+        masked values replaced by their fill value.
+        """
+        arrays = {name: np.ravel(ma.filled(column)) for name, column in columns.items()}
+        sizes = {name: array.size for name, array in arrays.items()}
+        if len(set(sizes.values())) > 1:
+            raise ValueError(f"Debug dump columns differ in size: {sizes}")
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmpfile = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmpfile, 'wb') as f:
+            if self.path.endswith('.csv'):
+                table = np.column_stack([array.astype(np.float64) for array in arrays.values()])
+                np.savetxt(f, table, fmt='%.7g', delimiter=',', header=','.join(arrays), comments='')
+            else:
+                np.savez_compressed(f, **arrays)
+        os.replace(tmpfile, self.path)
+        logger.info(f"Wrote debug dump of {max(sizes.values(), default=0)} rows to {self.path}")
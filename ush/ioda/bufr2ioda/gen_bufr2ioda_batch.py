@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# gen_bufr2ioda_batch.py
+# render all bufr2ioda JSON/YAML templates of a template directory
+# for one or more cycles in a single pass:
+# the templates are compiled once per process into one jinja environment
+# (with the same filters and missing-variable handling as parse_j2yaml),
+# rendered serially and written out concurrently
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import jinja2
+from gen_bufr2ioda_json import write_bufr_json
+from gen_bufr2ioda_yaml import write_bufr_yaml
+from wxflow import Logger, Jinja, YAMLFile, cast_strdict_as_dtypedict
+from wxflow import to_datetime, datetime_to_YMDH
+
+# initialize root logger
+logger = Logger('gen_bufr2ioda_batch.py', level='INFO', colored_log=True)
+
+# renderers already built in this process, by template directory
+_renderers = {}
+
+
+class BufrTemplateRenderer:
+    """
+    Compiled bufr2ioda_*.json / bufr2ioda_*.yaml templates of one directory.
+    """
+
+    def __init__(self, template_dir):
+        start_time = time.time()
+        self.template_dir = str(template_dir)
+        # borrow the environment set up by wxflow so that filters and
+        # missing-variable handling are identical to parse_j2yaml
+        loader = jinja2.FileSystemLoader([self.template_dir, "/"])
+        self.env = Jinja(self.template_dir, {}).get_set_env(loader)
+        self.templates = {}
+        for filename in sorted(os.listdir(self.template_dir)):
+            if filename.startswith('bufr2ioda_') and filename.endswith(('.json', '.yaml')):
+                self.templates[filename] = self.env.get_template(filename)
+        self.compile_time = time.time() - start_time
+        logger.info(f"Compiled {len(self.templates)} templates from {self.template_dir} "
+                    f"in {self.compile_time:.3f} seconds")
+
+    def render(self, filename, config):
+        # same result as parse_j2yaml(os.path.join(template_dir, filename), config)
+        if filename not in self.templates:
+            raise FileNotFoundError(f"Template {filename} not found in {self.template_dir}")
+        return YAMLFile(data=self.templates[filename].render(**config))
+
+
+def get_renderer(template_dir):
+    """
+    Renderer for a template directory, compiled on first use and reused
+    for every later cycle processed by this process.
+    """
+    key = os.path.realpath(template_dir)
+    if key not in _renderers:
+        _renderers[key] = BufrTemplateRenderer(template_dir)
+    return _renderers[key]
+
+
+def write_bufr_config(bufr_config, output):
+    if output.endswith('.json'):
+        write_bufr_json(bufr_config, output)
+        return bufr_config
+    return write_bufr_yaml(bufr_config, output)
+
+
+def gen_bufr_batch(template_dir, requests, max_workers=8):
+    """
+    Render and write a batch of bufr2ioda configs.
+
+    requests is a list of (template filename, config, output path);
+    returns the list of rendered configs in the same order, after the
+    splitvar substitution for YAML templates.
+    """
+    renderer = get_renderer(template_dir)
+
+    start_time = time.time()
+    rendered = [renderer.render(filename, config) for filename, config, _ in requests]
+    render_time = time.time() - start_time
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(write_bufr_config, bufr_config, output)
+                   for bufr_config, (_, _, output) in zip(rendered, requests)]
+        bufr_configs = [future.result() for future in futures]
+    write_time = time.time() - start_time
+
+    logger.info(f"Rendered {len(requests)} configs in {render_time:.3f} seconds, "
+                f"wrote them in {write_time:.3f} seconds")
+    return bufr_configs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--template_dir', type=str, help='Input template directory', required=True)
+    parser.add_argument('-o', '--output_dir', type=str, help='Output directory', required=True)
+    parser.add_argument('cycles', nargs='+', type=lambda dd: to_datetime(dd), help='cycles to render')
+    args = parser.parse_args()
+    # get the rest of the config from your environment
+    config = cast_strdict_as_dtypedict(os.environ)
+    os.makedirs(args.output_dir, exist_ok=True)
+    requests = []
+    for cycle in args.cycles:
+        cycle_config = dict(config, current_cycle=cycle, PDY=cycle.strftime('%Y%m%d'), cyc=cycle.strftime('%H'))
+        for filename in get_renderer(args.template_dir).templates:
+            obtype, ext = os.path.splitext(filename.replace('bufr2ioda_', ''))
+            output = os.path.join(args.output_dir, f"{obtype}_{datetime_to_YMDH(cycle)}{ext}")
+            requests.append((filename, cycle_config, output))
+    gen_bufr_batch(args.template_dir, requests)
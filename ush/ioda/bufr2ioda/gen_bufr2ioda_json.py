@@ -17,6 +17,11 @@ def gen_bufr_json(config, template, output):
     # read in templated JSON and do substitution
     logger.info(f"Using {template} as input {config}")
     bufr_config = parse_j2yaml(template, config)
+    write_bufr_json(bufr_config, output)
+    return bufr_config
+
+
+def write_bufr_json(bufr_config, output):
     # write out JSON
     json_object = json.dumps(bufr_config, indent=4)
     with open(output, "w") as outfile:
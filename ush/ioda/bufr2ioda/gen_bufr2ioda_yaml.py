@@ -16,11 +16,16 @@ def gen_bufr_yaml(config, template, output):
     # read in templated YAML and do substitution
     logger.info(f"Using {template} as input")
     bufr_config = parse_j2yaml(template, config)
+    return write_bufr_yaml(bufr_config, output)
+
+
+def write_bufr_yaml(bufr_config, output):
     # need to do some special manipulation for the splits
     substitutions = {'splitvar': '{splits/satId}'}
     bufr_config = Template.substitute_structure(bufr_config, TemplateConstants.DOLLAR_PARENTHESES, substitutions.get)
     save_as_yaml(bufr_config, output)
     logger.info(f"Wrote to {output}")
+    return bufr_config
 
 
 if __name__ == "__main__":
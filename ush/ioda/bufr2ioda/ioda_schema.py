@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# ioda_schema.py
+# table driven writing of IODA variables: a converter describes its output
+# variables once, as a schema of IodaVar entries, and writes them for every
+# output file from a dict of arrays keyed by IODA path, instead of one
+# create_var/write_attr/write_data chain per variable and file.
+# chunks and compression_level override the output policy of the file
+# (output_policy.py) for one variable
+from collections import namedtuple
+
+# dtype and fillval default to those of the array written, chunks and
+# compression_level to the output policy
+IodaVar = namedtuple('IodaVar', ['path', 'units', 'long_name', 'valid_range', 'dim_list', 'dtype', 'fillval',
+                                 'chunks', 'compression_level'],
+                     defaults=(None, None, None, None, None, None, None, None))
+
+
+def write_global_attrs(obsspace, attrs):
+    # attrs maps the global attribute names to their values, written in order
+    for name, value in attrs.items():
+        obsspace.write_attr(name, value)
+
+
+def write_ioda_vars(obsspace, schema, data):
+    """
+    Create and write every variable of schema, data maps the IODA path of
+    each variable to its array. All the arrays are checked before the first
+    variable is created, so a file is not left half written.
+    """
+    missing = [var.path for var in schema if var.path not in data]
+    if missing:
+        raise KeyError(f"No data for the IODA variables {missing}")
+    unknown = sorted(set(data) - set(var.path for var in schema))
+    if unknown:
+        raise KeyError(f"No schema for the IODA variables {unknown}")
+
+    for var in schema:
+        values = data[var.path]
+        options = {
+            'dtype': values.dtype if var.dtype is None else var.dtype,
+            'fillval': values.fill_value if var.fillval is None else var.fillval,
+        }
+        if var.dim_list is not None:
+            options['dim_list'] = var.dim_list
+        if var.chunks is not None:
+            options['chunks'] = var.chunks
+        if var.compression_level is not None:
+            options['compression_level'] = var.compression_level
+        ioda_var = obsspace.create_var(var.path, **options)
+        if var.units is not None:
+            ioda_var.write_attr('units', var.units)
+        if var.valid_range is not None:
+            ioda_var.write_attr('valid_range', var.valid_range)
+        if var.long_name is not None:
+            ioda_var.write_attr('long_name', var.long_name)
+        ioda_var.write_data(values)
@@ -39,6 +39,22 @@ class Bufr2iodaConfig:
         self.dump_dir = config["dump_directory"]
         self.ioda_dir = config["ioda_directory"]
         self.ocean_basin = config["ocean_basin"]
+        # optional HDF5 chunking and compression of the ioda output
+        self.output_policy = config.get("output_policy")
+        # optional batch of [cycle, input file, output file] jobs converted
+        # in one process, see Bufr2ioda_Converter.run_batch
+        self.jobs = config.get("jobs")
+        self.job_workers = config.get("job_workers", 1)
+        # optional single ioda file for the obs of all the jobs
+        self.merge_output = config.get("merge_output")
+        # optional number of bufr messages queried at a time
+        self.stream_messages = config.get("stream_messages")
+        # optional directory of cached query results, see query_cache.py
+        self.query_cache = config.get("query_cache")
+        self.input_file = None
+        self.output_file = None
+        # the bufr files of a merged output, for its sourceFiles attribute
+        self.source_files = None
 
         self.yyyymmdd = self.cycle_datetime[0:8]
         self.hh = self.cycle_datetime[8:10]
@@ -46,10 +62,21 @@ class Bufr2iodaConfig:
         # General Information
         self.converter = 'BUFR to IODA Converter'
 
+    def set_job(self, cycle_datetime, input_file=None, output_file=None):
+        # the cycle of one job of a batch, and its bufr input and ioda output
+        # file names when they are not the ones derived from the cycle
+        self.cycle_datetime = cycle_datetime
+        self.yyyymmdd = self.cycle_datetime[0:8]
+        self.hh = self.cycle_datetime[8:10]
+        self.input_file = input_file
+        self.output_file = output_file
+
     def ocean_basin_nc_file_path(self):
         return self.ocean_basin
 
     def bufr_filename(self):
+        if self.input_file:
+            return self.input_file
         return f"{self.cycle_datetime}-{self.cycle_type}.t{self.hh}z.{self.data_format}.tm00.bufr_d"
 
     def bufr_filepath(self):
@@ -59,12 +86,14 @@ class Bufr2iodaConfig:
         return f"{self.cycle_type}.t{self.hh}z.insitu_profile_{self.data_format}.{self.cycle_datetime}.nc4"
 
     def ioda_filepath(self):
+        if self.output_file:
+            return os.path.join(self.ioda_dir, self.output_file)
         return os.path.join(self.ioda_dir, self.ioda_filename())
 
     def create_ioda_attributes(self, obsspace, date_range):
         obsspace.write_attr('Converter', self.converter)
         obsspace.write_attr('source', self.source)
-        obsspace.write_attr('sourceFiles', self.bufr_filename())
+        obsspace.write_attr('sourceFiles', ', '.join(self.source_files or [self.bufr_filename()]))
         obsspace.write_attr('dataProviderOrigin', self.data_provider)
         obsspace.write_attr('description', self.data_description)
         obsspace.write_attr('datetimeRange', date_range)
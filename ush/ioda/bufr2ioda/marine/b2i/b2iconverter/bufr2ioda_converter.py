@@ -3,14 +3,23 @@ import numpy as np
 import numpy.ma as ma
 import os
 import time
+import math
 from datetime import datetime
 from pyiodaconv import bufr
 from collections import namedtuple
-from pyioda import ioda_obs_space as ioda_ospace
-from .util import parse_arguments, run_diff
+from .util import parse_arguments, run_diff, count_bufr_messages
 from .bufr2ioda_config import Bufr2iodaConfig
+from .ioda_addl_vars import compute_seq_num
+from .query_cache import query_set, query_cache_dir, query_cache_path, RecordingResultSet, CachedResultSet, QueryCacheMiss
 import logging
 import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+# the per-stage timing and the output policy are shared with the bufr2ioda
+# converters: ush/ioda/bufr2ioda has to be on the PYTHONPATH
+from stage_timer import StageTimer
+from output_policy import create_obsspace
 
 
 # the converter takes a configuration class as input,
@@ -23,6 +32,80 @@ import tempfile
 # the hashes are deterministic, yet they are supposedly capable
 # of detecting an error with high probability
 
+# with stream_messages, the bufr file is queried in batches of that many
+# messages, and only the filtered obs of every batch are kept; the query
+# result cache (query_cache.py) applies to whole file queries only
+
+# the converter can also convert a batch of cycles in one process, the jobs
+# of the config: the QuerySet, the ocean basins and the logger are set up
+# once, and the jobs run one after the other or in forked workers
+
+# one job of a batch: the cycle, and optionally the bufr input file in the
+# dump directory and the ioda output file in the ioda directory
+Bufr2iodaJob = namedtuple('Bufr2iodaJob', ['cycle', 'input_file', 'output_file'], defaults=(None, None))
+
+# converter of the current batch, inherited by the forked workers
+_batch = {}
+
+
+def _convert_job(job):
+    return _batch['converter'].convert_job(job)
+
+
+# with merge_output, the filtered obs of all the jobs of the batch are
+# concatenated and written to a single ioda file for the window instead:
+# reports found in the dumps of more than one cycle are written once, those
+# repeated within the dump of one cycle are all kept, and seqNum is computed
+# over the whole window
+
+
+def location_arrays(ioda_vars):
+    # the per-location arrays of the filtered ioda variables and their metadata
+    n = len(ioda_vars.metadata.lat)
+    return {(owner, name): value
+            for owner in ('ioda_vars', 'metadata')
+            for name, value in vars(ioda_vars if owner == 'ioda_vars' else ioda_vars.metadata).items()
+            if isinstance(value, np.ndarray) and value.shape[:1] == (n,)}
+
+
+def merge_locations(parts):
+    return {key: concatenate_locations([part[key] for part in parts]) for key in parts[0]}
+
+
+def set_locations(ioda_vars, arrays, rows=slice(None)):
+    for (owner, name), value in arrays.items():
+        setattr(ioda_vars if owner == 'ioda_vars' else ioda_vars.metadata, name, value[rows])
+
+
+def concatenate_locations(arrays):
+    if not any(isinstance(a, ma.MaskedArray) for a in arrays):
+        return np.concatenate(arrays)
+    merged = ma.concatenate(arrays)
+    # ma.concatenate resets the fill value, which the ioda variables use
+    merged.fill_value = arrays[0].fill_value
+    return merged
+
+
+def unique_locations(columns, cycles):
+    # index of the locations to keep, in file order: a location identical in
+    # every column to one of an earlier cycle is dropped
+    keys = []
+    for column in columns:
+        data = ma.filled(column).reshape(len(column), -1)
+        if data.dtype.kind == 'f':
+            # identical bits, nan included
+            data = data.view(f"u{data.dtype.itemsize}")
+        keys.extend(data.T)
+        if ma.is_masked(column):
+            keys.extend(ma.getmaskarray(column).reshape(len(column), -1).T)
+    if len(keys) < 2:
+        keys.append(np.zeros(len(columns[0]), dtype=np.uint8))
+    groups = compute_seq_num(*keys)
+    first_cycle = np.full(groups.max() + 1, cycles.max(), dtype=cycles.dtype)
+    np.minimum.at(first_cycle, groups, cycles)
+    return np.flatnonzero(cycles == first_cycle[groups])
+
+
 class Bufr2ioda_Converter:
     def __init__(self, bufr2ioda_config, ioda_vars, logfile):
         ioda_vars.set_ocean_basin_nc_file(bufr2ioda_config.ocean_basin_nc_file_path())
@@ -30,6 +113,7 @@ class Bufr2ioda_Converter:
         self.ioda_vars = ioda_vars
         self.logfile = logfile
         self.setup_logging(bufr2ioda_config.script_name, self.logfile)
+        self.query = None
 
     def setup_logging(self, script_name, logfile):
         self.logger = logging.getLogger(script_name)
@@ -51,38 +135,230 @@ class Bufr2ioda_Converter:
             self.file_handler.setFormatter(file_formatter)
 
     def run(self):
+        if self.bufr2ioda_config.jobs and self.bufr2ioda_config.merge_output:
+            if not self.run_merged(self.bufr2ioda_config.jobs, self.bufr2ioda_config.merge_output):
+                sys.exit(0)
+        elif self.bufr2ioda_config.jobs:
+            failed = self.run_batch(self.bufr2ioda_config.jobs, self.bufr2ioda_config.job_workers)
+            if failed:
+                sys.exit(1)
+        elif not self.convert():
+            sys.exit(0)
+
+    def build_query(self):
+        # the QuerySet is built once for all the jobs of a batch
+        if self.query is None:
+            self.logger.debug(f"build_query")
+            self.query = self.ioda_vars.build_query()
+        return self.query
+
+    def run_batch(self, jobs, workers=1):
+        """
+        Convert every job, a Bufr2iodaJob or a [cycle, input_file, output_file]
+        list, in up to workers forked processes. Returns the jobs that failed.
+        """
+        jobs = [Bufr2iodaJob(*job) for job in jobs]
+        # set up before the workers fork, so that they share it
+        self.build_query()
+        self.ioda_vars.additional_vars.load_ocean_basin()
+
+        workers = min(workers or 1, len(jobs))
+        self.logger.info(f"Converting {len(jobs)} cycles with {workers} workers")
+        if workers > 1 and not mp.current_process().daemon:
+            _batch['converter'] = self
+            try:
+                with ProcessPoolExecutor(workers, mp_context=mp.get_context('fork')) as executor:
+                    done = list(executor.map(_convert_job, jobs))
+            finally:
+                _batch.clear()
+        else:
+            if workers > 1:
+                self.logger.info("Running in a daemonic process, converting the cycles serially")
+            done = [self.convert_job(job) for job in jobs]
+
+        failed = [job for job, ok in zip(jobs, done) if not ok]
+        for job in failed:
+            self.logger.error(f"Conversion of cycle {job.cycle} failed")
+        return failed
+
+    def run_merged(self, jobs, output_file):
+        """
+        Read every job and write the obs of all of them to output_file in the
+        ioda directory, for the cycle of the config. False if there are no obs.
+        """
+        jobs = [Bufr2iodaJob(*job) for job in jobs]
+        config = self.bufr2ioda_config
+        window_cycle = config.cycle_datetime
+        self.build_query()
+        self.ioda_vars.additional_vars.load_ocean_basin()
+
+        start_time = time.time()
+        timer = StageTimer(config.script_name)
+        try:
+            parts = []
+            sources = []
+            for job in jobs:
+                config.set_job(*job)
+                if self.read_cycle(timer):
+                    parts.append(location_arrays(self.ioda_vars))
+                    sources.append(config.bufr_filename())
+            if not parts:
+                self.logger.warning(f"No obs in the window! Quitting.")
+                return False
+
+            timer.stage('filter')
+            merged = merge_locations(parts)
+            cycles = np.repeat(np.arange(len(parts)), [len(part[('metadata', 'lat')]) for part in parts])
+            keep = unique_locations(list(merged.values()), cycles)
+            n_merged = len(next(iter(merged.values())))
+            self.logger.debug(f"Merged {len(parts)} cycles: {n_merged} obs, {n_merged - len(keep)} duplicates removed")
+            set_locations(self.ioda_vars, merged, keep)
+
+            config.set_job(window_cycle, output_file=output_file)
+            config.source_files = sources
+            try:
+                self.write_output(timer)
+            finally:
+                config.source_files = None
+        finally:
+            # the stage record is saved however the window ends
+            timer.done(self.logger)
+
+        end_time = time.time()
+        running_time = end_time - start_time
+        self.logger.debug(f"Total running time: {running_time} seconds")
+        return True
+
+    def convert_job(self, job):
+        self.bufr2ioda_config.set_job(*job)
+        try:
+            self.convert()
+            return True
+        except Exception:
+            self.logger.exception(f"Conversion of cycle {job[0]} raised")
+            return False
+
+    def convert(self):
+        # convert the bufr file of the current cycle, False if it has no obs
         start_time = time.time()
+        timer = StageTimer(self.bufr2ioda_config.script_name)
+        try:
+            if not self.read_cycle(timer):
+                return False
+            self.write_output(timer)
+        finally:
+            # the stage record is saved however the cycle ends
+            timer.done(self.logger)
+
+        end_time = time.time()
+        running_time = end_time - start_time
+        self.logger.debug(f"Total running time: {running_time} seconds")
+        return True
 
-        self.logger.debug(f"build_query")
-        q = self.ioda_vars.build_query()
+    def read_cycle(self, timer):
+        # query and filter the bufr file of the current cycle, False if it has no obs
+        timer.stage('query')
+        q = self.build_query()
 
         bufrfile_path = self.bufr2ioda_config.bufr_filepath()
-        self.logger.debug(f"ExecuteQuery: BUFR file = {bufrfile_path}")
-        with bufr.File(bufrfile_path) as f:
-            r = f.execute(q)
+        if self.bufr2ioda_config.stream_messages:
+            return self.read_cycle_streamed(timer, q, bufrfile_path, self.bufr2ioda_config.stream_messages)
+        cache_dir = query_cache_dir(self.bufr2ioda_config.query_cache)
+        cache_path = query_cache_path(cache_dir, bufrfile_path, q) if cache_dir else None
+        timer.stage('execute')
+        if cache_path and os.path.exists(cache_path):
+            self.logger.debug(f"Query result from cache: {cache_path}")
+            r = CachedResultSet(cache_path)
+        else:
+            r = self.execute_query(q, bufrfile_path, cache_path)
 
         # process query results and set ioda variables
-        self.ioda_vars.set_from_query_result(r)
+        timer.stage('derive')
+        try:
+            self.ioda_vars.set_from_query_result(r)
+        except QueryCacheMiss as e:
+            # the converter gets a result that was not cached: decode the file
+            self.logger.debug(f"Query cache miss for {e}")
+            timer.stage('execute')
+            r = self.execute_query(q, bufrfile_path, cache_path)
+            timer.stage('derive')
+            self.ioda_vars.set_from_query_result(r)
+        if isinstance(r, RecordingResultSet):
+            if r.save(cache_path):
+                self.logger.debug(f"Saved the query result to cache: {cache_path}")
+            else:
+                self.logger.warning(f"Query result cannot be cached")
+        del r
 
         n_obs = self.ioda_vars.number_of_obs()
+        timer.obs_in(n_obs)
         self.logger.debug(f"Query result has {n_obs} obs")
         if (n_obs == 0):
             self.logger.warning(f"No obs! Quitting.")
-            sys.exit(0)
+            return False
 
+        timer.stage('filter')
         self.ioda_vars.filter()
 
         n_obs = self.ioda_vars.number_of_obs()
         self.logger.debug(f"Filtered result has {n_obs} obs")
         if (n_obs == 0):
             self.logger.warning(f"No obs! Quitting.")
-            sys.exit(0)
+            return False
         self.logger.debug(f"Number of temperature obs = {self.ioda_vars.number_of_temp_obs()}")
         self.logger.debug(f"Number of salinity obs = {self.ioda_vars.number_of_saln_obs()}")
+        return True
 
+    def execute_query(self, q, bufrfile_path, cache_path=None):
+        # the result of q on the whole file, recorded for the cache if it has a path
+        self.logger.debug(f"ExecuteQuery: BUFR file = {bufrfile_path}")
+        with bufr.File(bufrfile_path) as f:
+            r = f.execute(query_set(q))
+        return RecordingResultSet(r) if cache_path else r
+
+    def read_cycle_streamed(self, timer, q, bufrfile_path, batch_size):
+        # execute the query over batch_size messages at a time, each batch is
+        # derived and filtered before the next one is read, so that only the
+        # filtered obs of the whole file are held in memory
+        n_batches = math.ceil(count_bufr_messages(bufrfile_path) / batch_size)
+        self.logger.debug(f"ExecuteQuery: BUFR file = {bufrfile_path}, {n_batches} batches of {batch_size} messages")
+        parts = []
+        n_in = 0
+        with bufr.File(bufrfile_path) as f:
+            for batch in range(n_batches):
+                timer.stage('execute')
+                r = f.execute(query_set(q), next=batch_size)
+
+                timer.stage('derive')
+                self.ioda_vars.set_from_query_result(r)
+                del r
+                n_obs = self.ioda_vars.number_of_obs()
+                timer.obs_in(n_obs)
+                n_in += n_obs
+                if (n_obs == 0):
+                    continue
+
+                timer.stage('filter')
+                self.ioda_vars.filter()
+                if self.ioda_vars.number_of_obs() > 0:
+                    parts.append(location_arrays(self.ioda_vars))
+
+        self.logger.debug(f"Query result has {n_in} obs")
+        if not parts:
+            self.logger.warning(f"No obs! Quitting.")
+            return False
+        set_locations(self.ioda_vars, merge_locations(parts))
+        self.logger.debug(f"Filtered result has {self.ioda_vars.number_of_obs()} obs")
+        self.logger.debug(f"Number of temperature obs = {self.ioda_vars.number_of_temp_obs()}")
+        self.logger.debug(f"Number of salinity obs = {self.ioda_vars.number_of_saln_obs()}")
+        return True
+
+    def write_output(self, timer):
         # set seqNum, PreQC, ObsError, OceanBasin
+        timer.stage('derive')
         self.ioda_vars.additional_vars.construct()
 
+        timer.stage('write')
         iodafile_path = self.bufr2ioda_config.ioda_filepath()
         path, fname = os.path.split(iodafile_path)
         os.makedirs(path, exist_ok=True)
@@ -90,7 +366,8 @@ class Bufr2ioda_Converter:
         metadata = self.ioda_vars.metadata
 
         dims = {'Location': np.arange(0, metadata.lat.shape[0])}
-        obsspace = ioda_ospace.ObsSpace(iodafile_path, mode='w', dim_dict=dims)
+        obsspace = create_obsspace(iodafile_path, dims, self.bufr2ioda_config.output_policy, self.logger)
+        timer.output(iodafile_path, dims['Location'])
         self.logger.debug(f"Created IODA file: {iodafile_path}")
 
         date_range = [str(metadata.dateTime.min()), str(metadata.dateTime.max())]
@@ -100,16 +377,12 @@ class Bufr2ioda_Converter:
         self.logger.debug(f"ioda_vars.write_to_ioda_file")
         self.ioda_vars.write_to_ioda_file(obsspace)
 
+        # the hashes are computed only for a log file, test() logs its own
         if (self.logfile):
             self.logger.addHandler(self.file_handler)
-        self.ioda_vars.log(self.logger)
-        if (self.logfile):
+            self.ioda_vars.log(self.logger)
             self.logger.removeHandler(self.file_handler)
 
-        end_time = time.time()
-        running_time = end_time - start_time
-        self.logger.debug(f"Total running time: {running_time} seconds")
-
     def test(self, test_file):
         with tempfile.NamedTemporaryFile(delete=False, suffix='.log') as temp_log_file:
             temp_log_file_name = temp_log_file.name
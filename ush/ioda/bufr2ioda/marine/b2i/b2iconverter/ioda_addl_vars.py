@@ -1,4 +1,5 @@
 import numpy as np
+import numpy.ma as ma
 import sys
 from .ocean import OceanBasin
 from .util import *
@@ -22,12 +23,15 @@ class IODAAdditionalVariables:
     def set_ocean_basin_nc_file(self, nc_file_path):
         self.ocean.set_ocean_basin_nc_file(nc_file_path)
 
+    def load_ocean_basin(self):
+        self.ocean.read_nc_file()
+
     def compute_ocean_basin(self):
         lat = self.ioda_vars.metadata.lat
         lon = self.ioda_vars.metadata.lon
-        self.ocean.read_nc_file()
-        ob = self.ocean.get_station_basin(lat, lon)
-        self.OceanBasin = np.array(ob, dtype=np.int32)
+        self.load_ocean_basin()
+        ob = self.ocean.get_station_basin(lat, lon, self.PreQC.fill_value)
+        self.OceanBasin = ob.filled().astype(np.int32)
 
     def set_temperature_error(self, e):
         self.T_error = e
@@ -57,9 +61,7 @@ class IODAAdditionalVariables:
 
     # should the long name be "PreQC" + name?
     def write_preqc(self, obsspace, name):
-        obsspace.create_var("PreQC/" + name, dtype=self.PreQC.dtype, fillval=self.PreQC.fill_value) \
-            .write_attr('long_name', 'PreQC') \
-            .write_data(self.PreQC)
+        write_ioda_var(obsspace, IodaVar("PreQC/" + name, long_name='PreQC'), self.PreQC)
 
     def write_obs_errorT(self, obsspace):
         write_obs_error(obsspace, "ObsError/" + self.ioda_vars.T_name, "degC", self.ObsError_temp)
@@ -92,8 +94,52 @@ class IODAAdditionalVariables:
 #########################################################################
 
 
-def compute_seq_num(lon, lat):
-    combined = np.stack((lon, lat), axis=-1)
-    unique_combined, seqNum = np.unique(combined, axis=0, return_inverse=True)
-    seqNum = seqNum.astype(np.int32)
-    return seqNum
+def compute_seq_num(lon, lat, *keys):
+    # profiles are the unique (lon, lat) pairs, optionally refined by further
+    # keys such as stationID and dateTime, numbered in lexicographic order:
+    # the numbering of np.unique(np.stack((lon, lat), axis=-1), axis=0,
+    # return_inverse=True), which sorts a structured view of the pairs
+    columns = [np.asarray(ma.getdata(c)) for c in (lon, lat) + keys]
+    if any(c.dtype.kind == 'f' and np.isnan(c).any() for c in columns):
+        # nan never equals itself, leave it to np.unique
+        unique_combined, seqNum = np.unique(np.stack(columns, axis=-1), axis=0, return_inverse=True)
+        return seqNum.reshape(-1).astype(np.int32)
+
+    ordered = [ordered_key(c) for c in columns]
+    if sum(bits for _, bits in ordered) <= 64:
+        # one 64 bit key per observation, grouped by a single 1-D sort
+        packed = np.zeros(len(columns[0]), dtype=np.uint64)
+        for key, bits in ordered:
+            packed = (packed << np.uint64(bits)) | key.astype(np.uint64)
+        unique_keys, seqNum = np.unique(packed, return_inverse=True)
+    else:
+        keys = [key for key, _ in ordered]
+        order = np.lexsort(keys[::-1])
+        new_group = np.zeros(len(order), dtype=bool)
+        for key in keys:
+            sorted_key = key[order]
+            new_group[1:] |= sorted_key[1:] != sorted_key[:-1]
+        seqNum = np.empty(len(order), dtype=np.int64)
+        seqNum[order] = np.cumsum(new_group)
+    return seqNum.astype(np.int32)
+
+
+def ordered_key(values):
+    # unsigned integers in the order of values, and their width in bits
+    if values.dtype.kind == 'f':
+        bits = 8 * values.dtype.itemsize
+        # -0.0 and 0.0 are the same coordinate
+        raw = (values + values.dtype.type(0)).view(f"u{values.dtype.itemsize}")
+        # negative floats order in reverse of their bits, positive ones after them
+        sign = raw >> (bits - 1)
+        flip = np.where(sign == 1, ~raw.dtype.type(0), raw.dtype.type(1) << (bits - 1))
+        return raw ^ flip.astype(raw.dtype), bits
+    if values.dtype.kind == 'i':
+        bits = 8 * values.dtype.itemsize
+        raw = values.view(f"u{values.dtype.itemsize}")
+        return raw ^ raw.dtype.type(1 << (bits - 1)), bits
+    if values.dtype.kind in 'ub':
+        return values.astype(np.uint64), 8 * values.dtype.itemsize
+    # strings and other keys are ranked by a 1-D sort
+    unique_values, rank = np.unique(values, return_inverse=True)
+    return rank.reshape(-1).astype(np.uint64), max(1, int(len(unique_values) - 1).bit_length())
@@ -1,6 +1,5 @@
 import numpy as np
 from .util import *
-import hashlib
 
 
 class IODAMetadata:
@@ -82,11 +81,8 @@ class IODAMetadata:
     def log_station_id(self, logger):
         logger.debug(f"stationID: {len(self.stationID)}, {self.stationID.astype(str).dtype}")
         if isinstance(self.stationID[0], str):
-            concatenated_string = ''.join(self.stationID)
-            # Compute the hash using SHA-256
-            hash_object = hashlib.sha256(concatenated_string.encode())
-            hash_hex = hash_object.hexdigest()
-            logger.debug(f"stationID hash = {hash_hex}")
+            # the SHA-256 hash of the concatenated station ids
+            logger.debug(f"stationID hash = {compute_string_hash(self.stationID)}")
         # # elif isinstance(self.stationID[0], int32):
         else:
             logger.debug(f"stationID hash = {compute_hash(self.stationID)}")
@@ -3,6 +3,7 @@ from pyiodaconv import bufr
 from .util import *
 from .ioda_metadata import IODAMetadata
 from .ioda_addl_vars import IODAAdditionalVariables
+from .query_cache import RecordedQuerySet
 
 
 class IODAVariables:
@@ -67,7 +68,7 @@ class IODAVariables:
         return max(self.number_of_temp_obs(), self.number_of_saln_obs())
 
     def build_query(self):
-        q = bufr.QuerySet()
+        q = RecordedQuerySet()
         q.add('year', '*/YEAR')
         q.add('month', '*/MNTH')
         q.add('day', '*/DAYS')
@@ -113,22 +114,12 @@ class IODAVariables:
 ###########################################################################
 
     def write_obs_value_t(self, obsspace):
-        obsspace.create_var('ObsValue/' + self.T_name, dtype=self.temp.dtype, fillval=self.temp.fill_value) \
-            .write_attr('units', 'degC') \
-            .write_attr('valid_range', np.array([self.T_min, self.T_max], dtype=np.float32)) \
-            .write_attr('long_name', self.T_name) \
-            .write_data(self.temp)
+        write_ioda_var(obsspace, IodaVar('ObsValue/' + self.T_name, 'degC', self.T_name,
+                                         np.array([self.T_min, self.T_max], dtype=np.float32)), self.temp)
 
     def write_obs_value_s(self, obsspace):
-        obsspace.create_var(
-            'ObsValue/' + self.S_name,
-            dtype=self.saln.dtype,
-            fillval=self.saln.fill_value
-        ) \
-            .write_attr('units', 'psu') \
-            .write_attr('valid_range', np.array([self.S_min, self.S_max], dtype=np.float32)) \
-            .write_attr('long_name', self.S_name) \
-            .write_data(self.saln)
+        write_ioda_var(obsspace, IodaVar('ObsValue/' + self.S_name, 'psu', self.S_name,
+                                         np.array([self.S_min, self.S_max], dtype=np.float32)), self.saln)
 
 ##############################################################################
 
@@ -18,6 +18,64 @@ import xarray as xr
 # the main method is get_station_basin which returns the ocean basin
 # for a list of station coordinates
 
+# the nc file can be preprocessed once per cycle into a basin cache next to
+# it, <file>.basin.npy, holding the regular grid parameters followed by the
+# basin grid; the converters then memory-map the grid read-only, sharing its
+# pages, instead of each reading the nc file:
+#     python ocean.py RECCAP2_region_masks_all_v20221025.nc
+
+
+def basin_cache_path(nc_file_path):
+    return f"{os.path.splitext(nc_file_path)[0]}.basin.npy"
+
+
+def basin_cache_current(nc_file_path, cache_path=None):
+    # a basin cache at least as recent as the nc file replaces it
+    if cache_path is None:
+        cache_path = basin_cache_path(nc_file_path)
+    return os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(nc_file_path)
+
+
+def write_basin_cache(nc_file_path, cache_path=None):
+    if cache_path is None:
+        cache_path = basin_cache_path(nc_file_path)
+    with nc.Dataset(nc_file_path, 'r') as nc_file:
+        latitudes = nc_file.variables['lat'][:]
+        longitudes = nc_file.variables['lon'][:]
+        basin_array = np.reshape(ma.getdata(nc_file.variables['open_ocean'][:]),
+                                 (nc_file.dimensions['lat'].size, nc_file.dimensions['lon'].size))
+    # get_station_basin assumes a regular grid
+    for name, coords in (('lat', latitudes), ('lon', longitudes)):
+        steps = np.diff(ma.getdata(coords))
+        if not np.allclose(steps, steps[0]):
+            raise ValueError(f"{nc_file_path}: the {name} grid is not regular")
+    # the parameters keep the dtypes of the coordinates, so that the
+    # grid indices are computed as from the nc file
+    grid = np.array([(latitudes[0], latitudes[1] - latitudes[0], longitudes[0], longitudes[1] - longitudes[0])],
+                    dtype=[('lat0', latitudes.dtype), ('dlat', latitudes.dtype),
+                           ('lon0', longitudes.dtype), ('dlon', longitudes.dtype)])
+    tmpfile = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmpfile, 'wb') as f:
+        np.lib.format.write_array(f, grid)
+        np.lib.format.write_array(f, np.ascontiguousarray(basin_array))
+    os.replace(tmpfile, cache_path)
+    return cache_path
+
+
+def read_basin_cache(cache_path):
+    # the grid parameters, and the basin grid as a read-only memory map
+    with open(cache_path, 'rb') as f:
+        grid = np.lib.format.read_array(f)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    basin_array = np.memmap(cache_path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                            order='F' if fortran_order else 'C')
+    return grid[0], basin_array
+
 
 class OceanBasin:
     def __init__(self):
@@ -25,16 +83,29 @@ class OceanBasin:
 
     def set_ocean_basin_nc_file(self, filename):
         self.ocean_basin_nc_file_path = filename
+        self.__loaded_path = None
 
     def read_nc_file(self):
+        # the basins are read once, a batch of conversions reuses them
+        if self.__loaded_path == self.ocean_basin_nc_file_path:
+            return
+        self.__loaded_path = self.ocean_basin_nc_file_path
+        cache_path = basin_cache_path(self.ocean_basin_nc_file_path)
+        if basin_cache_current(self.ocean_basin_nc_file_path, cache_path):
+            grid, self.__basin_array = read_basin_cache(cache_path)
+            self.__grid = (grid['lat0'], grid['dlat'], grid['lon0'], grid['dlon'])
+            return
+
         try:
             with nc.Dataset(self.ocean_basin_nc_file_path, 'r') as nc_file:
                 variable_name = 'open_ocean'
                 if variable_name in nc_file.variables:
                     lat_dim = nc_file.dimensions['lat'].size
                     lon_dim = nc_file.dimensions['lon'].size
-                    self.__latitudes = nc_file.variables['lat'][:]
-                    self.__longitudes = nc_file.variables['lon'][:]
+                    latitudes = nc_file.variables['lat'][:]
+                    longitudes = nc_file.variables['lon'][:]
+                    self.__grid = (latitudes[0], latitudes[1] - latitudes[0],
+                                   longitudes[0], longitudes[1] - longitudes[0])
 
                     variable = nc_file.variables[variable_name]
                     # Read the variable data into a numpy array
@@ -42,29 +113,41 @@ class OceanBasin:
                     # Convert to 2D numpy array
                     self.__basin_array = np.reshape(variable_data, (lat_dim, lon_dim))
         except FileNotFoundError:
-            print(f"The file {file_path} does not exist.")
+            print(f"The file {self.ocean_basin_nc_file_path} does not exist.")
             sys.exit(1)
         except IOError as e:
             # Handle other I/O errors, such as permission errors
             print(f"An IOError occurred: {e}")
             sys.exit(1)
 
-    # input: 2 vectors of station coordinates
-    # output: a vector of station ocean basin values
-    def get_station_basin(self, lat, lon):
-        n = len(lon)
-        # print("number of stations = ", n)
-
-        lat0 = self.__latitudes[0]
-        dlat = self.__latitudes[1] - self.__latitudes[0]
-        lon0 = self.__longitudes[0]
-        dlon = self.__longitudes[1] - self.__longitudes[0]
-
-        # the data may be a masked array
-        ocean_basin = []
-        for i in range(n):
-            if not ma.is_masked(lat[i]):
-                i1 = round((lat[i] - lat0) / dlat)
-                i2 = round((lon[i] - lon0) / dlon)
-                ocean_basin.append(self.__basin_array[i1][i2])
-        return ocean_basin
+    # input: 2 vectors of station coordinates, possibly masked arrays
+    # output: a masked vector of station ocean basin values, as long as the
+    # coordinates; a station with a masked or non-finite coordinate is
+    # masked, with fill_value as its data
+    def get_station_basin(self, lat, lon, fill_value=-1):
+        lat0, dlat, lon0, dlon = self.__grid
+        nlat, nlon = self.__basin_array.shape
+
+        lat_data = ma.getdata(lat)
+        lon_data = ma.getdata(lon)
+        invalid = ma.getmaskarray(lat) | ma.getmaskarray(lon) | \
+            ~np.isfinite(lat_data) | ~np.isfinite(lon_data)
+        lat_data = np.where(invalid, lat0, lat_data)
+        lon_data = np.where(invalid, lon0, lon_data)
+
+        # nearest grid point, rounding half to even as round() does;
+        # longitudes wrap around the globe, latitudes beyond the grid
+        # take its first or last row
+        i1 = np.clip(np.rint((lat_data - lat0) / dlat).astype(np.int64), 0, nlat - 1)
+        i2 = np.rint((lon_data - lon0) / dlon).astype(np.int64) % nlon
+
+        ocean_basin = np.asarray(ma.getdata(self.__basin_array)[i1, i2], dtype=np.int32)
+        ocean_basin[invalid] = fill_value
+        return ma.masked_array(ocean_basin, mask=invalid, fill_value=fill_value)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(f"usage: {sys.argv[0]} ocean_basin_nc_file [cache_file]")
+        sys.exit(1)
+    print(f"Wrote the ocean basin cache {write_basin_cache(*sys.argv[1:])}")
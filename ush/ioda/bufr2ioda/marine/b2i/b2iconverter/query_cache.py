@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import numpy as np
+import numpy.ma as ma
+from pyiodaconv import bufr
+
+# opt-in cache of query results, for development and testing: the arrays a
+# converter gets from the ResultSet of its query (data, mask, fill value)
+# are saved in an npz bundle, and the next run on the same bufr file with
+# the same queries reads them instead of decoding the file.
+# The cache directory is the query_cache entry of the converter config, or
+# else BUFR2IODA_QUERY_CACHE; the bundle of a bufr file and a QuerySet is
+# <bufr file name>.<key>.npz, the key hashes the path, size and modification
+# time of the file and the sorted (name, path) queries.
+
+QUERY_CACHE_ENV = 'BUFR2IODA_QUERY_CACHE'
+
+
+class QueryCacheMiss(KeyError):
+    pass
+
+
+class RecordedQuerySet:
+    """
+    A bufr.QuerySet that keeps its queries, so that the cache can key on
+    them; query_set is the QuerySet to execute.
+    """
+
+    def __init__(self):
+        self.query_set = bufr.QuerySet()
+        self.queries = []
+
+    def add(self, name, path):
+        self.queries.append((name, path))
+        self.query_set.add(name, path)
+
+    def canonical(self):
+        return json.dumps(sorted(self.queries))
+
+
+def query_set(q):
+    # the bufr.QuerySet to execute
+    return getattr(q, 'query_set', q)
+
+
+def query_cache_dir(config_dir):
+    return config_dir or os.environ.get(QUERY_CACHE_ENV)
+
+
+def query_cache_path(cache_dir, bufrfile_path, q):
+    # None if the queries of q are not known
+    if not isinstance(q, RecordedQuerySet):
+        return None
+    st = os.stat(bufrfile_path)
+    identity = json.dumps([os.path.realpath(bufrfile_path), st.st_size, st.st_mtime_ns, q.canonical()])
+    key = hashlib.sha256(identity.encode()).hexdigest()[:20]
+    return os.path.join(cache_dir, f"{os.path.basename(bufrfile_path)}.{key}.npz")
+
+
+def call_key(method, args, kwargs):
+    return json.dumps([method, list(args), sorted(kwargs.items())])
+
+
+class RecordingResultSet:
+    """
+    A ResultSet that keeps a copy of every array it returns, for save.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = {}
+
+    def get(self, *args, **kwargs):
+        return self._record('get', args, kwargs)
+
+    def get_datetime(self, *args, **kwargs):
+        return self._record('get_datetime', args, kwargs)
+
+    def _record(self, method, args, kwargs):
+        value = getattr(self.result, method)(*args, **kwargs)
+        self.calls[call_key(method, args, kwargs)] = value.copy()
+        return value
+
+    def save(self, path):
+        """
+        Write the recorded arrays to path, False if one of them cannot be
+        saved without pickling.
+        """
+        arrays = {}
+        index = []
+        for i, (key, value) in enumerate(self.calls.items()):
+            data = ma.getdata(value)
+            dtype = data.dtype.str
+            if data.dtype.hasobject:
+                # strings only
+                if not all(isinstance(x, str) for x in data.flat):
+                    return False
+                data = data.astype(str)
+            arrays[f"d{i}"] = data
+            if isinstance(value, ma.MaskedArray):
+                arrays[f"m{i}"] = ma.getmaskarray(value)
+                arrays[f"f{i}"] = np.asarray(value.fill_value, dtype=data.dtype)
+            index.append([key, isinstance(value, ma.MaskedArray), dtype])
+        arrays['index'] = np.array(json.dumps(index))
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmpfile = f"{path}.{os.getpid()}.tmp"
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmpfile, path)
+        return True
+
+
+class CachedResultSet:
+    """
+    The arrays saved by RecordingResultSet, returned as fresh copies with
+    the get/get_datetime interface of bufr.ResultSet. A call that was not
+    recorded raises QueryCacheMiss.
+    """
+
+    def __init__(self, path):
+        self.calls = {}
+        with np.load(path) as bundle:
+            for i, (key, masked, dtype) in enumerate(json.loads(str(bundle['index']))):
+                data = bundle[f"d{i}"].astype(dtype, copy=False)
+                if masked:
+                    self.calls[key] = (data, bundle[f"m{i}"], bundle[f"f{i}"][()])
+                else:
+                    self.calls[key] = (data, None, None)
+
+    def get(self, *args, **kwargs):
+        return self._lookup('get', args, kwargs)
+
+    def get_datetime(self, *args, **kwargs):
+        return self._lookup('get_datetime', args, kwargs)
+
+    def _lookup(self, method, args, kwargs):
+        key = call_key(method, args, kwargs)
+        if key not in self.calls:
+            raise QueryCacheMiss(key)
+        data, mask, fill_value = self.calls[key]
+        if mask is None:
+            return data.copy()
+        return ma.masked_array(data.copy(), mask=mask.copy(), fill_value=fill_value)
@@ -5,6 +5,8 @@ import subprocess
 import numpy as np
 import tempfile
 import hashlib
+import mmap
+from ioda_schema import IodaVar, write_ioda_vars
 
 
 def parse_arguments():
@@ -32,6 +34,22 @@ def parse_arguments():
     return script_name, config_file, log_file, test_file
 
 
+def count_bufr_messages(path):
+    # number of BUFR messages in the file at path, from the total length in
+    # section 0 of every message; bytes between messages are skipped
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            count = 0
+            pos = m.find(b'BUFR')
+            while pos != -1:
+                length = int.from_bytes(m[pos + 4:pos + 7], 'big')
+                count += 1
+                pos = m.find(b'BUFR', pos + max(length, 8))
+    return count
+
+
 def log_variable(logger, v_name, v):
     logger.debug(f"{v_name}: {len(v)}, {v.dtype}    min, max = {v.min()}, {v.max()}")
 
@@ -64,113 +82,122 @@ def run_diff(file1, file2, logger):
 
 
 # use hash for testing;
-def compute_hash(sequence, algorithm='sha256'):
+# the arrays are hashed through memoryviews of their buffers, in blocks of
+# at most HASH_BLOCK_SIZE bytes: nothing is copied for contiguous arrays,
+# one block at a time otherwise, and the digest is that of bytes(array).
+# With BUFR2IODA_HASH_FINGERPRINT set, the logged hashes of arrays are their
+# fingerprints instead, which also tell apart the dtype, shape and mask; the
+# reference files of the tests hold the default digests.
+HASH_BLOCK_SIZE = 1 << 20
+HASH_FINGERPRINT_ENV = 'BUFR2IODA_HASH_FINGERPRINT'
+
+
+def update_hash(hash_obj, array):
+    """
+    Feed the data bytes of array, in C order, to hash_obj.
+    """
+    array = np.asarray(array)
+    if array.ndim == 0 or array.size == 0:
+        hash_obj.update(memoryview(np.ascontiguousarray(array).reshape(-1).view(np.uint8)))
+        return
+    rows = max(1, HASH_BLOCK_SIZE // max(1, array[0].nbytes))
+    for start in range(0, len(array), rows):
+        block = np.ascontiguousarray(array[start:start + rows])
+        hash_obj.update(memoryview(block.reshape(-1).view(np.uint8)))
+
+
+def compute_hash(sequence, algorithm='sha256', fingerprint=None):
     """
     Compute a hash of the given sequence using the specified algorithm.
 
     :param sequence: A sequence of numbers (e.g., list of integers).
     :param algorithm: The hash algorithm to use (e.g., 'sha256').
+    :param fingerprint: Hash an array with compute_fingerprint; by default
+        if BUFR2IODA_HASH_FINGERPRINT is set.
     :return: The hexadecimal digest of the hash.
     """
-    # Convert the sequence to a byte string
-    sequence_bytes = bytes(sequence)
-    # Create a hash object
+    if fingerprint is None:
+        fingerprint = bool(os.environ.get(HASH_FINGERPRINT_ENV))
+    if fingerprint and isinstance(sequence, np.ndarray):
+        return compute_fingerprint(sequence, algorithm)
+    hash_obj = hashlib.new(algorithm)
+    if isinstance(sequence, np.ndarray):
+        # the data of a masked array, as bytes(sequence)
+        update_hash(hash_obj, np.ma.getdata(sequence))
+    else:
+        hash_obj.update(bytes(sequence))
+    return hash_obj.hexdigest()
+
+
+def compute_fingerprint(array, algorithm='sha256'):
+    """
+    Hash of the dtype, the shape, the data and the mask of array: unlike
+    compute_hash, arrays with the same bytes but a different layout or
+    different masked elements do not collide.
+    """
     hash_obj = hashlib.new(algorithm)
-    # Update the hash object with the byte string
-    hash_obj.update(sequence_bytes)
-    # Return the hexadecimal digest of the hash
+    hash_obj.update(f"{np.asarray(array).dtype.str}{np.shape(array)}".encode())
+    update_hash(hash_obj, np.ma.getdata(array))
+    if np.ma.is_masked(array):
+        update_hash(hash_obj, np.packbits(np.ma.getmaskarray(array)))
+    return hash_obj.hexdigest()
+
+
+def compute_string_hash(strings, algorithm='sha256'):
+    """
+    The hash of the UTF-8 encoded concatenation of strings, encoded one
+    block at a time instead of as one joined string.
+    """
+    hash_obj = hashlib.new(algorithm)
+    rows = max(1, HASH_BLOCK_SIZE // 16)
+    for start in range(0, len(strings), rows):
+        hash_obj.update(''.join(strings[start:start + rows]).encode())
     return hash_obj.hexdigest()
 
 
 #####################################################################
 
+def write_ioda_var(obsspace, var, values):
+    # one variable of the schema of ioda_schema.py
+    write_ioda_vars(obsspace, [var], {var.path: values})
+
+
 def write_date_time(obsspace, dateTime):
-    obsspace.create_var(
-        'MetaData/dateTime',
-        dtype=dateTime.dtype, fillval=dateTime.fill_value
-    ) \
-        .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-        .write_attr('long_name', 'Datetime') \
-        .write_data(dateTime)
+    write_ioda_var(obsspace, IodaVar('MetaData/dateTime', 'seconds since 1970-01-01T00:00:00Z', 'Datetime'), dateTime)
 
 
 def write_rcpt_date_time(obsspace, rcptdateTime):
-    obsspace.create_var(
-        'MetaData/rcptdateTime',
-        dtype=rcptdateTime.dtype, fillval=rcptdateTime.fill_value
-    ) \
-        .write_attr('units', 'seconds since 1970-01-01T00:00:00Z') \
-        .write_attr('long_name', 'receipt Datetime') \
-        .write_data(rcptdateTime)
+    write_ioda_var(obsspace, IodaVar('MetaData/rcptdateTime', 'seconds since 1970-01-01T00:00:00Z', 'receipt Datetime'),
+                   rcptdateTime)
 
 
 def write_longitude(obsspace, lon):
-    obsspace.create_var(
-        'MetaData/longitude',
-        dtype=lon.dtype, fillval=lon.fill_value
-    ) \
-        .write_attr('units', 'degrees_east') \
-        .write_attr('valid_range', np.array([-180, 180], dtype=np.float32)) \
-        .write_attr('long_name', 'Longitude') \
-        .write_data(lon)
+    write_ioda_var(obsspace, IodaVar('MetaData/longitude', 'degrees_east', 'Longitude',
+                                     np.array([-180, 180], dtype=np.float32)), lon)
 
 
 def write_latitude(obsspace, lat):
-    obsspace.create_var(
-        'MetaData/latitude',
-        dtype=lat.dtype, fillval=lat.fill_value
-    ) \
-        .write_attr('units', 'degrees_north') \
-        .write_attr('valid_range', np.array([-90, 90], dtype=np.float32)) \
-        .write_attr('long_name', 'Latitude') \
-        .write_data(lat)
+    write_ioda_var(obsspace, IodaVar('MetaData/latitude', 'degrees_north', 'Latitude',
+                                     np.array([-90, 90], dtype=np.float32)), lat)
 
 
 def write_station_id(obsspace, stationID):
-    obsspace.create_var(
-        'MetaData/stationID',
-        dtype=stationID.dtype, fillval=stationID.fill_value
-    ) \
-        .write_attr('long_name', 'Station Identification') \
-        .write_data(stationID)
+    write_ioda_var(obsspace, IodaVar('MetaData/stationID', long_name='Station Identification'), stationID)
 
 
 def write_depth(obsspace, depth):
-    obsspace.create_var(
-        'MetaData/depth',
-        dtype=depth.dtype,
-        fillval=depth.fill_value
-    ) \
-        .write_attr('units', 'm') \
-        .write_attr('long_name', 'Water depth') \
-        .write_data(depth)
+    write_ioda_var(obsspace, IodaVar('MetaData/depth', 'm', 'Water depth'), depth)
 
 
 def write_seq_num(obsspace, seqNum, datatype, fillvalue):
-    obsspace.create_var(
-        'MetaData/sequenceNumber',
-        dtype=datatype,
-        fillval=fillvalue
-    ) \
-        .write_attr('long_name', 'Sequence Number') \
-        .write_data(seqNum)
+    write_ioda_var(obsspace, IodaVar('MetaData/sequenceNumber', long_name='Sequence Number',
+                                     dtype=datatype, fillval=fillvalue), seqNum)
 
 
 def write_obs_error(obsspace, v_name, units, v):
-    obsspace.create_var(
-        v_name,
-        dtype=v.dtype, fillval=v.fill_value
-    ) \
-        .write_attr('units', units) \
-        .write_attr('long_name', 'ObsError') \
-        .write_data(v)
+    write_ioda_var(obsspace, IodaVar(v_name, units, 'ObsError'), v)
 
 
 def write_ocean_basin(obsspace, ocean_basin, datatype, fillvalue):
-    obsspace.create_var(
-        'MetaData/oceanBasin',
-        dtype=datatype,
-        fillval=fillvalue
-    ) \
-        .write_attr('long_name', 'Ocean basin') \
-        .write_data(ocean_basin)
+    write_ioda_var(obsspace, IodaVar('MetaData/oceanBasin', long_name='Ocean basin', dtype=datatype, fillval=fillvalue),
+                   ocean_basin)
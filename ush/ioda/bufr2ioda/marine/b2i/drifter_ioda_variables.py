@@ -2,6 +2,7 @@ import numpy as np
 from pyiodaconv import bufr
 from b2iconverter.ioda_variables import IODAVariables
 from b2iconverter.ioda_metadata import IODAMetadata
+from b2iconverter.query_cache import RecordedQuerySet
 from b2iconverter.ioda_addl_vars import IODAAdditionalVariables, compute_seq_num
 from b2iconverter.util import *
 
@@ -14,7 +15,7 @@ class DrifterIODAVariables(IODAVariables):
         self.additional_vars = DrifterAdditionalVariables(self)
 
     def build_query(self):
-        q = bufr.QuerySet()
+        q = RecordedQuerySet()
         q.add('year', '*/YEAR')
         q.add('month', '*/MNTH')
         q.add('day', '*/DAYS')
@@ -92,12 +93,7 @@ class DrifterMetadata(IODAMetadata):
         write_longitude(obsspace, self.lon)
         write_latitude(obsspace, self.lat)
         write_station_id(obsspace, self.stationID)
-        obsspace.create_var(
-            'MetaData/BuoyType',
-            dtype=self.buoy_type.dtype, fillval=self.buoy_type.fill_value
-        ) \
-            .write_attr('long_name', 'Buoy Type') \
-            .write_data(self.buoy_type)
+        write_ioda_var(obsspace, IodaVar('MetaData/BuoyType', long_name='Buoy Type'), self.buoy_type)
 
     def log(self, logger):
         self.log_date_time(logger)
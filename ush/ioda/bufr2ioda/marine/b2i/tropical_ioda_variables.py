@@ -2,8 +2,10 @@ import numpy as np
 from pyiodaconv import bufr
 from b2iconverter.ioda_variables import IODAVariables
 from b2iconverter.ioda_metadata import IODAMetadata
+from b2iconverter.query_cache import RecordedQuerySet
 from b2iconverter.ioda_addl_vars import IODAAdditionalVariables
-from b2iconverter.util import log_variable, compute_hash
+from b2iconverter.util import log_variable, compute_hash, write_ioda_var
+from ioda_schema import IodaVar
 
 
 class TropicalIODAVariables(IODAVariables):
@@ -14,7 +16,7 @@ class TropicalIODAVariables(IODAVariables):
         self.additional_vars = IODAAdditionalVariables(self)
 
     def build_query(self):
-        q = bufr.QuerySet()
+        q = RecordedQuerySet()
         q.add('year', '*/YEAR')
         q.add('month', '*/MNTH')
         q.add('day', '*/DAYS')
@@ -67,12 +69,7 @@ class TropicalMetadata(IODAMetadata):
 
     def write_to_ioda_file(self, obsspace):
         super().write_to_ioda_file(obsspace)
-        obsspace.create_var(
-            'MetaData/BuoyType',
-            dtype=self.buoy_type.dtype, fillval=self.buoy_type.fill_value
-        ) \
-            .write_attr('long_name', 'Buoy Type') \
-            .write_data(self.buoy_type)
+        write_ioda_var(obsspace, IodaVar('MetaData/BuoyType', long_name='Buoy Type'), self.buoy_type)
 
     def log(self, logger):
         super().log(logger)
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# obstype_mask.py
+# observation type per derived variable for the prepbufr converters
+# (conventional_prepbufr_ps, adpupa_prepbufr, acft_profiles_prepbufr):
+# the report type where the variable has a value and the type's fill value
+# where it is missing, for all the variables of a report in one operation.
+# test/bufr2ioda/prepbufr_loops.py benchmarks this against the
+# per-variable deepcopy and loop it replaces
+import numpy as np
+import numpy.ma as ma
+
+
+def Mask_typ_for_vars(typ, *variables):
+    """
+    One array per variable: typ, set to its fill value (unmasked) where the
+    variable is missing. The arrays are rows of a single block built with one
+    broadcast over all variables; a variable that is never missing gets typ
+    itself.
+    """
+    # a report is missing a variable if any of its values is masked
+    missing = np.empty((len(variables), typ.shape[0]), dtype=bool)
+    for k, var in enumerate(variables):
+        mask = ma.getmaskarray(var)
+        missing[k] = mask.any(axis=tuple(range(1, mask.ndim)))
+    shared = ~missing.any(axis=1)
+
+    data = np.where(missing, typ.fill_value, ma.getdata(typ))
+    if typ.mask is ma.nomask:
+        mask = ma.nomask
+    else:
+        # setting the fill value unmasks a masked type, the buffer of missing is reused
+        mask = np.logical_not(missing, out=missing)
+        mask &= typ.mask
+    block = ma.masked_array(data, mask=mask, fill_value=typ.fill_value)
+    return [typ if shared[k] else block[k] for k in range(len(variables))]
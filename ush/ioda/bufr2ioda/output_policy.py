@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# output_policy.py
+# HDF5 storage of the IODA files written by the converters: chunk size along
+# Location and Channel, deflate level and shuffle filter, e.g.
+# {"location_chunk": 10000, "deflate_level": 4, "shuffle": true}, given as
+# the output_policy entry of a converter config (run_bufr2ioda.py
+# --output-policy sets it for the python converters without one).
+# The policy is applied as the variables are created: create_obsspace opens
+# the output with a PolicyObsSpace, whose create_var hands the chunks and
+# compression of the policy to the IODA library. A library that does not
+# take them keeps its defaults, with a warning; without a policy the files
+# are written as before.
+# Run as a script it benchmarks policies on an existing IODA file, reporting
+# the write time against the file size, e.g.
+# output_policy.py gdas.t00z.sevcsr.tm00.nc --deflate 0 1 4 --chunk 1000 100000
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+
+class OutputPolicy:
+    """
+    Storage of the IODA variables: chunks of location_chunk locations and
+    channel_chunk channels (a dimension without a chunk size is chunked
+    whole), compressed with deflate_level (0 or None: uncompressed) after the
+    shuffle filter if shuffle is set.
+    """
+
+    def __init__(self, location_chunk=None, channel_chunk=None, deflate_level=None, shuffle=False):
+        self.location_chunk = location_chunk
+        self.channel_chunk = channel_chunk
+        self.deflate_level = deflate_level
+        self.shuffle = shuffle
+        if deflate_level is not None and not 0 <= deflate_level <= 9:
+            raise ValueError(f"deflate_level must be in 0..9, not {deflate_level}")
+        for name, chunk in (('location_chunk', location_chunk), ('channel_chunk', channel_chunk)):
+            if chunk is not None and chunk < 1:
+                raise ValueError(f"{name} must be positive, not {chunk}")
+
+    @classmethod
+    def from_settings(cls, settings):
+        # None is the default policy
+        return cls(**(settings or {}))
+
+    def settings(self):
+        return {'location_chunk': self.location_chunk, 'channel_chunk': self.channel_chunk,
+                'deflate_level': self.deflate_level, 'shuffle': self.shuffle}
+
+    def is_default(self):
+        return self.location_chunk is None and self.channel_chunk is None and not self.deflate_level and not self.shuffle
+
+    def __str__(self):
+        return ', '.join(f"{name}={value}" for name, value in self.settings().items())
+
+    def chunksizes(self, dimensions, shape):
+        if self.location_chunk is None and self.channel_chunk is None:
+            return None
+        if 0 in shape:
+            # an empty variable is left to the library
+            return None
+        chunks = {'Location': self.location_chunk, 'Channel': self.channel_chunk}
+        return [min(chunks.get(name) or size, size) for name, size in zip(dimensions, shape)]
+
+    def create_options(self, dim_list, dim_sizes):
+        """
+        Keyword arguments of ObsSpace.create_var for a variable of the
+        dimensions dim_list, given the size of every dimension.
+        """
+        options = {}
+        chunks = self.chunksizes(dim_list, [dim_sizes[name] for name in dim_list])
+        if chunks is not None:
+            options['chunks'] = chunks
+        if self.deflate_level:
+            options['compression_level'] = self.deflate_level
+        if self.shuffle:
+            options['shuffle'] = True
+        return options
+
+    def write_copy(self, path, copy_path):
+        import netCDF4 as nc
+        with nc.Dataset(path, 'r') as src, nc.Dataset(copy_path, 'w', format='NETCDF4') as dst:
+            # copy the stored values and fill values as they are
+            src.set_auto_maskandscale(False)
+            self._copy_group(nc, src, dst)
+
+    def _copy_group(self, nc, src, dst):
+        dst.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+        for name, dim in src.dimensions.items():
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+        for var in src.variables.values():
+            self._copy_variable(nc, var, dst)
+        for name, group in src.groups.items():
+            self._copy_group(nc, group, dst.createGroup(name))
+
+    def _copy_variable(self, nc, var, dst):
+        attrs = {name: var.getncattr(name) for name in var.ncattrs()}
+        fill_value = attrs.pop('_FillValue', None)
+        options = {}
+        # filters do not apply to strings and other variable length data
+        if var.ndim > 0 and var.datatype is not str and not isinstance(var.datatype, nc.VLType):
+            if self.deflate_level:
+                options['zlib'] = True
+                options['complevel'] = self.deflate_level
+            options['shuffle'] = bool(self.shuffle)
+            chunksizes = self.chunksizes(var.dimensions, var.shape)
+            if chunksizes is not None:
+                options['chunksizes'] = chunksizes
+        out = dst.createVariable(var.name, var.datatype, var.dimensions, fill_value=fill_value, **options)
+        out.setncatts(attrs)
+        out[...] = var[...]
+
+
+# create_var arguments set by an output policy or a variable of the schema
+STORAGE_OPTIONS = ('chunks', 'compression_level', 'shuffle')
+
+
+class PolicyObsSpace:
+    """
+    An ObsSpace opened for writing whose variables are created with the
+    chunks and compression of policy; the options given to create_var
+    override those of the policy. If the IODA library does not take them,
+    the variables are created with its defaults and a warning is logged
+    once. Everything else is the ObsSpace.
+    """
+
+    def __init__(self, obsspace, policy, dim_sizes, logger=None):
+        self.obsspace = obsspace
+        self.policy = policy
+        self.dim_sizes = dim_sizes
+        self.logger = logger
+        self.storage_options = True
+
+    def create_var(self, name, dtype=np.float32, dim_list=None, fillval=None, **options):
+        dim_list = ['Location'] if dim_list is None else list(dim_list)
+        if self.storage_options:
+            options = dict(self.policy.create_options(dim_list, self.dim_sizes), **options)
+            if any(key in options for key in STORAGE_OPTIONS):
+                try:
+                    return self.obsspace.create_var(name, dtype=dtype, dim_list=dim_list, fillval=fillval, **options)
+                except TypeError as e:
+                    self.storage_options = False
+                    if self.logger is not None:
+                        self.logger.warning(f"ObsSpace.create_var does not take the output policy ({e}), "
+                                            f"the variables keep the IODA library defaults")
+        options = {key: value for key, value in options.items() if key not in STORAGE_OPTIONS}
+        return self.obsspace.create_var(name, dtype=dtype, dim_list=dim_list, fillval=fillval, **options)
+
+    def __getattr__(self, name):
+        return getattr(self.obsspace, name)
+
+
+def create_obsspace(path, dim_dict, settings=None, logger=None):
+    """
+    ObsSpace writing the IODA file path with the dimensions of dim_dict, its
+    variables created with the output policy settings (None: the defaults).
+    """
+    from pyioda import ioda_obs_space as ioda_ospace
+    policy = OutputPolicy.from_settings(settings)
+    obsspace = ioda_ospace.ObsSpace(path, mode='w', dim_dict=dim_dict)
+    if logger is not None and not policy.is_default():
+        logger.debug(f"{path}: output policy {policy}")
+    return PolicyObsSpace(obsspace, policy, {name: len(values) for name, values in dim_dict.items()}, logger)
+
+
+def benchmark(path, policies, logger):
+    """
+    Write path with every policy, log the write time and the size of the
+    result and return them as a list of dicts.
+    """
+    size = os.path.getsize(path)
+    logger.info(f"{path}: {size / 2**20:.2f} MB")
+    results = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for k, policy in enumerate(policies):
+            copy_path = os.path.join(tmpdir, f"{k}.nc")
+            start_time = time.time()
+            policy.write_copy(path, copy_path)
+            write_time = time.time() - start_time
+            copy_size = os.path.getsize(copy_path)
+            results.append(dict(policy.settings(), write_time=write_time, size=copy_size))
+            logger.info(f"{str(policy):<80} write {write_time:8.3f} s, {copy_size / 2**20:8.2f} MB "
+                        f"({100 * copy_size / size:6.1f}%)")
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('iodafile', type=str, help='IODA file to rewrite with every policy')
+    parser.add_argument('--chunk', type=int, nargs='+', default=[None], help='chunk sizes along Location')
+    parser.add_argument('--channel-chunk', type=int, nargs='+', default=[None], help='chunk sizes along Channel')
+    parser.add_argument('--deflate', type=int, nargs='+', default=[0, 1, 4, 9], help='deflate levels')
+    parser.add_argument('--shuffle', choices=['on', 'off', 'both'], default='both', help='shuffle filter')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file for the results')
+    args = parser.parse_args()
+
+    # the marine converters import this module without wxflow
+    from wxflow import Logger
+    logger = Logger('output_policy.py', level='INFO', colored_log=True)
+    shuffles = {'on': [True], 'off': [False], 'both': [False, True]}[args.shuffle]
+    policies = [OutputPolicy(location_chunk, channel_chunk, deflate_level, shuffle)
+                for location_chunk, channel_chunk, deflate_level, shuffle
+                in itertools.product(args.chunk, args.channel_chunk, args.deflate, shuffles)]
+    results = benchmark(args.iodafile, policies, logger)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
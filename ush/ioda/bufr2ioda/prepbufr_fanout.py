@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# prepbufr_fanout.py
+# decode the prepbufr file once per subset for all the conventional
+# converters reading it (conventional_prepbufr_ps, adpsfc_prepbufr,
+# sfcshp_prepbufr, adpupa_prepbufr): the queries the converters' build_query
+# add for a subset are merged into a single QuerySet, each distinct path
+# queried once, and every converter then reads its columns, under its own
+# names, from the shared ResultSet in forked workers
+import inspect
+import time
+from pyiodaconv import bufr
+from wxflow import Logger
+from bufr_fanout import record_queries, run_converters, fanout_main
+from converter_pool import load_converter
+from runtime_ledger import bufr_input_path
+from stage_timer import StageTimer
+
+# Initialize root logger
+logger = Logger('prepbufr_fanout.py', level='INFO', colored_log=True)
+
+
+class SubsetResultView:
+    """
+    A ResultSet shared by the converters of one subset, with the get/get_datetime
+    interface of bufr.ResultSet and the names used by one converter's build_query.
+    """
+
+    def __init__(self, result, names):
+        self.result = result
+        self.names = names
+
+    def _group_by(self, kwargs):
+        # group_by=, a query name, under its shared name
+        if kwargs.get('group_by') is not None:
+            kwargs['group_by'] = self.names[kwargs['group_by']]
+        return kwargs
+
+    def get(self, name, *group_by, **kwargs):
+        # group_by is given positionally by the converters, as a query name
+        return self.result.get(self.names[name], *[self.names[g] for g in group_by], **self._group_by(kwargs))
+
+    def get_datetime(self, *names, **kwargs):
+        return self.result.get_datetime(*[self.names[n] for n in names], **self._group_by(kwargs))
+
+
+def converter_queries(script, config):
+    """
+    {subset: [(name, path)]} of one converter: build_query(q, subset) builds one
+    QuerySet per subset, build_query(q) one QuerySet over its only subset.
+    """
+    build_query = load_converter(script).build_query
+    if len(inspect.signature(build_query).parameters) > 1:
+        return {subset: record_queries(script, subset) for subset in config['subsets']}
+    if len(config['subsets']) != 1:
+        raise ValueError(f"{script} queries {config['subsets']} in a single QuerySet")
+    return {config['subsets'][0]: record_queries(script)}
+
+
+def fanout(bufrfile, converters, workers=None, log_level='INFO'):
+    """
+    Convert bufrfile with a list of (obtype, script, config) converters,
+    decoding each subset once. Returns {obtype: status}.
+    """
+    # ============================================
+    # One QuerySet per subset, each path once
+    # ============================================
+    timer = StageTimer(__file__)
+    try:
+        timer.stage('query')
+        start_time = time.time()
+        paths = {}   # subset: {path: shared name}
+        names = {}   # (obtype, subset): {converter name: shared name}
+        for obtype, script, config in converters:
+            for subset, queries in converter_queries(script, config).items():
+                shared = paths.setdefault(subset, {})
+                names[(obtype, subset)] = {}
+                for name, path in queries:
+                    if path not in shared:
+                        taken = set(shared.values())
+                        shared[path] = name if name not in taken else f"{name}__{len(taken)}"
+                    names[(obtype, subset)][name] = shared[path]
+        logger.info(f"Built {len(paths)} QuerySets for {len(converters)} converters "
+                    f"in {time.time() - start_time:.3f} seconds")
+
+        # ============================================
+        # Decode each subset once
+        # ============================================
+        timer.stage('execute')
+        results = {}
+        for subset, shared in paths.items():
+            start_time = time.time()
+            q = bufr.QuerySet([subset])
+            for path, name in shared.items():
+                q.add(name, path)
+            with bufr.File(bufrfile) as f:
+                try:
+                    results[subset] = f.execute(q)
+                except Exception as err:
+                    logger.info(f'Return {subset} with {err}')
+                    continue
+            logger.info(f"Decoded {subset} ({len(shared)} paths) from {bufrfile} "
+                        f"in {time.time() - start_time:.3f} seconds")
+    finally:
+        # the shared decode is recorded on its own, also when it fails
+        timer.done(logger)
+
+    # ============================================
+    # Derive and write per converter
+    # ============================================
+    # same as the converters on their own: nothing is written when a subset failed to decode
+    status = {}
+    ready = []
+    for obtype, script, config in converters:
+        missing = [s for (o, s) in names if o == obtype and s not in results]
+        if missing:
+            logger.info(f"Skipping {obtype}, no ResultSet for {missing}")
+            status[obtype] = 'ok'
+        else:
+            ready.append((obtype, script, config))
+
+    scripts = {obtype: script for obtype, script, _ in ready}
+
+    def inputs(obtype, config):
+        # conventional_prepbufr_ps takes its ResultSets by subset, the others their only one
+        views = {s: SubsetResultView(results[s], n) for (o, s), n in names.items() if o == obtype}
+        if 'results' in inspect.signature(load_converter(scripts[obtype]).bufr_to_ioda).parameters:
+            return {'results': views}
+        return {'r': views[config['subsets'][0]]}
+
+    if ready:
+        status.update(run_converters(ready, inputs, workers, log_level))
+    return status
+
+
+def prepbufr_fanout(converters, workers=None, log_level='INFO'):
+    """
+    Convert a list of (obtype, script, config), decoding each subset of each BUFR input once.
+    Returns {obtype: status}.
+    """
+    by_input = {}
+    for converter in converters:
+        bufrfile = bufr_input_path(converter[2])
+        if bufrfile is None:
+            logger.info(f"No BUFR input for {converter[0]}")
+            continue
+        by_input.setdefault(bufrfile, []).append(converter)
+
+    status = {obtype: 'ok' for obtype, _, _ in converters}
+    for bufrfile, group in by_input.items():
+        status.update(fanout(bufrfile, group, workers, log_level))
+    return status
+
+
+if __name__ == '__main__':
+    fanout_main('prepbufr_fanout.py', prepbufr_fanout)
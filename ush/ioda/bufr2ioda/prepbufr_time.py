@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# prepbufr_time.py
+# cycle-relative time kernels shared by the prepbufr converters
+# (conventional_prepbufr_ps, adpsfc_prepbufr, acft_profiles_prepbufr,
+# adpupa_prepbufr), operating on whole masked arrays at once.
+# test/bufr2ioda/prepbufr_loops.py benchmarks them against the
+# per-observation loop they replace
+import numpy as np
+import numpy.ma as ma
+
+# dateTime of an observation without a time offset, a computed 0 is masked as well
+int64_fill_value = np.int64(0)
+
+
+def Compute_dateTime(cycleTimeSinceEpoch, dhr):
+    """
+    Seconds since epoch of observations dhr hours from the cycle time,
+    truncated to whole seconds. Masked, with fill value 0, where dhr is
+    masked or the result is 0.
+    """
+    seconds = (ma.filled(dhr, 0) * 3600).astype(np.int64) + cycleTimeSinceEpoch
+    dateTime = np.where(ma.getmaskarray(dhr), int64_fill_value, seconds)
+    return ma.masked_values(dateTime, int64_fill_value)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# record_filter.py
+# columnar selection of the records of a ResultSet: the predicate is
+# evaluated once over whole arrays and the same compaction is applied to
+# every column, keeping each column's dtype, mask and fill value, or
+# building the arrays exactly as the np.append loops it replaces did
+import numpy as np
+import numpy.ma as ma
+
+
+class RecordFilter:
+    """
+    The records of a subset accepted by one boolean predicate, e.g.
+    RecordFilter(typ < 200). Calling it with a column of the subset returns
+    the accepted rows of that column in order. A masked predicate rejects
+    the record.
+    """
+
+    def __init__(self, keep):
+        keep = ma.filled(keep, False)
+        self.size = keep.shape[0]
+        self.index = np.flatnonzero(keep)
+        # nothing rejected: the columns are returned as they are
+        self.all = len(self.index) == self.size
+
+    def __len__(self):
+        return len(self.index)
+
+    def __call__(self, column):
+        if column.shape[0] != self.size:
+            raise ValueError(f"Column has {column.shape[0]} records, the filter {self.size}")
+        if self.all:
+            return column
+        return column[self.index]
+
+    def appended(self, initial, column):
+        """
+        The accepted rows of column appended to initial, as built by a loop
+        of np.append(initial, column[i]): the result has no masked entry, a
+        masked one is appended as np.asarray(ma.masked), a float64 0, which
+        promotes the result. Nothing accepted returns initial.
+        """
+        rows = self(column)
+        if len(rows) == 0:
+            return initial
+        values = ma.getdata(rows)
+        if values.dtype == object:
+            # every element was appended as the array np.asarray made of it
+            values = np.array(values.tolist())
+        mask = ma.getmaskarray(rows)
+        if not mask.any():
+            return np.append(initial, values)
+        # and turns the result into a MaskedArray without a mask
+        appended = ma.masked_array(np.append(np.append(initial, values), np.zeros(0)))
+        appended[len(initial):][mask] = np.float64(0)
+        return appended
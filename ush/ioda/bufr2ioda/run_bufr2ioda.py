@@ -1,14 +1,26 @@
 #!/usr/bin/env python3
 import argparse
 import glob
+import json
 import multiprocessing as mp
 import os
+import queue
 import shutil
+import tempfile
+import time
+import yaml
 from itertools import repeat
 from pathlib import Path
-from gen_bufr2ioda_json import gen_bufr_json
-from gen_bufr2ioda_yaml import gen_bufr_yaml
-from wxflow import (Logger, Executable, cast_as_dtype, logit,
+from gen_bufr2ioda_batch import gen_bufr_batch
+from gen_bufr2ioda_json import write_bufr_json
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from converter_pool import converter_executor, run_converter
+from conversion_manifest import ConversionManifest, conversion_key, output_pattern
+from runtime_ledger import RuntimeLedger, bufr_input_size, run_measured, critical_path_report
+from stage_timer import STAGE_DIR_ENV, load_stage_records, stage_report
+from output_policy import OutputPolicy
+from wxflow import (Logger, cast_as_dtype, logit,
                     to_datetime, datetime_to_YMDH, Task, rm_p)
 
 # Initialize root logger
@@ -17,20 +29,138 @@ logger = Logger('run_bufr2ioda.py', level='INFO', colored_log=True)
 # get parallel processing info
 num_cores = mp.cpu_count()
 
+# default number of converters a pool worker runs before it is replaced
+default_tasks_per_worker = 8
 
-def mp_bufr_converter(exename, configfile):
-    cmd = Executable(exename)
-    filetype = Path(configfile).suffix
-    if filetype == '.json':
-        cmd.add_default_arg('-c')
-    cmd.add_default_arg(configfile)
-    logger.info(f"Executing {cmd}")
-    cmd()
+# python converters reading the same BUFR file, run as one job by a fan-out
+# script that decodes the file once for all of them
+fanout_groups = {
+    'satwnd_amv': ('satwnd_amv_fanout.py', ['satwnd_amv_ahi', 'satwnd_amv_avhrr', 'satwnd_amv_goes',
+                                            'satwnd_amv_leogeo', 'satwnd_amv_modis', 'satwnd_amv_seviri',
+                                            'satwnd_amv_viirs']),
+    'prepbufr': ('prepbufr_fanout.py', ['conventional_prepbufr_ps', 'adpsfc_prepbufr', 'sfcshp_prepbufr',
+                                        'adpupa_prepbufr']),
+}
+
+
+def mp_bufr_converter(obtype, exename, configfile, members=()):
+    cmd = [exename]
+    peak_rss_file = None
+    if members:
+        # fan-out scripts take one obtype and config per converter, and report
+        # the peak RSS of their forked workers together, which the rusage of
+        # the script does not
+        for member in members:
+            cmd += ['-c', member['obtype'], member['configfile']]
+        fd, peak_rss_file = tempfile.mkstemp(prefix=f"{obtype}.", suffix='.rss.json')
+        os.close(fd)
+        cmd += ['--peak-rss-file', peak_rss_file]
+    else:
+        filetype = Path(configfile).suffix
+        if filetype == '.json':
+            cmd.append('-c')
+        cmd.append(configfile)
+    logger.info(f"Executing {' '.join(cmd)}")
+    status = 'ok'
+    start = time.time()
+    peak_rss = 0
+    try:
+        returncode, peak_rss = run_measured(cmd)
+        if returncode != 0:
+            raise RuntimeError(f"{exename} exited with {returncode}")
+    except Exception as e:
+        logger.error(f"{obtype} failed: {e}")
+        status = 'failed'
+    end = time.time()
+    if peak_rss_file is not None:
+        try:
+            with open(peak_rss_file, 'r') as f:
+                peak_rss = max(peak_rss, json.load(f)['peak_rss'])
+        except (OSError, ValueError, KeyError):
+            pass
+        os.remove(peak_rss_file)
+    return {'obtype': obtype, 'start': start, 'end': end, 'wall_time': end - start,
+            'peak_rss': peak_rss, 'status': status}
+
+
+def run_job(job):
+    # python converters run in the worker itself when their config was handed over,
+    # everything else (bufr2ioda.x YAML jobs, the fan-out groups) through its own executable
+    if job.get('config') is not None:
+        return run_converter(job['obtype'], job['exename'], job['config'])
+    return mp_bufr_converter(job['obtype'], job['exename'], job['configfile'], job.get('members', ()))
+
+
+def fanout_job(group, exename, members):
+    # one job decoding a BUFR file once for all the converters of a fan-out group
+    return {'obtype': group, 'exename': exename, 'configfile': None, 'config': None,
+            'members': members, 'input_size': max(m['input_size'] for m in members),
+            'key': None, 'outputs': None}
+
+
+def parse_size(size):
+    # '64G' -> bytes, binary units
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def run_admitted(pool, jobs, slots, max_rss=None):
+    """
+    Run jobs on the pool, an executor, at most slots at a time and, with a memory budget,
+    only while the estimated peak RSS of the running jobs fits in max_rss.
+    Jobs are started in the given order, a later job that fits may start
+    ahead of one that does not, and a job larger than the whole budget
+    starts once nothing else is running. Returns the records in job order.
+    """
+    done = queue.Queue()
+    pending = list(range(len(jobs)))
+    running = {}
+    records = [None] * len(jobs)
+    committed_max = 0
+    while pending or running:
+        committed = sum(running.values())
+        for i in list(pending):
+            if len(running) >= slots:
+                break
+            rss = jobs[i]['rss_estimate']
+            if max_rss is not None and running and committed + rss > max_rss:
+                continue
+            pending.remove(i)
+            running[i] = rss
+            committed += rss
+            try:
+                future = pool.submit(run_job, jobs[i])
+            except BrokenProcessPool as e:
+                # a worker died, e.g. killed by the OOM killer: the rest of the jobs fail
+                done.put((i, e))
+                continue
+            future.add_done_callback(lambda future, i=i: done.put((i, future.exception() or future.result())))
+        committed_max = max(committed_max, committed)
+        if max_rss is not None and pending and len(running) < slots:
+            logger.info(f"{len(pending)} obtypes waiting for memory, "
+                        f"{committed / 2**30:.1f} GB of {max_rss / 2**30:.1f} GB committed")
+        i, record = done.get()
+        del running[i]
+        if isinstance(record, Exception):
+            logger.error(f"{jobs[i]['obtype']} failed: {record}")
+            now = time.time()
+            record = {'obtype': jobs[i]['obtype'], 'start': now, 'end': now, 'wall_time': 0.0,
+                      'peak_rss': 0, 'status': 'failed'}
+        records[i] = record
+    if max_rss is not None:
+        logger.info(f"Largest estimated peak RSS committed at once: {committed_max / 2**30:.1f} GB")
+    return records
 
 
 @logit(logger)
-def bufr2ioda(current_cycle, RUN, DMPDIR, config_template_dir, COM_OBS):
+def bufr2ioda(current_cycle, RUN, DMPDIR, config_template_dir, COM_OBS, ledger_file=None, in_process=True,
+              tasks_per_worker=default_tasks_per_worker, incremental=False, force=(), dry_run=False, digest=False,
+              fanout=True, max_rss=None, output_policy=None):
     logger.info(f"Process {current_cycle} {RUN} from {DMPDIR} to {COM_OBS} using {config_template_dir}")
+    setup_start = time.time()
 
     # Get gdasapp root directory
     DIR_ROOT = os.path.realpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../.."))
@@ -41,6 +171,11 @@ def bufr2ioda(current_cycle, RUN, DMPDIR, config_template_dir, COM_OBS):
     # Create output directory if it doesn't exist
     os.makedirs(COM_OBS, exist_ok=True)
 
+    # Runtime ledger from previous cycles, used to schedule the longest obtypes first
+    if ledger_file is None:
+        ledger_file = os.path.join(COM_OBS, 'bufr2ioda_runtime_ledger.json')
+    ledger = RuntimeLedger(ledger_file)
+
     # Load configuration
     config = {
         'RUN': RUN,
@@ -60,52 +195,142 @@ def bufr2ioda(current_cycle, RUN, DMPDIR, config_template_dir, COM_OBS):
     BUFR_py_files = [os.path.basename(f) for f in BUFR_py_files]
     BUFR_py = [f.replace('bufr2ioda_', '').replace('.py', '') for f in BUFR_py_files]
 
-    config_files = []
-    exename = []
+    # Specify observation types to be processed by the bufr2ioda executable
+    BUFR_yaml_files = glob.glob(os.path.join(config_template_dir, '*.yaml'))
+    BUFR_yaml_files = [os.path.basename(f) for f in BUFR_yaml_files]
+    BUFR_yaml = [f.replace('bufr2ioda_', '').replace('.yaml', '') for f in BUFR_yaml_files]
+
+    # Render all configs in one pass with the templates compiled once per process
+    jobs = []
+    requests = []
     for obtype in BUFR_py:
         logger.info(f"Convert {obtype}...")
         json_output_file = os.path.join(DATA, f"{obtype}_{datetime_to_YMDH(current_cycle)}.json")
         filename = 'bufr2ioda_' + obtype + '.json'
-        template = os.path.join(config_template_dir, filename)
-        gen_bufr_json(config, template, json_output_file)
+        requests.append((filename, config, json_output_file))
 
         # Use the converter script for the ob type
         bufr2iodapy = USH_IODA + '/bufr2ioda_' + obtype + ".py"
-
-        # append the values to the lists
-        config_files.append(json_output_file)
-        exename.append(bufr2iodapy)
-
-        # Check if the converter was successful
-        # if os.path.exists(json_output_file):
-        #     rm_p(json_output_file)
-
-    # Specify observation types to be processed by the bufr2ioda executable
-    BUFR_yaml_files = glob.glob(os.path.join(config_template_dir, '*.yaml'))
-    BUFR_yaml_files = [os.path.basename(f) for f in BUFR_yaml_files]
-    BUFR_yaml = [f.replace('bufr2ioda_', '').replace('.yaml', '') for f in BUFR_yaml_files]
+        jobs.append({'obtype': obtype, 'exename': bufr2iodapy, 'configfile': json_output_file, 'python': True})
 
     for obtype in BUFR_yaml:
         logger.info(f"Convert {obtype}...")
         yaml_output_file = os.path.join(DATA, f"{obtype}_{datetime_to_YMDH(current_cycle)}.yaml")
         filename = 'bufr2ioda_' + obtype + '.yaml'
-        template = os.path.join(config_template_dir, filename)
-        gen_bufr_yaml(config, template, yaml_output_file)
+        requests.append((filename, config, yaml_output_file))
 
         # use the bufr2ioda executable for the ob type
         bufr2iodaexe = BIN_GDAS + '/bufr2ioda.x'
+        jobs.append({'obtype': obtype, 'exename': bufr2iodaexe, 'configfile': yaml_output_file, 'python': False})
+
+    bufr_configs = gen_bufr_batch(config_template_dir, requests)
+
+    for job, bufr_config in zip(jobs, bufr_configs):
+        python = job.pop('python')
+        # a cycle-wide output policy goes to the python converters without one of their own
+        if python and output_policy is not None and 'output_policy' not in bufr_config:
+            bufr_config['output_policy'] = output_policy
+            write_bufr_json(bufr_config, job['configfile'])
+        # for in-process conversion the config is round tripped through JSON
+        # so the converter sees exactly what it would read from the file
+        job['config'] = json.loads(json.dumps(bufr_config)) if python and in_process else None
+        job['input_size'] = bufr_input_size(bufr_config)
+        job['key'] = conversion_key(bufr_config, job['exename'], digest) if incremental else None
+        job['outputs'] = output_pattern(job['obtype'], bufr_config)
 
-        # append the values to the lists
-        config_files.append(yaml_output_file)
-        exename.append(bufr2iodaexe)
+    # in incremental mode skip the obtypes whose input, config, converter and outputs are unchanged
+    if incremental:
+        manifest_file = os.path.join(COM_OBS, 'bufr2ioda_manifest.json')
+        manifest = ConversionManifest(manifest_file)
+        stale = []
+        for job in jobs:
+            reason = 'forced' if job['obtype'] in force else manifest.stale_reason(job['obtype'], job['key'])
+            if reason:
+                logger.info(f"{job['obtype']} is stale: {reason}")
+                stale.append(job)
+            else:
+                logger.info(f"{job['obtype']} is up to date, skipping")
+        jobs = stale
+        if dry_run:
+            logger.info(f"Dry run, stale obtypes: {[job['obtype'] for job in jobs]}")
+            return
+        if not jobs:
+            logger.info("All obtypes are up to date")
+            return
 
-        # Check if the converter was successful
-        # if os.path.exists(yaml_output_file):
-        #     rm_p(yaml_output_file)
+    # converters reading the same BUFR file: decode it once for all of them
+    for group, (script, obtypes) in fanout_groups.items():
+        members = [job for job in jobs if job['obtype'] in obtypes and job['exename'].endswith('.py')]
+        if fanout and len(members) > 1:
+            logger.info(f"Fan out one decode for {group} to {[job['obtype'] for job in members]}")
+            jobs = [job for job in jobs if job not in members]
+            jobs.append(fanout_job(group, os.path.join(USH_IODA, script), members))
+
+    # dispatch the most expensive obtypes first (longest processing time first)
+    jobs = ledger.order(jobs)
+    logger.info(f"Dispatch order: {[job['obtype'] for job in jobs]}")
+
+    # estimated footprint of each job from its past peaks; obtypes never seen get an equal share of the budget
+    for job in jobs:
+        job['rss_estimate'] = ledger.rss_estimate(job['obtype'], job['input_size'])
+        if job['rss_estimate'] is None:
+            job['rss_estimate'] = max_rss / num_cores if max_rss is not None else 0
+    logger.info(f"Serial setup before dispatch took {time.time() - setup_start:.3f} seconds")
+
+    # every converter saves its stage record here, the workers and their children inherit the environment
+    cycle = datetime_to_YMDH(current_cycle)
+    stage_dir = os.path.join(DATA, f"bufr2ioda_stages_{cycle}")
+    shutil.rmtree(stage_dir, ignore_errors=True)
+    os.environ[STAGE_DIR_ENV] = stage_dir
+
+    # check the cycle-wide output policy before converting anything
+    if output_policy is not None:
+        logger.info(f"Output policy: {OutputPolicy.from_settings(output_policy)}")
 
     # run everything in parallel
-    with mp.Pool(num_cores) as pool:
-        pool.starmap(mp_bufr_converter, zip(exename, config_files))
+    if in_process:
+        # long-lived workers that import the python converters once
+        scripts = [job['exename'] for job in jobs if job.get('config') is not None]
+        pool = converter_executor(num_cores, scripts, tasks_per_worker)
+    else:
+        # the workers only wait for their converter's process, which is measured on its own
+        pool = ProcessPoolExecutor(num_cores)
+    with pool:
+        records = run_admitted(pool, jobs, num_cores, max_rss)
+
+    # update the ledger and report the critical path
+    for job, record in zip(jobs, records):
+        record['estimate'] = job['estimate']
+        logger.debug(f"{job['obtype']}: peak RSS {record['peak_rss'] / 2**20:.1f} MB, "
+                     f"estimated {job['rss_estimate'] / 2**20:.1f} MB")
+        ledger.record(job['obtype'], cycle, record['wall_time'], record['peak_rss'],
+                      job['input_size'], record['status'])
+    ledger.save()
+    logger.info(f"Wrote runtime ledger {ledger_file}")
+
+    if incremental:
+        for job, record in zip(jobs, records):
+            for member in job.get('members', [job]):
+                if record['status'] == 'ok':
+                    manifest.update(member['obtype'], member['key'], member['outputs'], record['start'])
+                else:
+                    manifest.remove(member['obtype'])
+        manifest.save()
+        logger.info(f"Wrote conversion manifest {manifest_file}")
+    critical_path_report(records, logger)
+
+    # merge the stage records of the converters into one report for the cycle
+    report = stage_report(load_stage_records(stage_dir), logger)
+    report_file = os.path.join(COM_OBS, f"bufr2ioda_stage_report_{cycle}.json")
+    tmpfile = f"{report_file}.{os.getpid()}.tmp"
+    with open(tmpfile, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmpfile, report_file)
+    logger.info(f"Wrote stage report {report_file}")
+
+    failed = [r['obtype'] for r in records if r['status'] != 'ok']
+    if failed:
+        raise RuntimeError(f"bufr2ioda failed for obtypes: {failed}")
 
 
 if __name__ == "__main__":
@@ -115,5 +340,34 @@ if __name__ == "__main__":
     parser.add_argument('DMPDIR', type=Path, help='path to bufr dump files')
     parser.add_argument('config_template_dir', type=Path, help='path to templates')
     parser.add_argument('COM_OBS', type=Path, help='path to output ioda format dump files')
+    parser.add_argument('--ledger', type=str, default=None,
+                        help='runtime ledger file, defaults to COM_OBS/bufr2ioda_runtime_ledger.json')
+    parser.add_argument('--executable', action='store_true',
+                        help='run every python converter in its own interpreter instead of in the worker pool')
+    parser.add_argument('--tasks-per-worker', type=int, default=default_tasks_per_worker,
+                        help='number of converters a pool worker runs before it is recycled')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip obtypes whose BUFR input, config, converter and IODA outputs are unchanged')
+    parser.add_argument('--force', action='append', default=[], metavar='OBTYPE',
+                        help='convert this obtype even if it is up to date (repeatable, implies --incremental)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the stale obtypes and exit (implies --incremental)')
+    parser.add_argument('--digest', action='store_true',
+                        help='include a sha256 of the BUFR input in the incremental key')
+    parser.add_argument('--no-fanout', action='store_true',
+                        help='run the satwnd AMV and prepbufr converters separately instead of from one decode of their input')
+    parser.add_argument('--max-rss', type=parse_size, default=None, metavar='SIZE',
+                        help='memory budget, e.g. 64G: start a converter only when its estimated peak RSS fits')
+    parser.add_argument('--output-policy', type=str, default=None, metavar='FILE',
+                        help='JSON or YAML file with the chunking and compression of the IODA outputs of the python converters '
+                             'whose config has no output_policy, see output_policy.py')
     args = parser.parse_args()
-    bufr2ioda(args.current_cycle, args.RUN, args.DMPDIR, args.config_template_dir, args.COM_OBS)
+    output_policy = None
+    if args.output_policy:
+        with open(args.output_policy, 'r') as f:
+            output_policy = yaml.safe_load(f)
+    incremental = args.incremental or args.dry_run or bool(args.force)
+    bufr2ioda(args.current_cycle, args.RUN, args.DMPDIR, args.config_template_dir, args.COM_OBS, args.ledger,
+              in_process=not args.executable, tasks_per_worker=args.tasks_per_worker,
+              incremental=incremental, force=args.force, dry_run=args.dry_run, digest=args.digest,
+              fanout=not args.no_fanout, max_rss=args.max_rss, output_policy=output_policy)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# runtime_ledger.py
+# persist per-obtype wall time, peak memory and input size of the
+# bufr2ioda converters from one cycle to the next, so that
+# run_bufr2ioda.py can dispatch the most expensive obtypes first,
+# keep the converters running at once within a memory budget,
+# and report which obtype set the wall time of the cycle
+import json
+import os
+import resource
+import subprocess
+import time
+
+LEDGER_VERSION = 1
+# number of past cycles kept for each obtype
+MAX_HISTORY = 5
+# weight of a past peak RSS relative to the one after it
+RSS_DECAY = 0.5
+# bounds of the input size ratio a past peak RSS is scaled with
+RSS_SCALE_MIN = 0.5
+RSS_SCALE_MAX = 2.0
+
+
+def bufr_input_path(config):
+    """
+    Best-effort lookup of the BUFR file a converter config reads.
+    Returns None if no candidate exists on disk.
+    """
+    # bufr2ioda.x YAML: the input file is given explicitly as obsdatain
+    obsdatain = _find_key(config, 'obsdatain')
+    if isinstance(obsdatain, str):
+        return obsdatain if os.path.isfile(obsdatain) else None
+
+    # python converters: rebuild the path the way the scripts do
+    try:
+        dump_dir = config["dump_directory"]
+        cycle_type = config["cycle_type"]
+        cycle = config["cycle_datetime"]
+    except (KeyError, TypeError):
+        return None
+    data_format = config.get("data_format", "")
+    data_type = config.get("data_type", "")
+    yyyymmdd = cycle[0:8]
+    hh = cycle[8:10]
+
+    # gnssro reads the gpsro dump
+    aliases = {'gnssro': 'gpsro'}
+    data_type = aliases.get(data_type, data_type)
+
+    candidates = [
+        f"{cycle_type}.t{hh}z.{data_type}.tm00.{data_format}",
+        f"{cycle_type}.t{hh}z.{data_type}.tm{hh}.{data_format}",
+        f"{cycle_type}.t{hh}z.{data_format}.acft_profiles",
+        f"{cycle_type}.t{hh}z.{data_format}",
+    ]
+    atmos_dir = os.path.join(dump_dir, f"{cycle_type}.{yyyymmdd}", str(hh), 'atmos')
+    for bufrfile in candidates:
+        path = os.path.join(atmos_dir, bufrfile)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def bufr_input_size(config):
+    path = bufr_input_path(config)
+    return os.path.getsize(path) if path else 0
+
+
+def run_measured(argv):
+    """
+    Run a command and return its exit code and the peak RSS in bytes of that
+    child alone, waited for by pid rather than taken from the usage of all
+    children of this process. The peak includes the descendants the child
+    waited for, but only the largest of them, not their sum.
+    """
+    process = subprocess.Popen(argv)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is reported in kilobytes on Linux
+    return process.returncode, rusage.ru_maxrss * 1024
+
+
+def peak_rss_reset():
+    """
+    Reset the peak RSS of this process (Linux >= 4.0), so that peak_rss_self
+    measures from here on. Returns False if the kernel does not allow it.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_self():
+    # VmHWM follows peak_rss_reset, ru_maxrss is the peak since the process started
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _find_key(config, key):
+    if isinstance(config, dict):
+        if key in config:
+            return config[key]
+        values = config.values()
+    elif isinstance(config, list):
+        values = config
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+class RuntimeLedger:
+    """
+    Small JSON ledger of converter runtimes, keyed by obtype.
+    Each obtype keeps the last MAX_HISTORY records of
+    (cycle, wall_time [s], peak_rss [bytes], input_size [bytes], status).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.obtypes = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    ledger = json.load(f)
+                if ledger.get('version') == LEDGER_VERSION:
+                    self.obtypes = ledger.get('obtypes', {})
+            except (OSError, ValueError):
+                # a corrupt ledger only costs us the ordering of one cycle
+                self.obtypes = {}
+
+    def history(self, obtype):
+        return self.obtypes.get(obtype, [])
+
+    def record(self, obtype, cycle, wall_time, peak_rss, input_size, status='ok'):
+        entry = {
+            'cycle': cycle,
+            'wall_time': round(wall_time, 3),
+            'peak_rss': int(peak_rss),
+            'input_size': int(input_size),
+            'status': status,
+        }
+        self.obtypes[obtype] = (self.history(obtype) + [entry])[-MAX_HISTORY:]
+
+    def seconds_per_byte(self, obtype):
+        samples = [(h['wall_time'], h['input_size']) for h in self.history(obtype)
+                   if h['status'] == 'ok' and h['input_size'] > 0]
+        if not samples:
+            return None
+        return sum(t for t, _ in samples) / sum(s for _, s in samples)
+
+    def estimate(self, obtype, input_size):
+        """
+        Estimated wall time in seconds of an obtype for the given input size,
+        or None if the ledger has never seen this obtype succeed.
+        """
+        rate = self.seconds_per_byte(obtype)
+        if rate is not None and input_size > 0:
+            return rate * input_size
+        ok = [h['wall_time'] for h in self.history(obtype) if h['status'] == 'ok']
+        if ok:
+            return sum(ok) / len(ok)
+        return None
+
+    def rss_estimate(self, obtype, input_size):
+        """
+        Estimated peak RSS in bytes of an obtype for the given input size,
+        or None if the ledger has no peak for it. Past peaks are scaled with
+        the input size, within RSS_SCALE_MIN and RSS_SCALE_MAX, and averaged
+        with weights decaying by RSS_DECAY per cycle, so that one outlier
+        fades out of the estimate instead of holding it up for good.
+        """
+        total = 0.0
+        weights = 0.0
+        weight = 1.0
+        for h in reversed(self.history(obtype)):
+            if h['status'] != 'ok' or h['peak_rss'] <= 0:
+                continue
+            scale = input_size / h['input_size'] if h['input_size'] > 0 and input_size > 0 else 1.0
+            total += weight * h['peak_rss'] * min(max(scale, RSS_SCALE_MIN), RSS_SCALE_MAX)
+            weights += weight
+            weight *= RSS_DECAY
+        return total / weights if weights else None
+
+    def order(self, jobs):
+        """
+        Sort jobs longest-first. Each job is a dict with at least
+        'obtype' and 'input_size'. Obtypes without history are costed from
+        their input size with the ledger-wide rate, and go first if even
+        that is unknown, since they may well be the long pole.
+        """
+        rates = [r for r in (self.seconds_per_byte(o) for o in self.obtypes) if r is not None]
+        default_rate = sum(rates) / len(rates) if rates else None
+
+        def cost(job):
+            estimate = self.estimate(job['obtype'], job['input_size'])
+            if estimate is None and default_rate is not None:
+                estimate = default_rate * job['input_size']
+            job['estimate'] = estimate
+            # unknown cost sorts first, ties broken by input size
+            return (estimate is not None, -(estimate or 0.0), -job['input_size'])
+
+        return sorted(jobs, key=cost)
+
+    def save(self):
+        ledger = {'version': LEDGER_VERSION, 'obtypes': self.obtypes}
+        tmpfile = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmpfile, 'w') as f:
+            json.dump(ledger, f, indent=2, sort_keys=True)
+        os.replace(tmpfile, self.path)
+
+
+def critical_path_report(records, logger, top=5):
+    """
+    Log which obtype finished last, and therefore set the cycle wall time,
+    together with the next longest poles. Each record carries absolute
+    'start' and 'end' times as returned by the pool workers.
+    """
+    if not records:
+        return
+    t0 = min(r['start'] for r in records)
+    wall_time = max(r['end'] for r in records) - t0
+    by_end = sorted(records, key=lambda r: r['end'], reverse=True)
+    critical = by_end[0]
+    logger.info(f"Cycle wall time {wall_time:.1f} s set by {critical['obtype']} "
+                f"(queued {critical['start'] - t0:.1f} s, ran {critical['wall_time']:.1f} s)")
+    logger.info(f"{'obtype':<40} {'queued':>8} {'run':>8} {'end':>8} {'slack':>8} {'peak MB':>9} {'estimate':>9}")
+    for r in by_end[:top]:
+        end = r['end'] - t0
+        estimate = '-' if r.get('estimate') is None else f"{r['estimate']:.1f}"
+        logger.info(f"{r['obtype']:<40} {r['start'] - t0:8.1f} {r['wall_time']:8.1f} {end:8.1f} "
+                    f"{wall_time - end:8.1f} {r['peak_rss'] / 2**20:9.1f} {estimate:>9}")
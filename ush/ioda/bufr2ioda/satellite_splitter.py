@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# satellite_splitter.py
+# split the observations of a satellite converter into one IODA file per
+# satellite: the observations are sorted by satellite id once, so that the
+# data of each satellite is a contiguous slice (a view) of the sorted
+# variables, and the per-satellite files are written concurrently by a
+# bounded pool of forked processes, which inherit the sorted data
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import numpy.ma as ma
+from wxflow import Logger
+
+# Initialize root logger
+logger = Logger('satellite_splitter.py', level='INFO', colored_log=True)
+
+# upper bound of the processes writing the files of one converter
+SPLIT_WORKERS_ENV = 'BUFR2IODA_SPLIT_WORKERS'
+default_split_workers = 4
+
+# write function of the current split, inherited by the forked workers
+_split = {}
+
+
+def _write(sat):
+    return _split['write'](sat)
+
+
+class SatelliteSplitter:
+    """
+    The observations of a converter in satellite order. Observations without
+    a satellite id belong to no satellite and are never written; with keep,
+    only the observations it accepts are sorted, a satellite without any is
+    still split, into an empty slice.
+    """
+
+    def __init__(self, satid, keep=None):
+        ids = ma.getdata(satid)
+        valid = ~ma.getmaskarray(satid)
+        self.satids = np.unique(ids[valid])
+        if keep is not None:
+            valid &= ma.filled(keep, False)
+        rows = np.flatnonzero(valid)
+        # a stable sort keeps the observations of a satellite in file order
+        self.order = rows[np.argsort(ids[rows], kind='stable')]
+        sorted_ids = ids[self.order]
+        starts = np.searchsorted(sorted_ids, self.satids, side='left')
+        ends = np.searchsorted(sorted_ids, self.satids, side='right')
+        self.slices = {sat: slice(start, end)
+                       for sat, start, end in zip(self.satids.tolist(), starts.tolist(), ends.tolist())}
+
+    def sort(self, *variables):
+        """
+        The variables in satellite order along their first axis, one copy each.
+        """
+        return [var[self.order] for var in variables]
+
+    def rows(self, sat):
+        """
+        The rows of satellite sat in the sorted variables.
+        """
+        return self.slices[sat]
+
+    def take(self, sat, *variables):
+        """
+        The rows of satellite sat of each of the sorted variables, as views,
+        in the order of the arguments.
+        """
+        rows = self.rows(sat)
+        return [var[rows] for var in variables]
+
+    def write(self, write, workers=None):
+        """
+        Call write(sat) for every satellite, in forked processes when this
+        process is allowed to have children. Returns the results that are not
+        None, in satellite order.
+        """
+        satids = self.satids.tolist()
+        if workers is None:
+            workers = int(os.environ.get(SPLIT_WORKERS_ENV, default_split_workers))
+        workers = min(workers, len(satids))
+        if workers > 1 and not mp.current_process().daemon:
+            _split['write'] = write
+            try:
+                with ProcessPoolExecutor(workers, mp_context=mp.get_context('fork')) as executor:
+                    results = list(executor.map(_write, satids))
+            finally:
+                _split.clear()
+        else:
+            if workers > 1:
+                logger.info("Running in a daemonic process, writing the satellites serially")
+            results = [write(sat) for sat in satids]
+        return [result for result in results if result is not None]
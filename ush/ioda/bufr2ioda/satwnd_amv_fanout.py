@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# satwnd_amv_fanout.py
+# decode the satwnd dump once for all the bufr2ioda_satwnd_amv_*.py converters:
+# the queries of every converter (its build_query) are qualified with each of
+# its subsets and executed as one QuerySet, the ResultSet is partitioned back
+# into one view per converter holding only the rows of its own subsets, and
+# each converter derives and writes its IODA files from that view, in
+# parallel forked workers when this process is allowed to have children
+import os
+import time
+import numpy as np
+import numpy.ma as ma
+from pyiodaconv import bufr
+from wxflow import Logger
+from bufr_fanout import record_queries, run_converters, fanout_main
+from runtime_ledger import bufr_input_path
+from stage_timer import StageTimer
+
+# Initialize root logger
+logger = Logger('satwnd_amv_fanout.py', level='INFO', colored_log=True)
+
+# set to compare the rows of every converter's view with a decode of its
+# own QuerySet, as the converter would run standalone (decodes twice)
+CHECK_ENV = 'BUFR2IODA_FANOUT_CHECK'
+
+
+def subset_path(subset, path):
+    # '*/...' matches in every subset of the QuerySet, 'NC005030/...' only in NC005030
+    if path.startswith('*/'):
+        return f"{subset}/{path[2:]}"
+    return path
+
+
+def subset_name(subset, name):
+    return f"{subset}__{name}"
+
+
+def subset_rows(result, subset, queries):
+    """
+    Rows of the shared ResultSet that come from subset: the paths are
+    qualified with the subset, so in the rows of any other subset all of them
+    are missing, and a row of this subset has at least one of them. Only
+    numeric queries are used, string elements are not masked when missing.
+    """
+    member = None
+    for name, _ in queries:
+        values = result.get(subset_name(subset, name))
+        if values.dtype.kind in 'OSU':
+            continue
+        present = ~ma.getmaskarray(values).reshape(len(values), -1).all(axis=1)
+        member = present if member is None else member | present
+    if member is None:
+        raise ValueError(f"No numeric query to tell the rows of subset {subset}")
+    return member
+
+
+def standalone_rows(bufrfile, script, subsets):
+    # number of rows of a converter decoding its own subsets
+    queries = record_queries(script)
+    q = bufr.QuerySet(subsets)
+    for name, path in queries:
+        q.add(name, path)
+    with bufr.File(bufrfile) as f:
+        return len(f.execute(q).get(queries[0][0]))
+
+
+class ResultSetView:
+    """
+    The rows of some subsets of a shared ResultSet, with the get/get_datetime
+    interface of bufr.ResultSet and the names used by one converter's build_query.
+    Arrays come back in file order and shaped as if the converter had executed
+    its own QuerySet over these subsets.
+    """
+
+    def __init__(self, result, subsets, rows):
+        self.result = result
+        self.subsets = subsets
+        self.rows = [rows[subset] for subset in subsets]
+        # position of the rows of each subset in the converter's arrays
+        member = np.logical_or.reduce(self.rows)
+        position = np.cumsum(member) - 1
+        self.positions = [position[r] for r in self.rows]
+        self.size = int(member.sum())
+
+    def _stitch(self, arrays):
+        parts = [a[r] for a, r in zip(arrays, self.rows)]
+        if len(parts) == 1:
+            return parts[0]
+        # a repeated element is as wide as its longest replication in any subset
+        shape = (self.size,) + tuple(max(dims) for dims in zip(*(p.shape[1:] for p in parts)))
+        if any(p.ndim != len(shape) for p in parts):
+            raise ValueError(f"Inconsistent dimensions across subsets {self.subsets}")
+        data = ma.masked_all(shape, dtype=parts[0].dtype)
+        data.fill_value = parts[0].fill_value
+        for part, position in zip(parts, self.positions):
+            data[(position,) + tuple(slice(0, n) for n in part.shape[1:])] = part
+        return data
+
+    def get(self, name, **kwargs):
+        return self._stitch([self.result.get(subset_name(s, name), **kwargs) for s in self.subsets])
+
+    def get_datetime(self, *names, **kwargs):
+        return self._stitch([self.result.get_datetime(*[subset_name(s, n) for n in names], **kwargs)
+                             for s in self.subsets])
+
+
+def fanout(bufrfile, converters, workers=None, log_level='INFO'):
+    """
+    Convert the satwnd dump bufrfile with a list of (obtype, script, config)
+    bufr2ioda_satwnd_amv_*.py converters from a single decode.
+    Returns {obtype: status}.
+    """
+    # ============================================
+    # Union of the queries of all converters
+    # ============================================
+    timer = StageTimer(__file__)
+    try:
+        timer.stage('query')
+        start_time = time.time()
+        queries = {}
+        for obtype, script, config in converters:
+            recorded = record_queries(script)
+            for subset in config['subsets']:
+                if subset in queries:
+                    raise ValueError(f"Subset {subset} of {obtype} is claimed by another converter")
+                queries[subset] = recorded
+        subsets = list(queries)
+        q = bufr.QuerySet(subsets)
+        for subset in subsets:
+            for name, path in queries[subset]:
+                q.add(subset_name(subset, name), subset_path(subset, path))
+        logger.info(f"Built one QuerySet over {len(subsets)} subsets for {len(converters)} converters "
+                    f"in {time.time() - start_time:.3f} seconds")
+
+        # ============================================
+        # Decode the dump once
+        # ============================================
+        timer.stage('execute')
+        start_time = time.time()
+        with bufr.File(bufrfile) as f:
+            try:
+                result = f.execute(q)
+            except Exception as err:
+                # same as the converters on their own: nothing to write
+                logger.info(f'Return with {err}')
+                return {obtype: 'ok' for obtype, _, _ in converters}
+        rows = {subset: subset_rows(result, subset, queries[subset]) for subset in subsets}
+        logger.info(f"Decoded {bufrfile} once in {time.time() - start_time:.3f} seconds")
+        for subset in subsets:
+            logger.debug(f"Subset {subset}: {int(rows[subset].sum())} rows")
+
+        # rows that no subset claims (every queried element missing) would be lost
+        # by the views: the converters then decode their own subsets
+        nrows = len(result.get(subset_name(subsets[0], queries[subsets[0]][0][0])))
+        unclaimed = nrows - sum(int(rows[subset].sum()) for subset in subsets)
+        standalone = set()
+        if unclaimed:
+            logger.warning(f"{unclaimed} of {nrows} rows of {bufrfile} not attributed to a subset, "
+                           f"converting without the shared decode")
+            standalone = {obtype for obtype, _, _ in converters}
+        elif os.environ.get(CHECK_ENV):
+            for obtype, script, config in converters:
+                fanout_size = int(np.logical_or.reduce([rows[subset] for subset in config['subsets']]).sum())
+                own_size = standalone_rows(bufrfile, script, config['subsets'])
+                if fanout_size != own_size:
+                    logger.error(f"{obtype}: {fanout_size} rows from the shared decode, {own_size} standalone, "
+                                 f"converting without the shared decode")
+                    standalone.add(obtype)
+    finally:
+        # the shared decode is recorded on its own, also when it fails
+        timer.done(logger)
+
+    # ============================================
+    # Derive and write per converter
+    # ============================================
+    def inputs(obtype, config):
+        if obtype in standalone:
+            return {}
+        return {'r': ResultSetView(result, config['subsets'], rows)}
+
+    return run_converters(converters, inputs, workers, log_level)
+
+
+def satwnd_amv_fanout(converters, workers=None, log_level='INFO'):
+    """
+    Convert a list of (obtype, script, config), decoding each BUFR input once.
+    Returns {obtype: status}.
+    """
+    by_input = {}
+    for converter in converters:
+        bufrfile = bufr_input_path(converter[2])
+        if bufrfile is None:
+            logger.info(f"No BUFR input for {converter[0]}")
+            continue
+        by_input.setdefault(bufrfile, []).append(converter)
+
+    status = {obtype: 'ok' for obtype, _, _ in converters}
+    for bufrfile, group in by_input.items():
+        status.update(fanout(bufrfile, group, workers, log_level))
+    return status
+
+
+if __name__ == '__main__':
+    fanout_main('satwnd_amv_fanout.py', satwnd_amv_fanout)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# stage_timer.py
+# per-stage wall time of one bufr2ioda converter run (query build, execute,
+# derive, filter, split, write) together with the number of obs read and
+# written, the IODA files written and the peak memory.
+# Every converter logs its record as JSON and, when run_bufr2ioda.py asks for
+# it through BUFR2IODA_STAGE_DIR, saves it there as <obtype>.json;
+# run_bufr2ioda.py then merges the records into one report for the cycle.
+import functools
+import glob
+import json
+import os
+import time
+from runtime_ledger import peak_rss_self
+
+STAGES = ('query', 'execute', 'derive', 'filter', 'split', 'write')
+
+# directory the records of a cycle are saved to, set by run_bufr2ioda.py
+STAGE_DIR_ENV = 'BUFR2IODA_STAGE_DIR'
+
+
+class StageTimer:
+    """
+    Lap timer over the stages of one converter run: stage(name) ends the
+    running stage and starts the next one, a stage entered more than once
+    (e.g. split and write per satellite) accumulates.
+    """
+
+    def __init__(self, obtype):
+        # a converter passes its __file__
+        self.obtype = os.path.basename(obtype).replace('bufr2ioda_', '').replace('.py', '')
+        self.start = time.time()
+        self.lap = self.start
+        self.current = None
+        self.stages = {}
+        self.n_in = 0
+        self.n_out = 0
+        self.outputs = []
+
+    def stage(self, name):
+        now = time.time()
+        if self.current is not None:
+            self.stages[self.current] = self.stages.get(self.current, 0.0) + now - self.lap
+        self.current = name
+        self.lap = now
+
+    def obs_in(self, n):
+        self.n_in += int(n)
+
+    def obs_out(self, n):
+        self.n_out += int(n)
+
+    def output(self, path, locations):
+        # locations: the Location dimension of the ObsSpace, a size or the coordinate array
+        self.outputs.append(path)
+        self.obs_out(locations if isinstance(locations, int) else len(locations))
+
+    def record(self):
+        end = time.time()
+        self.stage(None)
+        # files still open in the converter may not be flushed yet,
+        # run_bufr2ioda.py measures them again once the converter is done
+        return {
+            'obtype': self.obtype,
+            'start': self.start,
+            'end': end,
+            'wall_time': end - self.start,
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'obs_in': self.n_in,
+            'obs_out': self.n_out,
+            'outputs': self.outputs,
+            'bytes_written': bytes_written(self.outputs),
+            'peak_rss': peak_rss_self(),
+        }
+
+    def done(self, logger):
+        """
+        Close the running stage, log the record and save it to BUFR2IODA_STAGE_DIR if set.
+        """
+        record = self.record()
+        logger.info(f"Stage record: {json.dumps(record)}")
+        stage_dir = os.environ.get(STAGE_DIR_ENV)
+        if stage_dir:
+            os.makedirs(stage_dir, exist_ok=True)
+            path = os.path.join(stage_dir, f"{self.obtype}.json")
+            tmpfile = f"{path}.{os.getpid()}.tmp"
+            with open(tmpfile, 'w') as f:
+                json.dump(record, f, indent=2)
+            os.replace(tmpfile, path)
+        return record
+
+
+def timed(obtype):
+    """
+    Decorator of a converter's bufr_to_ioda(config, logger, timer, ...): the
+    call gets a new StageTimer, whose record is logged and saved however the
+    converter returns, early without input or on an exception.
+    """
+    def decorate(convert):
+        @functools.wraps(convert)
+        def wrapper(config, logger, *args, **kwargs):
+            timer = StageTimer(obtype)
+            try:
+                return convert(config, logger, timer, *args, **kwargs)
+            finally:
+                timer.done(logger)
+        return wrapper
+    return decorate
+
+
+def bytes_written(outputs):
+    return sum(os.path.getsize(f) for f in outputs if os.path.isfile(f))
+
+
+def load_stage_records(stage_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(stage_dir, '*.json'))):
+        try:
+            with open(path, 'r') as f:
+                records.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return records
+
+
+def stage_report(records, logger):
+    """
+    Merge the stage records of a cycle: log one line per obtype and the
+    totals per stage, and return the merged report as a dict.
+    """
+    for record in records:
+        record['bytes_written'] = bytes_written(record['outputs'])
+    totals = {name: sum(r['stages'].get(name, 0.0) for r in records) for name in STAGES}
+    report = {
+        'obtypes': {r['obtype']: r for r in records},
+        'stage_totals': totals,
+        'obs_in': sum(r['obs_in'] for r in records),
+        'obs_out': sum(r['obs_out'] for r in records),
+        'bytes_written': sum(r['bytes_written'] for r in records),
+    }
+
+    header = ' '.join(f"{name:>8}" for name in STAGES)
+    logger.info(f"{'obtype':<32} {header} {'obs in':>9} {'obs out':>9} {'MB out':>8} {'peak MB':>8}")
+    for r in sorted(records, key=lambda r: r['wall_time'], reverse=True):
+        stages = ' '.join(f"{r['stages'].get(name, 0.0):8.2f}" for name in STAGES)
+        logger.info(f"{r['obtype']:<32} {stages} {r['obs_in']:9d} {r['obs_out']:9d} "
+                    f"{r['bytes_written'] / 2**20:8.1f} {r['peak_rss'] / 2**20:8.1f}")
+    stages = ' '.join(f"{totals[name]:8.2f}" for name in STAGES)
+    logger.info(f"{'total':<32} {stages} {report['obs_in']:9d} {report['obs_out']:9d} "
+                f"{report['bytes_written'] / 2**20:8.1f}")
+    return report
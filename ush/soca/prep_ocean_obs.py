@@ -101,6 +101,7 @@ class PrepOceanObs(Task):
         COMIN_OBS = self.task_config.COMIN_OBS
         COMOUT_OBS = self.task_config['COMOUT_OBS']
         OCEAN_BASIN_FILE = self.task_config['OCEAN_BASIN_FILE']
+        prep_ocean_obs_utils.write_ocean_basin_cache(OCEAN_BASIN_FILE, BUFR2IODA_PY_DIR)
         if not os.path.exists(COMOUT_OBS):
             os.makedirs(COMOUT_OBS)
 
@@ -177,6 +178,11 @@ class PrepOceanObs(Task):
                                 output_files.append(ioda_filename)
                                 bufrconv_files.append((cycle, input_file, ioda_filename))
 
+                            # optionally, all the cycles are merged into one file for the window
+                            if obsprep_space.get('merge cycles', False):
+                                output_files = [f"{RUN}.t{cyc:02d}z.{obs_space_name}.{cdatestr}.nc4"]
+                                obsprep_space['merge output'] = output_files[0]
+
                             obsprep_space['output file'] = output_files
                             obsprep_space['bufrconv files'] = bufrconv_files
 
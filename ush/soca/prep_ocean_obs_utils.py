@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import os
 import fnmatch
+import importlib.util
 import subprocess
 from wxflow import FileHandler, Logger, YAMLFile
 
@@ -53,6 +54,26 @@ def obs_fetch(config, task_config, obsprep_space, cycles):
     return [(f[2], f[3]) for f in matching_files]
 
 
+# preprocesses the ocean basin nc file into the cache memory-mapped by the
+# bufr2ioda converters, unless a cache at least as recent as the nc file
+# exists; without it they read the nc file
+
+
+def write_ocean_basin_cache(ocean_basin_file, bufr2ioda_py_dir):
+    ocean_py = os.path.join(bufr2ioda_py_dir, 'b2iconverter', 'ocean.py')
+    try:
+        spec = importlib.util.spec_from_file_location('ocean', ocean_py)
+        ocean = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(ocean)
+        if ocean.basin_cache_current(ocean_basin_file):
+            logger.info(f"the ocean basin cache of {ocean_basin_file} is up to date")
+            return
+        ocean.write_basin_cache(ocean_basin_file)
+        logger.info(f"wrote the ocean basin cache of {ocean_basin_file}")
+    except Exception as e:
+        logger.warning(f"ocean basin preprocessing failed with error {e}")
+
+
 def run_netcdf_to_ioda(obsspace_to_convert, OCNOBS2IODAEXEC):
     logger.info(f"running run_netcdf_to_ioda on {obsspace_to_convert['name']}")
     iodaYamlFilename = obsspace_to_convert['conversion config file']
@@ -66,6 +87,21 @@ def run_netcdf_to_ioda(obsspace_to_convert, OCNOBS2IODAEXEC):
         return e.returncode
 
 
+# converts all the cycles of an obs space in one converter process, which
+# builds its QuerySet and reads the ocean basins once: the config lists the
+# (cycle, input file, output file) jobs, run by 'bufr2ioda workers' forked
+# workers (default 1), or merged into the single 'merge output' file of the
+# current cycle
+
+
+def bufr2ioda_env(bufr2iodapy):
+    # the marine converters import the modules they share with the bufr2ioda
+    # converters from ush/ioda/bufr2ioda, two directories above their own
+    bufr2ioda_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(bufr2iodapy)), '..', '..'))
+    pythonpath = [bufr2ioda_dir] + [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep) if p]
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+
+
 def run_bufr_to_ioda(obsspace_to_convert):
     logger.info(f"running run_bufr_to_ioda on {obsspace_to_convert['name']}")
     bufrconv_yaml = obsspace_to_convert['conversion config file']
@@ -73,14 +109,28 @@ def run_bufr_to_ioda(obsspace_to_convert):
     bufr2iodapy = obsspace_to_convert['bufr2ioda converter']
     obtype = obsspace_to_convert['name']
 
-    for cycle, input_file, output_file in obsspace_to_convert['bufrconv files']:
+    jobs = [list(job) for job in obsspace_to_convert['bufrconv files']]
+    if not jobs:
+        return
+    if 'merge output' in obsspace_to_convert:
+        # the config keeps the current cycle
+        bufrconv_config['output_file'] = obsspace_to_convert['merge output']
+        bufrconv_config['merge_output'] = obsspace_to_convert['merge output']
+    else:
+        # the first job fills the per-cycle entries the config requires
+        cycle, input_file, output_file = jobs[0]
         bufrconv_config['input_file'] = input_file
         bufrconv_config['output_file'] = output_file
         bufrconv_config['cycle_datetime'] = cycle
-        config_filename = f"{cycle}.{bufrconv_yaml}"
-        bufrconv_config.save(config_filename)
-        try:
-            subprocess.run(['python', bufr2iodapy, '-c', config_filename], check=True)
-        except subprocess.CalledProcessError as e:
-            logger.warning(f"bufr2ioda converter failed with error  >{e}<, \
-                return code {e.returncode}")
+    bufrconv_config['jobs'] = jobs
+    bufrconv_config['job_workers'] = obsspace_to_convert.get('bufr2ioda workers', 1)
+    if 'bufr2ioda stream messages' in obsspace_to_convert:
+        # large tanks are queried a bounded number of messages at a time
+        bufrconv_config['stream_messages'] = obsspace_to_convert['bufr2ioda stream messages']
+    config_filename = f"batch.{bufrconv_yaml}"
+    bufrconv_config.save(config_filename)
+    try:
+        subprocess.run(['python', bufr2iodapy, '-c', config_filename], check=True, env=bufr2ioda_env(bufr2iodapy))
+    except subprocess.CalledProcessError as e:
+        logger.warning(f"bufr2ioda converter failed with error  >{e}<, \
+            return code {e.returncode}")